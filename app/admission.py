@@ -0,0 +1,191 @@
+"""
+Admission control for the ingestion webhook.
+
+Providers deliver most syncs in a narrow window after people wake up. Instead
+of letting requests queue inside uvicorn until they time out (which triggers
+provider retries), ingestion is shed early:
+
+- A global concurrency limit caps in-flight ingests (503). It is checked by
+  `IngestionAdmissionMiddleware` before the body is read or validated, so a
+  shed request costs almost nothing.
+- A token bucket per `provider_slug` limits the sustained rate (429), once the
+  slug has been parsed from the request.
+- Alarm reads always get in and reserve part of the capacity, so ingestion
+  bursts never delay them.
+
+Both rejections carry a `Retry-After` header.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+
+# Buckets por proveedor en memoria: el slug lo envía el cliente, así que se acota
+_MAX_PROVIDER_BUCKETS = 1024
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated_at = clock()
+
+    def try_acquire(self) -> float:
+        """
+        Take one token if available.
+
+        Returns:
+            float: 0.0 if the token was taken, otherwise seconds until one is available.
+        """
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (1.0 - self._tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Tracks in-flight work and decides whether an ingest may start.
+
+    All state is mutated from the event loop thread only, so no locking is needed.
+    At most `max_buckets` provider buckets are kept; the least recently used one
+    is evicted first (a bucket idle for `burst / rate` seconds is full anyway).
+
+    Attributes:
+        ingest_in_flight: Ingestion requests currently being processed.
+        reads_in_flight: Priority (alarm) reads currently being processed.
+    """
+
+    def __init__(
+        self,
+        rate_per_provider: float,
+        burst_per_provider: int,
+        max_concurrency: int,
+        read_reserve: int,
+        retry_after_seconds: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        max_buckets: int = _MAX_PROVIDER_BUCKETS,
+    ):
+        self.rate_per_provider = rate_per_provider
+        self.burst_per_provider = burst_per_provider
+        self.max_concurrency = max_concurrency
+        self.read_reserve = read_reserve
+        self.retry_after_seconds = retry_after_seconds
+        self._clock = clock
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.ingest_in_flight = 0
+        self.reads_in_flight = 0
+
+    def _bucket(self, provider_slug: str) -> TokenBucket:
+        bucket = self._buckets.get(provider_slug)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._buckets.popitem(last=False)
+            bucket = TokenBucket(self.rate_per_provider, self.burst_per_provider, self._clock)
+            self._buckets[provider_slug] = bucket
+        else:
+            self._buckets.move_to_end(provider_slug)
+        return bucket
+
+    def acquire_ingestion_slot(self) -> None:
+        """
+        Take one global ingestion slot or raise immediately.
+
+        Raises:
+            HTTPException(503): Global capacity exhausted (or reserved for reads).
+        """
+        # Las lecturas de alarma consumen capacidad y la ingesta nunca usa la reserva
+        ingest_limit = self.max_concurrency - self.read_reserve
+        if (
+            self.ingest_in_flight >= ingest_limit
+            or self.ingest_in_flight + self.reads_in_flight >= self.max_concurrency
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor saturado, reintente más tarde",
+                headers={"Retry-After": str(self.retry_after_seconds)},
+            )
+        self.ingest_in_flight += 1
+
+    def check_provider_rate(self, provider_slug: str) -> None:
+        """
+        Take one token from the provider bucket or raise immediately.
+
+        Args:
+            provider_slug (str): Provider sending the webhook.
+
+        Raises:
+            HTTPException(429): Provider exceeded its rate.
+        """
+        wait_seconds = self._bucket(provider_slug).try_acquire()
+        if wait_seconds > 0:
+            retry_after = self.retry_after_seconds if math.isinf(wait_seconds) else max(1, math.ceil(wait_seconds))
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Límite de ingesta excedido para el proveedor '{provider_slug}'",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+    def release_ingestion(self) -> None:
+        self.ingest_in_flight = max(0, self.ingest_in_flight - 1)
+
+    def enter_read(self) -> None:
+        self.reads_in_flight += 1
+
+    def exit_read(self) -> None:
+        self.reads_in_flight = max(0, self.reads_in_flight - 1)
+
+
+class IngestionAdmissionMiddleware:
+    """
+    ASGI middleware holding a global ingestion slot for every POST under `prefix`.
+
+    Runs before routing, so overloaded requests are shed with 503 before their
+    body is read or validated. The slot is released when the response is done.
+    """
+
+    def __init__(self, app, prefix: str):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            admission_controller.acquire_ingestion_slot()
+        except HTTPException as e:
+            response = JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_controller.release_ingestion()
+
+
+admission_controller = AdmissionController(
+    rate_per_provider=settings.INGEST_RATE_PER_PROVIDER,
+    burst_per_provider=settings.INGEST_BURST_PER_PROVIDER,
+    max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+    read_reserve=settings.ADMISSION_READ_RESERVE,
+    retry_after_seconds=settings.ADMISSION_RETRY_AFTER_SECONDS,
+)
@@ -0,0 +1,194 @@
+"""
+Data loading for sleep analysis.
+
+Gathers everything the pure functions in `app.logic` need for a given sleep
+record, so the smart alarm endpoint and the background scheduler analyze a
+night exactly the same way.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.archive import get_spo2_summary
+from app.config import settings
+from app.database import to_naive_utc
+from app.merge import IntervalIndex, fuse_nights, fusion_cache, record_interval
+from app.models import CleanSleepData, SleepRecord, SmartAlarmResponse, VitalMetric
+from app.vitals import get_rollups
+import app.logic as logic
+
+# Margen de búsqueda de candidatas: una noche empieza como mucho 18 h antes de que otra termine
+_MERGE_LOOKAROUND = timedelta(hours=18)
+
+
+async def find_night_record(
+    session: AsyncSession,
+    user_id: UUID,
+    target_time: datetime,
+) -> Optional[SleepRecord]:
+    """
+    Return the most recent sleep record of a user that started before the alarm.
+
+    Args:
+        session (AsyncSession): Database session.
+        user_id (UUID): Owner of the records.
+        target_time (datetime): Alarm target time.
+
+    Returns:
+        Optional[SleepRecord]: The night to analyze, or None.
+    """
+    statement = (
+        select(SleepRecord)
+        .where(SleepRecord.user_id == user_id)
+        .where(SleepRecord.timestamp <= to_naive_utc(target_time))
+        .order_by(SleepRecord.timestamp.desc())
+        .limit(1)
+    )
+    return (await session.exec(statement)).first()
+
+
+def notify_new_data(user_id: UUID) -> None:
+    """
+    Invalidate everything derived from a user's data after an ingestion.
+
+    Drops the user's fused nights and marks their precomputed alarm
+    predictions as stale.
+    """
+    from app.scheduler import alarm_scheduler
+
+    fusion_cache.invalidate_user(user_id)
+    alarm_scheduler.notify_new_data(user_id)
+
+
+async def find_overlapping_records(session: AsyncSession, record: SleepRecord) -> List[SleepRecord]:
+    """
+    Return the user's records describing the same night as `record` (itself included).
+
+    Candidates are read with the (user_id, timestamp) index around the night.
+    The ones overlapping by at least `MERGE_MIN_OVERLAP` are then selected
+    with an interval index. Duplicate deliveries of the same provider record
+    are collapsed to the most recent one.
+
+    Raises:
+        DataParsingError: If the record timestamps cannot be parsed.
+    """
+    start_at, end_at = record_interval(record)
+    statement = (
+        select(SleepRecord)
+        .where(SleepRecord.user_id == record.user_id)
+        .where(SleepRecord.timestamp >= start_at - _MERGE_LOOKAROUND)
+        .where(SleepRecord.timestamp <= end_at)
+    )
+    candidates: Dict[UUID, SleepRecord] = {record.id: record}
+    for candidate in (await session.exec(statement)).all():
+        candidates.setdefault(candidate.id, candidate)
+
+    intervals = []
+    for candidate in candidates.values():
+        try:
+            intervals.append((*record_interval(candidate), candidate.id))
+        except logic.DataParsingError:
+            continue
+    overlapping = IntervalIndex(intervals).overlapping(start_at, end_at, min_ratio=settings.MERGE_MIN_OVERLAP)
+
+    latest_by_source: Dict[Tuple[str, str], SleepRecord] = {}
+    for record_id in overlapping:
+        candidate = candidates[record_id]
+        key = (candidate.provider_source, candidate.record_id_provider)
+        current = latest_by_source.get(key)
+        if current is None or candidate.created_at > current.created_at or candidate.id == record.id:
+            latest_by_source[key] = candidate
+    return list(latest_by_source.values()) or [record]
+
+
+async def _load_single_record(session: AsyncSession, record: SleepRecord) -> CleanSleepData:
+    clean_data = logic.parse_sleep_payload(record.payload)
+
+    # Resumen de la serie de SpO2 (sin cargar las muestras; también si está archivada)
+    spo2 = await get_spo2_summary(session, record.id)
+    if spo2 is not None:
+        clean_data.ODI, clean_data.desaturation_count = spo2
+
+    return clean_data
+
+
+async def load_clean_sleep_data(session: AsyncSession, record: SleepRecord) -> CleanSleepData:
+    """
+    Build the normalized view of a sleep record.
+
+    If other sources recorded the same night, returns the fused canonical
+    night (cached until one of the sources changes).
+
+    Args:
+        session (AsyncSession): Database session.
+        record (SleepRecord): Raw sleep record.
+
+    Returns:
+        CleanSleepData: Normalized data ready for `app.logic`.
+
+    Raises:
+        DataParsingError: If the raw payload cannot be parsed.
+    """
+    sources = await find_overlapping_records(session, record)
+    if len(sources) == 1:
+        return await _load_single_record(session, record)
+
+    key = tuple(sorted(source.id for source in sources))
+    cached = fusion_cache.get(key)
+    if cached is not None:
+        return cached.model_copy()
+
+    parsed: List[Tuple[SleepRecord, CleanSleepData]] = []
+    for source in sources:
+        try:
+            parsed.append((source, await _load_single_record(session, source)))
+        except logic.DataParsingError:
+            # Una fuente corrupta no invalida la noche; la pedida sí debe parsear
+            if source.id == record.id:
+                raise
+    fused = fuse_nights(parsed)
+    fusion_cache.put(key, record.user_id, fused)
+    return fused.model_copy()
+
+
+async def analyze_sleep_record(
+    session: AsyncSession,
+    record: SleepRecord,
+    target_time: datetime,
+) -> SmartAlarmResponse:
+    """
+    Run the full smart alarm analysis for a record and target time.
+
+    HRV rollups are read at 1-minute resolution for the alarm window and,
+    only if the payload lacks a nightly HRV, at 5-minute resolution for the
+    whole night.
+
+    Raises:
+        DataParsingError: If the raw payload cannot be parsed.
+    """
+    clean_data = await load_clean_sleep_data(session, record)
+
+    window_start = target_time - timedelta(minutes=logic.SMART_ALARM_WINDOW_MINUTES)
+    window_hrv = await get_rollups(
+        session, record.user_id, VitalMetric.HRV, window_start, target_time, resolution_s=60
+    )
+    night_hrv = None
+    if not clean_data.HRV:
+        night_hrv = await get_rollups(
+            session,
+            record.user_id,
+            VitalMetric.HRV,
+            clean_data.start_at_timestamp,
+            clean_data.end_at_timestamp,
+            resolution_s=300,
+        )
+
+    return logic.build_smart_alarm_response(
+        clean_data,
+        target_time,
+        window_hrv_rollup=window_hrv,
+        night_hrv_rollup=night_hrv,
+    )
@@ -0,0 +1,424 @@
+"""
+Time-based archival tier for old sleep records.
+
+Records older than `ARCHIVE_AFTER_DAYS` are moved out of the hot `sleep_records`
+table into per-month SQLite files (`ARCHIVE_DIR/sleep_records_YYYY-MM.db`).
+Their SpO2 series move to the same file. The hot database keeps only
+`sleep_record_archive_index` (id, user, timestamp, month), so the read helpers
+in this module can transparently fall back to the archive. Run the job with:
+
+    python -m app.archive [--older-than-days N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, select
+
+from app.config import settings
+from app.database import to_naive_utc
+from app.models import SleepRecord, SleepRecordArchiveIndex, SpO2Series
+
+logger = logging.getLogger(__name__)
+
+_ARCHIVE_COLUMNS = (
+    "id",
+    "user_id",
+    "timestamp",
+    "provider_source",
+    "record_id_provider",
+    "payload",
+    "created_at",
+    "ingest_request_id",
+)
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sleep_records (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    provider_source TEXT NOT NULL,
+    record_id_provider TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    ingest_request_id TEXT
+)
+"""
+
+_SPO2_ARCHIVE_COLUMNS = (
+    "sleep_record_id",
+    "start_at",
+    "interval_ms",
+    "sample_count",
+    "samples",
+    "odi",
+    "desaturation_count",
+    "desaturation_events",
+    "created_at",
+)
+
+_SPO2_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spo2_series (
+    sleep_record_id TEXT PRIMARY KEY,
+    start_at TEXT NOT NULL,
+    interval_ms INTEGER NOT NULL,
+    sample_count INTEGER NOT NULL,
+    samples BLOB NOT NULL,
+    odi REAL NOT NULL,
+    desaturation_count INTEGER NOT NULL,
+    desaturation_events TEXT NOT NULL,
+    created_at TEXT NOT NULL
+)
+"""
+
+
+def _archive_path(month: str) -> Path:
+    return Path(settings.ARCHIVE_DIR) / f"sleep_records_{month}.db"
+
+
+def _month_of(timestamp: datetime) -> str:
+    return f"{timestamp:%Y-%m}"
+
+
+def _record_to_row(record: SleepRecord) -> Tuple[Any, ...]:
+    return (
+        record.id.hex,
+        record.user_id.hex,
+        to_naive_utc(record.timestamp).isoformat(),
+        record.provider_source,
+        record.record_id_provider,
+        json.dumps(record.payload),
+        to_naive_utc(record.created_at).isoformat(),
+        record.ingest_request_id,
+    )
+
+
+def _row_to_record(row: Tuple[Any, ...]) -> SleepRecord:
+    values = dict(zip(_ARCHIVE_COLUMNS, row))
+    return SleepRecord(
+        id=UUID(values["id"]),
+        user_id=UUID(values["user_id"]),
+        timestamp=datetime.fromisoformat(values["timestamp"]),
+        provider_source=values["provider_source"],
+        record_id_provider=values["record_id_provider"],
+        payload=json.loads(values["payload"]),
+        created_at=datetime.fromisoformat(values["created_at"]),
+        ingest_request_id=values["ingest_request_id"],
+    )
+
+
+def _spo2_series_to_row(series: SpO2Series) -> Tuple[Any, ...]:
+    return (
+        series.sleep_record_id.hex,
+        to_naive_utc(series.start_at).isoformat(),
+        series.interval_ms,
+        series.sample_count,
+        series.samples,
+        series.odi,
+        series.desaturation_count,
+        json.dumps(series.desaturation_events),
+        to_naive_utc(series.created_at).isoformat(),
+    )
+
+
+# --- Archive file access (sync, executed in a worker thread) ---
+
+def _ensure_archive_schema(conn: sqlite3.Connection) -> None:
+    conn.execute(_ARCHIVE_SCHEMA)
+    # Archivos mensuales creados antes de la columna ingest_request_id
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(sleep_records)")}
+    if "ingest_request_id" not in columns:
+        conn.execute("ALTER TABLE sleep_records ADD COLUMN ingest_request_id TEXT")
+    conn.execute(_SPO2_ARCHIVE_SCHEMA)
+
+
+def _write_archive_rows(
+    month: str,
+    rows: List[Tuple[Any, ...]],
+    spo2_rows: Iterable[Tuple[Any, ...]] = (),
+) -> None:
+    path = _archive_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with sqlite3.connect(path) as conn:
+        _ensure_archive_schema(conn)
+        # INSERT OR REPLACE: el job es idempotente si se interrumpe antes de borrar del hot DB
+        conn.executemany(
+            f"INSERT OR REPLACE INTO sleep_records ({', '.join(_ARCHIVE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in _ARCHIVE_COLUMNS)})",
+            rows,
+        )
+        conn.executemany(
+            f"INSERT OR REPLACE INTO spo2_series ({', '.join(_SPO2_ARCHIVE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in _SPO2_ARCHIVE_COLUMNS)})",
+            list(spo2_rows),
+        )
+    conn.close()
+
+
+def _read_archive_rows(month: str, record_ids: Iterable[UUID]) -> List[SleepRecord]:
+    path = _archive_path(month)
+    ids = [record_id.hex for record_id in record_ids]
+    if not ids or not path.exists():
+        return []
+    with sqlite3.connect(path) as conn:
+        _ensure_archive_schema(conn)
+        cursor = conn.execute(
+            f"SELECT {', '.join(_ARCHIVE_COLUMNS)} FROM sleep_records "
+            f"WHERE id IN ({', '.join('?' for _ in ids)})",
+            ids,
+        )
+        records = [_row_to_record(row) for row in cursor]
+    conn.close()
+    return records
+
+
+def _read_archive_spo2_summary(month: str, record_id: UUID) -> Optional[Tuple[float, int]]:
+    path = _archive_path(month)
+    if not path.exists():
+        return None
+    with sqlite3.connect(path) as conn:
+        _ensure_archive_schema(conn)
+        row = conn.execute(
+            "SELECT odi, desaturation_count FROM spo2_series WHERE sleep_record_id = ?",
+            (record_id.hex,),
+        ).fetchone()
+    conn.close()
+    return tuple(row) if row else None
+
+
+# --- Archival job ---
+
+async def archive_old_records(
+    session: AsyncSession,
+    older_than_days: Optional[int] = None,
+    batch_size: int = 500,
+) -> int:
+    """
+    Move sleep records older than the cutoff into the monthly archive.
+
+    Each batch, with the SpO2 series of its records, is written to the archive
+    files first and only then removed from the hot tables, together with the
+    insertion of its index rows, in a single commit.
+
+    Args:
+        session (AsyncSession): Database session on the hot database.
+        older_than_days (Optional[int]): Age cutoff. Defaults to `ARCHIVE_AFTER_DAYS`.
+        batch_size (int): Records moved per transaction.
+
+    Returns:
+        int: Number of archived records.
+    """
+    days = settings.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    archived = 0
+
+    while True:
+        statement = (
+            select(SleepRecord)
+            .where(SleepRecord.timestamp < cutoff)
+            .order_by(SleepRecord.timestamp)
+            .limit(batch_size)
+        )
+        records = (await session.exec(statement)).all()
+        if not records:
+            break
+
+        ids = [record.id for record in records]
+        month_by_id = {record.id: _month_of(record.timestamp) for record in records}
+        rows_by_month: Dict[str, List[Tuple[Any, ...]]] = defaultdict(list)
+        for record in records:
+            rows_by_month[month_by_id[record.id]].append(_record_to_row(record))
+        spo2_rows_by_month: Dict[str, List[Tuple[Any, ...]]] = defaultdict(list)
+        spo2_statement = select(SpO2Series).where(SpO2Series.sleep_record_id.in_(ids))
+        for series in (await session.exec(spo2_statement)).all():
+            spo2_rows_by_month[month_by_id[series.sleep_record_id]].append(_spo2_series_to_row(series))
+        for month, rows in rows_by_month.items():
+            await asyncio.to_thread(_write_archive_rows, month, rows, spo2_rows_by_month.get(month, []))
+
+        for record in records:
+            session.add(
+                SleepRecordArchiveIndex(
+                    id=record.id,
+                    user_id=record.user_id,
+                    timestamp=record.timestamp,
+                    archive_month=_month_of(record.timestamp),
+                )
+            )
+        await session.exec(delete(SpO2Series).where(SpO2Series.sleep_record_id.in_(ids)))
+        await session.exec(delete(SleepRecord).where(SleepRecord.id.in_(ids)))
+        await session.commit()
+        session.expunge_all()
+
+        archived += len(records)
+        logger.info("Archived %s sleep records (total %s)", len(records), archived)
+
+    return archived
+
+
+# --- Read paths with archive fallback ---
+
+async def get_sleep_record(session: AsyncSession, record_id: UUID) -> Optional[SleepRecord]:
+    """
+    Fetch a sleep record by id from the hot table, falling back to the archive.
+
+    Args:
+        session (AsyncSession): Database session.
+        record_id (UUID): ID of the sleep record.
+
+    Returns:
+        Optional[SleepRecord]: The record (detached if archived) or None.
+    """
+    result = await session.exec(select(SleepRecord).where(SleepRecord.id == record_id))
+    record = result.first()
+    if record:
+        return record
+
+    index_entry = await session.get(SleepRecordArchiveIndex, record_id)
+    if not index_entry:
+        return None
+    archived = await asyncio.to_thread(_read_archive_rows, index_entry.archive_month, [record_id])
+    return archived[0] if archived else None
+
+
+async def get_spo2_summary(session: AsyncSession, record_id: UUID) -> Optional[Tuple[float, int]]:
+    """
+    Return the (ODI, desaturation count) of a record's SpO2 series, without
+    loading the samples, falling back to the archive.
+
+    Args:
+        session (AsyncSession): Database session.
+        record_id (UUID): ID of the sleep record.
+
+    Returns:
+        Optional[Tuple[float, int]]: The summary, or None if the record has no series.
+    """
+    statement = select(SpO2Series.odi, SpO2Series.desaturation_count).where(
+        SpO2Series.sleep_record_id == record_id
+    )
+    summary = (await session.exec(statement)).first()
+    if summary is not None:
+        return tuple(summary)
+
+    index_entry = await session.get(SleepRecordArchiveIndex, record_id)
+    if not index_entry:
+        return None
+    return await asyncio.to_thread(_read_archive_spo2_summary, index_entry.archive_month, record_id)
+
+
+async def list_sleep_records(
+    session: AsyncSession,
+    user_id: UUID,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[Tuple[SleepRecord, bool]]:
+    """
+    List a user's sleep records in a time range, merging hot and archived data.
+
+    Archived records are only read from the monthly files referenced by the
+    hot index, so recent ranges never touch the archive.
+
+    Args:
+        session (AsyncSession): Database session.
+        user_id (UUID): Owner of the records.
+        since (Optional[datetime]): Inclusive lower bound on `timestamp`.
+        until (Optional[datetime]): Exclusive upper bound on `timestamp`.
+
+    Returns:
+        List[Tuple[SleepRecord, bool]]: (record, archived) pairs ordered by timestamp.
+    """
+    hot_statement = select(SleepRecord).where(SleepRecord.user_id == user_id)
+    index_statement = select(SleepRecordArchiveIndex).where(SleepRecordArchiveIndex.user_id == user_id)
+    if since is not None:
+        hot_statement = hot_statement.where(SleepRecord.timestamp >= to_naive_utc(since))
+        index_statement = index_statement.where(SleepRecordArchiveIndex.timestamp >= to_naive_utc(since))
+    if until is not None:
+        hot_statement = hot_statement.where(SleepRecord.timestamp < to_naive_utc(until))
+        index_statement = index_statement.where(SleepRecordArchiveIndex.timestamp < to_naive_utc(until))
+
+    results: List[Tuple[SleepRecord, bool]] = []
+
+    ids_by_month: Dict[str, List[UUID]] = defaultdict(list)
+    for entry in (await session.exec(index_statement)).all():
+        ids_by_month[entry.archive_month].append(entry.id)
+    for month in sorted(ids_by_month):
+        archived = await asyncio.to_thread(_read_archive_rows, month, ids_by_month[month])
+        results.extend((record, True) for record in archived)
+
+    results.extend((record, False) for record in (await session.exec(hot_statement)).all())
+    results.sort(key=lambda item: to_naive_utc(item[0].timestamp))
+    return results
+
+
+async def stream_sleep_records(
+    session: AsyncSession,
+    user_id: UUID,
+    chunk_size: int = 500,
+) -> AsyncIterator[List[SleepRecord]]:
+    """
+    Stream all of a user's sleep records in chunks, archived ones first.
+
+    Both the archive index and the hot table are read through server-side
+    cursors, so memory use is bounded by `chunk_size` regardless of history
+    length.
+
+    Args:
+        session (AsyncSession): Database session.
+        user_id (UUID): Owner of the records.
+        chunk_size (int): Records per yielded chunk.
+
+    Yields:
+        List[SleepRecord]: Records ordered by timestamp within each tier.
+    """
+    index_statement = (
+        select(SleepRecordArchiveIndex)
+        .where(SleepRecordArchiveIndex.user_id == user_id)
+        .order_by(SleepRecordArchiveIndex.timestamp)
+        .execution_options(yield_per=chunk_size)
+    )
+    index_result = await session.stream(index_statement)
+    async for entries in index_result.scalars().partitions(chunk_size):
+        ids_by_month: Dict[str, List[UUID]] = defaultdict(list)
+        for entry in entries:
+            ids_by_month[entry.archive_month].append(entry.id)
+        chunk: List[SleepRecord] = []
+        for month in sorted(ids_by_month):
+            chunk.extend(await asyncio.to_thread(_read_archive_rows, month, ids_by_month[month]))
+        chunk.sort(key=lambda record: record.timestamp)
+        yield chunk
+
+    hot_statement = (
+        select(SleepRecord)
+        .where(SleepRecord.user_id == user_id)
+        .order_by(SleepRecord.timestamp)
+        .execution_options(yield_per=chunk_size)
+    )
+    hot_result = await session.stream(hot_statement)
+    async for records in hot_result.scalars().partitions(chunk_size):
+        yield list(records)
+        session.expunge_all()
+
+
+# --- CLI ---
+
+async def _main(older_than_days: Optional[int]) -> None:
+    from app.database import async_session_maker, engine
+
+    async with async_session_maker() as session:
+        archived = await archive_old_records(session, older_than_days=older_than_days)
+    print(f"Archived {archived} sleep records")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old sleep records to the monthly archive")
+    parser.add_argument("--older-than-days", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(_main(args.older_than_days))
@@ -3,6 +3,8 @@ Configuration settings for WeSleep API.
 
 Using Pydantic BaseSettings to manage environment variables.
 """
+from typing import Dict, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -13,12 +15,94 @@ class Settings(BaseSettings):
         PROJECT_NAME: Name of the API project.
         API_V1_STR: Base prefix for API v1.
         SQLITE_URL: Database connection string.
+        DB_ECHO: Log every SQL statement through SQLAlchemy's echo (debugging only).
+        DB_AUTO_MIGRATE: Apply pending light migrations on startup.
+        ARCHIVE_AFTER_DAYS: Age after which sleep records move to the archive.
+        ARCHIVE_DIR: Directory holding the per-month archive databases.
+        INGEST_RATE_PER_PROVIDER: Sustained ingests per second per provider_slug.
+        INGEST_BURST_PER_PROVIDER: Token bucket size per provider_slug.
+        ADMISSION_MAX_CONCURRENCY: In-flight ingests plus alarm reads.
+        ADMISSION_READ_RESERVE: Slots of that capacity ingestion may never use.
+        ADMISSION_RETRY_AFTER_SECONDS: Retry-After sent on 503 responses.
+        SCHEDULER_ENABLED: Run the alarm precomputation worker in the lifespan.
+        SCHEDULER_TICK_SECONDS: Interval between precomputation passes.
+        SCHEDULER_LEAD_MINUTES: How long before a window opens predictions are computed.
+        VITALS_RAW_RETENTION_DAYS: Days raw heart-rate/HRV samples are kept.
+        VITALS_MINUTE_ROLLUP_RETENTION_DAYS: Days 1-minute rollups are kept (5-minute ones are kept forever).
+        MERGE_MIN_OVERLAP: Minimum overlap (fraction of the shorter night) to fuse two records.
+        SOURCE_QUALITY: Extra quality score per provider_source when fusing nights.
+        PROFILING_TOKEN: Secret that enables profiling of a request via `X-Profile-Token`.
+        PROFILING_SAMPLE_RATE: Fraction of profiled-endpoint requests profiled at random.
+        PROFILING_DIR: Directory where folded-stack profiles are written.
+        PROFILING_MAX_FILES: Number of profiles kept before the oldest are deleted.
+        LOG_LEVEL: Root log level.
+        LOG_LEVELS: Per-logger level overrides (e.g. {"app.sql": "DEBUG"}).
+        SQL_SLOW_QUERY_MS: Statements at least this slow are logged as warnings.
+        SQL_LOG_SAMPLE_RATE: Fraction of the other statements logged at DEBUG.
+        SERVE_MODE: `single` (one process) or `multi` (HTTP workers plus one writer), see app.serve.
+        SERVE_WORKERS: HTTP worker processes in multi mode (0 = one per CPU).
+        INGEST_WRITER_ADDRESS: Unix socket of the writer process; when set, ingestion writes are forwarded to it.
+        INGEST_WRITER_BATCH_SIZE: Maximum writes committed in one transaction by the writer.
+        INGEST_WRITER_MAX_DELAY_MS: Maximum wait to fill a batch.
+        INGEST_WRITER_TIMEOUT_SECONDS: How long a worker waits for the writer before answering 503.
+        STARTUP_BACKGROUND: Serve liveness while the warm-up runs (readiness via `/ready`).
+        STARTUP_TIMEOUT_SECONDS: How long API requests received during the warm-up are held.
     """
     PROJECT_NAME: str = "WeSleep API"
     API_V1_STR: str = "/api/v1"
     
     # Database
     SQLITE_URL: str = "sqlite+aiosqlite:///./wesleep.db"
+    DB_AUTO_MIGRATE: bool = True
+    DB_ECHO: bool = False
+
+    # Archive
+    ARCHIVE_AFTER_DAYS: int = 90
+    ARCHIVE_DIR: str = "./data/archive"
+
+    # Admission control (webhook de ingesta)
+    INGEST_RATE_PER_PROVIDER: float = 50.0
+    INGEST_BURST_PER_PROVIDER: int = 100
+    ADMISSION_MAX_CONCURRENCY: int = 64
+    ADMISSION_READ_RESERVE: int = 16
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1
+
+    # Precálculo de alarmas
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_TICK_SECONDS: float = 30.0
+    SCHEDULER_LEAD_MINUTES: int = 10
+
+    # Series de FC/HRV
+    VITALS_RAW_RETENTION_DAYS: int = 7
+    VITALS_MINUTE_ROLLUP_RETENTION_DAYS: int = 30
+
+    # Fusión de noches multi-fuente
+    MERGE_MIN_OVERLAP: float = 0.5
+    SOURCE_QUALITY: Dict[str, float] = {}
+
+    # Perfilado bajo demanda (desactivado por defecto)
+    PROFILING_TOKEN: Optional[str] = None
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_DIR: str = "./data/profiles"
+    PROFILING_MAX_FILES: int = 200
+
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: Dict[str, str] = {}
+    SQL_SLOW_QUERY_MS: float = 200.0
+    SQL_LOG_SAMPLE_RATE: float = 0.0
+
+    # Despliegue multi-proceso
+    SERVE_MODE: str = "single"
+    SERVE_WORKERS: int = 0
+    INGEST_WRITER_ADDRESS: Optional[str] = None
+    INGEST_WRITER_BATCH_SIZE: int = 64
+    INGEST_WRITER_MAX_DELAY_MS: float = 5.0
+    INGEST_WRITER_TIMEOUT_SECONDS: float = 10.0
+
+    # Arranque
+    STARTUP_BACKGROUND: bool = False
+    STARTUP_TIMEOUT_SECONDS: float = 30.0
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -3,36 +3,73 @@ Database connection and session management.
 
 This module sets up the asynchronous engine and session maker for SQLModel/SQLAlchemy.
 """
+import logging
+from datetime import datetime, timezone
+
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlmodel import SQLModel
 
 from app.config import settings
+from app.log import install_sql_logging
+
+logger = logging.getLogger(__name__)
 
 # Crear motor asíncrono para SQLite
 # check_same_thread=False es necesario para SQLite
 engine = create_async_engine(
     settings.SQLITE_URL, 
-    echo=True, 
+    echo=settings.DB_ECHO, 
     connect_args={"check_same_thread": False}
 )
 
+# Consultas lentas y muestreadas al log estructurado (en lugar de echo)
+install_sql_logging(engine.sync_engine)
+
 async_session_maker = sessionmaker(
     engine, 
     class_=AsyncSession, 
     expire_on_commit=False
 )
 
+def to_naive_utc(value: datetime) -> datetime:
+    """
+    Normalize a datetime to naive UTC.
+
+    SQLite does not store timezone information, so every value written to or
+    compared against a DateTime column goes through this helper.
+    """
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 async def init_db():
     """
-    Initialize the database by creating all tables defined in SQLModel metadata.
+    Initialize the database schema on application startup.
 
-    This function should be called on application startup.
+    Only reads the applied versions when no light migration is pending; heavy
+    ones are left to `python -m app.migrations upgrade` and do not trigger an
+    upgrade on every boot. Otherwise, if `DB_AUTO_MIGRATE` is enabled, applies
+    the pending light migrations.
+
+    Raises:
+        RuntimeError: If light migrations are pending and `DB_AUTO_MIGRATE` is
+            disabled, so that readiness fails instead of requests failing later.
     """
-    async with engine.begin() as conn:
-        # En producción usaríamos Alembic, aquí creamos tablas para dev rápido
-        await conn.run_sync(SQLModel.metadata.create_all)
+    from app.migrations import get_pending_migrations, upgrade
+
+    pending_light = [m for m in await get_pending_migrations(engine) if not m.heavy]
+    if not pending_light:
+        return
+    if not settings.DB_AUTO_MIGRATE:
+        versions = ", ".join(str(m.version) for m in pending_light)
+        logger.error(
+            "Pending migrations (%s) with DB_AUTO_MIGRATE disabled; "
+            "run `python -m app.migrations upgrade`",
+            versions,
+        )
+        raise RuntimeError(f"Database schema is out of date (pending migrations: {versions})")
+    await upgrade(engine, include_heavy=False)
 
 async def get_session():
     """
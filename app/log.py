@@ -0,0 +1,235 @@
+"""
+Structured, non-blocking logging.
+
+Application code keeps using `logging.getLogger(__name__)`. `setup_logging`
+replaces the root handlers with a `QueueHandler`: emitting a record only
+enqueues it, and a `QueueListener` thread formats it as one JSON line and
+writes it to stdout, off the event loop.
+
+Every record carries the id of the HTTP request that produced it (from the
+`X-Request-ID` header or generated by `RequestIdMiddleware`). The same id is
+returned in the response and stored with ingested sleep records, so an ingest
+can be matched with the alarm reads that use it later.
+
+SQL statements are logged by `install_sql_logging` instead of the engine's
+`echo`. Statements slower than `SQL_SLOW_QUERY_MS` are logged as warnings,
+and a `SQL_LOG_SAMPLE_RATE` share of the rest is logged at DEBUG.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from uuid import uuid4
+
+from app.config import settings
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+sql_logger = logging.getLogger("app.sql")
+
+# Un id de cliente solo se acepta si es corto y seguro para logs y cabeceras
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Atributos estándar de LogRecord; el resto viene de `extra=` y se serializa
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id", "color_message"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+
+
+def get_request_id() -> Optional[str]:
+    """Return the id of the request being handled, if any."""
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id (runs in the emitting thread)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Un request_id explícito (extra=...) tiene prioridad sobre el del contexto
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps the message and the traceback as separate fields.
+
+    The stock `prepare` merges the traceback into the message; the JSON
+    formatter on the listener side needs them apart.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        prepared = logging.makeLogRecord(vars(record))
+        prepared.msg = message
+        prepared.args = None
+        prepared.exc_info = None
+        prepared.exc_text = exc_text
+        return prepared
+
+
+def setup_logging() -> None:
+    """
+    Route all logging through the queue and start the writer thread.
+
+    Applies `LOG_LEVEL` to the root logger and `LOG_LEVELS` per logger. Log
+    records from uvicorn are routed through the queue as well. Idempotent.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+
+    _queue_handler = _StructuredQueueHandler(log_queue)
+    _queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.StreamHandler) and getattr(handler, "stream", None) in (sys.stdout, sys.stderr):
+            root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+    for name, level in settings.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush pending records and stop the writer thread."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+
+
+# --- SQL ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed_ms = (perf_counter() - starts.pop()) * 1000
+    # Sin parámetros: pueden contener datos de salud del usuario
+    if elapsed_ms >= settings.SQL_SLOW_QUERY_MS:
+        sql_logger.warning("Slow query", extra={"statement": statement, "duration_ms": round(elapsed_ms, 3)})
+    elif settings.SQL_LOG_SAMPLE_RATE > 0 and random.random() < settings.SQL_LOG_SAMPLE_RATE:
+        sql_logger.debug("Query", extra={"statement": statement, "duration_ms": round(elapsed_ms, 3)})
+
+
+def _handle_error(context) -> None:
+    # Una sentencia fallida no llega a after_cursor_execute: se descarta su inicio
+    conn = context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def install_sql_logging(engine: "Engine") -> None:
+    """
+    Time every statement of a (sync) engine and log slow or sampled ones.
+
+    Args:
+        engine (Engine): Engine to instrument; use `async_engine.sync_engine`.
+    """
+    from sqlalchemy import event
+
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+# --- HTTP ---
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware assigning a request id to every HTTP request.
+
+    A valid `X-Request-ID` from the client is reused; otherwise one is
+    generated. The id is set in `request_id_var` and echoed in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid4().hex
+        header = (REQUEST_ID_HEADER.lower().encode(), request_id.encode())
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), header]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
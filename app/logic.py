@@ -7,13 +7,26 @@ Includes functions for:
 - Detecting anomalies (Apnea, Fragmentation).
 - Predicting optimal wake-up times (Smart Alarm).
 """
+import heapq
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Dict, Any
+from typing import Iterable, List, Optional, Dict, Any, Tuple
 from uuid import UUID
 
 from pydantic import ValidationError
 
-from app.models import CleanSleepData, WakeupPrediction, SleepPhase, SleepSegment
+from app.models import (
+    CleanSleepData,
+    DesaturationEvent,
+    DesaturationSummary,
+    SleepPhase,
+    SleepSegment,
+    SmartAlarmResponse,
+    VitalRollupBucket,
+    WakeupPrediction,
+)
+
+# Ventana de la alarma inteligente: se busca despertar en los N minutos previos al objetivo
+SMART_ALARM_WINDOW_MINUTES = 30
 
 # --- Exceptions ---
 class DataParsingError(Exception):
@@ -21,7 +34,7 @@ class DataParsingError(Exception):
     pass
 
 
-def _coerce_datetime(value: Any, field_name: str) -> datetime:
+def coerce_datetime(value: Any, field_name: str) -> datetime:
     """Convierte un valor a datetime aceptando datetime o string ISO8601."""
     if isinstance(value, datetime):
         return value
@@ -94,6 +107,130 @@ def _build_hypnogram_from_phase_durations(
 
     return hypnogram
 
+# --- Native Segment Normalization ---
+
+# Fases nativas de proveedores -> SleepPhase (None = se ignora, e.g. "inBed")
+_STAGE_ALIASES: Dict[str, Optional[SleepPhase]] = {
+    "deep": SleepPhase.DEEP,
+    "asleepdeep": SleepPhase.DEEP,
+    "light": SleepPhase.LIGHT,
+    "core": SleepPhase.LIGHT,
+    "asleepcore": SleepPhase.LIGHT,
+    "asleep": SleepPhase.LIGHT,
+    "asleepunspecified": SleepPhase.LIGHT,
+    "rem": SleepPhase.REM,
+    "asleeprem": SleepPhase.REM,
+    "awake": SleepPhase.AWAKE,
+    "inbed": None,
+}
+_HEALTHKIT_STAGE_PREFIX = "hkcategoryvaluesleepanalysis"
+
+# Prioridad ante solapes dentro de una misma fuente: la fase más específica gana
+PHASE_PRIORITY: Dict[SleepPhase, int] = {
+    SleepPhase.LIGHT: 0,
+    SleepPhase.REM: 1,
+    SleepPhase.DEEP: 2,
+    SleepPhase.AWAKE: 3,
+}
+
+
+def _map_stage(stage: str) -> Optional[SleepPhase]:
+    key = stage.strip().lower().replace("_", "")
+    if key.startswith(_HEALTHKIT_STAGE_PREFIX):
+        key = key[len(_HEALTHKIT_STAGE_PREFIX):]
+    if key not in _STAGE_ALIASES:
+        raise DataParsingError(f"Fase de sueño desconocida: {stage}")
+    return _STAGE_ALIASES[key]
+
+
+def align_timezone(value: datetime, reference: datetime) -> datetime:
+    """Asume UTC para valores naive si la referencia tiene zona horaria (y viceversa)."""
+    if reference.tzinfo and not value.tzinfo:
+        return value.replace(tzinfo=timezone.utc)
+    if not reference.tzinfo and value.tzinfo:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def normalize_segments(
+    segments: Iterable[Tuple[datetime, datetime, SleepPhase, int]],
+    window_start: datetime,
+    window_end: datetime,
+) -> List[SleepSegment]:
+    """
+    Normaliza segmentos (inicio, fin, fase, prioridad) en un hipnograma mínimo.
+
+    Recorta a la ventana de la noche, resuelve solapes quedándose en cada
+    instante con el segmento de mayor prioridad y fusiona segmentos contiguos
+    de la misma fase. Barrido con heap sobre los extremos ordenados: O(n log n).
+    """
+    clipped: List[Tuple[datetime, datetime, SleepPhase, int]] = []
+    for start_at, end_at, phase, priority in segments:
+        start_at = max(align_timezone(start_at, window_start), window_start)
+        end_at = min(align_timezone(end_at, window_start), window_end)
+        if end_at > start_at:
+            clipped.append((start_at, end_at, phase, priority))
+    if not clipped:
+        return []
+
+    clipped.sort(key=lambda segment: segment[0])
+    boundaries = sorted({t for segment in clipped for t in segment[:2]})
+
+    hypnogram: List[SleepSegment] = []
+    active: List[Tuple[int, int, datetime, SleepPhase]] = []  # (-prioridad, orden, fin, fase)
+    next_segment = 0
+
+    for index, boundary in enumerate(boundaries[:-1]):
+        while next_segment < len(clipped) and clipped[next_segment][0] <= boundary:
+            start_at, end_at, phase, priority = clipped[next_segment]
+            heapq.heappush(active, (-priority, next_segment, end_at, phase))
+            next_segment += 1
+        # Borrado perezoso de segmentos ya terminados
+        while active and active[0][2] <= boundary:
+            heapq.heappop(active)
+        if not active:
+            continue
+
+        phase = active[0][3]
+        interval_end = boundaries[index + 1]
+        if hypnogram and hypnogram[-1].phase == phase and hypnogram[-1].end_at == boundary:
+            hypnogram[-1].end_at = interval_end
+        else:
+            hypnogram.append(SleepSegment(start_at=boundary, end_at=interval_end, phase=phase))
+
+    return hypnogram
+
+
+def _build_hypnogram_from_native_segments(
+    start_at: datetime,
+    end_at: datetime,
+    raw_segments: List[Dict[str, Any]],
+) -> List[SleepSegment]:
+    """
+    Construye el hipnograma a partir de los segmentos nativos del proveedor.
+    """
+    segments: List[Tuple[datetime, datetime, SleepPhase, int]] = []
+    for index, raw in enumerate(raw_segments):
+        if not isinstance(raw, dict):
+            raise DataParsingError(f"Segmento inválido en la posición {index}")
+        phase = _map_stage(str(raw.get("stage", "")))
+        if phase is None:
+            continue
+        segments.append((
+            coerce_datetime(raw.get("start_at"), f"segments[{index}].start_at"),
+            coerce_datetime(raw.get("end_at"), f"segments[{index}].end_at"),
+            phase,
+            PHASE_PRIORITY[phase],
+        ))
+    return normalize_segments(segments, start_at, end_at)
+
+
+def _phase_durations_ms(hypnogram: List[SleepSegment]) -> Dict[SleepPhase, int]:
+    durations = {phase: 0 for phase in SleepPhase}
+    for segment in hypnogram:
+        durations[segment.phase] += int((segment.end_at - segment.start_at).total_seconds() * 1000)
+    return durations
+
 # --- Parser Logic ---
 
 def parse_sleep_payload(payload: Dict[str, Any]) -> CleanSleepData:
@@ -125,14 +262,23 @@ def parse_sleep_payload(payload: Dict[str, Any]) -> CleanSleepData:
         if interruptions is not None and isinstance(interruptions, (int, float)):
                 movimiento = min(float(interruptions) / 20.0, 1.0) # E.g. 20 interrupciones = 1.0 (mucho movimiento)
 
-        start_at = _coerce_datetime(payload["start_at_timestamp"], "start_at_timestamp")
-        end_at = _coerce_datetime(payload["end_at_timestamp"], "end_at_timestamp")
-
-        synthetic_hypnogram = _build_hypnogram_from_phase_durations(
-            start_at=start_at,
-            end_at=end_at,
-            metrics=metrics,
-        )
+        start_at = coerce_datetime(payload["start_at_timestamp"], "start_at_timestamp")
+        end_at = coerce_datetime(payload["end_at_timestamp"], "end_at_timestamp")
+
+        # Hipnograma: segmentos nativos si existen; si no, aproximación por duraciones
+        hypnogram: List[SleepSegment] = []
+        raw_segments = payload.get("segments")
+        if raw_segments:
+            if not isinstance(raw_segments, list):
+                raise DataParsingError("El campo 'segments' debe ser una lista.")
+            hypnogram = _build_hypnogram_from_native_segments(start_at, end_at, raw_segments)
+        native_durations = _phase_durations_ms(hypnogram) if hypnogram else {}
+        if not hypnogram:
+            hypnogram = _build_hypnogram_from_phase_durations(
+                start_at=start_at,
+                end_at=end_at,
+                metrics=metrics,
+            )
 
         # Construcción del diccionario para CleanSleepData
         clean_data_dict = {
@@ -155,12 +301,12 @@ def parse_sleep_payload(payload: Dict[str, Any]) -> CleanSleepData:
             "movimiento": movimiento,
             "breathing_rate": metrics.get("sleep_breathing_rate"),
             
-            # Fases del Sueño (Default a 0 si no existen)
-            "sleep_duration_deep": metrics.get("sleep_duration_deep") or 0,
-            "sleep_duration_light": metrics.get("sleep_duration_light") or 0,
-            "sleep_duration_rem": metrics.get("sleep_duration_rem") or 0,
-            "sleep_duration_awake": metrics.get("sleep_duration_awake") or 0,
-            "hypnogram": synthetic_hypnogram,
+            # Fases del Sueño (derivadas de los segmentos nativos si faltan; default 0)
+            "sleep_duration_deep": metrics.get("sleep_duration_deep") or native_durations.get(SleepPhase.DEEP, 0),
+            "sleep_duration_light": metrics.get("sleep_duration_light") or native_durations.get(SleepPhase.LIGHT, 0),
+            "sleep_duration_rem": metrics.get("sleep_duration_rem") or native_durations.get(SleepPhase.REM, 0),
+            "sleep_duration_awake": metrics.get("sleep_duration_awake") or native_durations.get(SleepPhase.AWAKE, 0),
+            "hypnogram": hypnogram,
         }
         
         # 3. Creación y validación final del modelo Pydantic
@@ -174,13 +320,31 @@ def parse_sleep_payload(payload: Dict[str, Any]) -> CleanSleepData:
 
 # --- Evaluator Logic ---
 
-def calculate_sleep_score(data: CleanSleepData) -> float:
+def rollup_mean(buckets: Optional[List[VitalRollupBucket]]) -> Optional[float]:
+    """
+    Media ponderada por número de muestras de un conjunto de agregaciones.
+    """
+    if not buckets:
+        return None
+    total_count = sum(bucket.count for bucket in buckets)
+    if total_count <= 0:
+        return None
+    return sum(bucket.mean * bucket.count for bucket in buckets) / total_count
+
+
+def calculate_sleep_score(
+    data: CleanSleepData,
+    hrv_rollup: Optional[List[VitalRollupBucket]] = None,
+) -> float:
     """
     Calculates a sleep quality score (0-100) based on weighted metrics:
     - 30% Duration (vs 8h)
     - 30% Deep Sleep (vs 15%)
     - 20% Efficiency (Sleep / Bed)
     - 20% HRV (Normalized)
+
+    If the payload has no nightly HRV, `hrv_rollup` (HRV buckets for the
+    night) is used instead.
     """
     score = 0.0
 
@@ -231,7 +395,7 @@ def calculate_sleep_score(data: CleanSleepData) -> float:
 
     # 4. HRV (20%)
     # User: "Más alto es mejor".
-    hrv_val = data.HRV or 0.0
+    hrv_val = data.HRV or rollup_mean(hrv_rollup) or 0.0
     # If HRV is 0/None, score 0.
     if hrv_val > 0:
         # Cap at 100ms for full points
@@ -244,15 +408,124 @@ def calculate_sleep_score(data: CleanSleepData) -> float:
 
 # --- Anomaly Detection Logic NO PRIORITARIO ---
 
+# Criterio ODI-3%: caída >= 3 puntos respecto al basal durante >= 10 s
+DESATURATION_DROP = 3
+DESATURATION_MIN_SECONDS = 10.0
+DESATURATION_BASELINE_SECONDS = 120.0
+DESATURATION_MIN_BASELINE_SECONDS = 30.0
+
+
+def detect_desaturations(samples: bytes, interval_ms: int) -> DesaturationSummary:
+    """
+    Detecta desaturaciones en una serie de SpO2 en una sola pasada.
+
+    `samples` es un array uint8 (un porcentaje por muestra, 0 = inválida).
+    El basal es la media móvil de los últimos `DESATURATION_BASELINE_SECONDS`
+    de muestras válidas (suma acumulada sobre un buffer circular, O(1) por
+    muestra) y se congela mientras dura un evento. Las muestras se recorren
+    como `memoryview`, así que los valores (< 256) son enteros cacheados por
+    CPython; el índice de `enumerate` sí se crea en cada muestra a partir de 256.
+    Un evento que sigue abierto al final de la serie se cierra en la última
+    muestra. Es CPU pura: desde el event loop, llamarla con `asyncio.to_thread`.
+    """
+    if interval_ms <= 0:
+        raise DataParsingError("interval_ms debe ser positivo")
+
+    interval_s = interval_ms / 1000.0
+    window = max(int(DESATURATION_BASELINE_SECONDS / interval_s), 1)
+    min_baseline = max(int(DESATURATION_MIN_BASELINE_SECONDS / interval_s), 1)
+    min_event = max(int(DESATURATION_MIN_SECONDS / interval_s), 1)
+
+    ring = bytearray(window)
+    ring_pos = 0
+    ring_len = 0
+    ring_sum = 0
+    valid_count = 0
+
+    events: List[DesaturationEvent] = []
+    event_start = -1
+    event_baseline = 0.0
+    event_nadir = 0
+
+    for index, value in enumerate(memoryview(samples).cast("B")):
+        if value == 0 or value > 100:
+            continue
+        valid_count += 1
+
+        if event_start >= 0:
+            if value < event_nadir:
+                event_nadir = value
+            # Fin del evento: recuperación a <= 1 punto del basal
+            if value >= event_baseline - 1:
+                if index - event_start >= min_event:
+                    events.append(
+                        DesaturationEvent(
+                            start_offset_s=round(event_start * interval_s, 3),
+                            duration_s=round((index - event_start) * interval_s, 3),
+                            baseline=round(event_baseline, 1),
+                            nadir=event_nadir,
+                        )
+                    )
+                event_start = -1
+            else:
+                continue
+        elif ring_len >= min_baseline:
+            baseline = ring_sum / ring_len
+            if value <= baseline - DESATURATION_DROP:
+                event_start = index
+                event_baseline = baseline
+                event_nadir = value
+                continue
+
+        # Actualización del basal (solo fuera de eventos)
+        if ring_len == window:
+            ring_sum -= ring[ring_pos]
+        else:
+            ring_len += 1
+        ring[ring_pos] = value
+        ring_sum += value
+        ring_pos = (ring_pos + 1) % window
+
+    # Desaturación aún en curso al terminar la serie
+    if event_start >= 0 and len(samples) - event_start >= min_event:
+        events.append(
+            DesaturationEvent(
+                start_offset_s=round(event_start * interval_s, 3),
+                duration_s=round((len(samples) - event_start) * interval_s, 3),
+                baseline=round(event_baseline, 1),
+                nadir=event_nadir,
+            )
+        )
+
+    valid_hours = valid_count * interval_s / 3600.0
+    odi = len(events) / valid_hours if valid_hours > 0 else 0.0
+    return DesaturationSummary(odi=round(odi, 2), valid_hours=round(valid_hours, 3), events=events)
+
+
+def _odi_severity(odi: float) -> str:
+    if odi >= 30:
+        return "severa"
+    if odi >= 15:
+        return "moderada"
+    return "leve"
+
+
 def detect_sleep_anomalies(data: CleanSleepData) -> List[str]:
     """
     Returns a list of anomaly tags.
     """
     anomalies = []
 
-    # 1. SpO2 < 90 -> Posible Apnea
-    # Check SpO2_min if available, else SpO2 (avg)
-    if data.SpO2_min and data.SpO2_min < 90:
+    # 1. Apnea
+    # Con serie de SpO2 se usa el ODI (eventos/h) con severidad; si no,
+    # se cae al resumen: SpO2_min si está disponible, si no SpO2 (avg)
+    if data.ODI is not None:
+        if data.ODI >= 5:
+            anomalies.append(
+                f"Posible Apnea {_odi_severity(data.ODI)} "
+                f"(ODI: {data.ODI}/h, {data.desaturation_count} desaturaciones)"
+            )
+    elif data.SpO2_min and data.SpO2_min < 90:
             anomalies.append(f"Posible Apnea (SpO2 Min: {data.SpO2_min})")
     elif data.SpO2 and data.SpO2 < 90:
             anomalies.append(f"Posible Apnea (SpO2 Avg: {data.SpO2})")
@@ -272,11 +545,18 @@ def detect_sleep_anomalies(data: CleanSleepData) -> List[str]:
 
 # --- Smart Alarm Logic ---
 
-def predict_optimal_wakeup(data: CleanSleepData, target_alarm_time: datetime) -> WakeupPrediction:
+def predict_optimal_wakeup(
+    data: CleanSleepData,
+    target_alarm_time: datetime,
+    hrv_rollup: Optional[List[VitalRollupBucket]] = None,
+) -> WakeupPrediction:
     """
     Estrategia v1: Heurística basada en fases de sueño y HRV.
+
+    Si se pasan agregaciones de HRV de la ventana (`hrv_rollup`), se usa su
+    media en lugar del HRV medio de toda la noche.
     """
-    WINDOW_MINUTES = 30
+    WINDOW_MINUTES = SMART_ALARM_WINDOW_MINUTES
     HRV_THRESHOLD = 50.0
 
     # Aseguarnos de que target_alarm_time tenga timezone si los datos lo tienen
@@ -330,7 +610,8 @@ def predict_optimal_wakeup(data: CleanSleepData, target_alarm_time: datetime) ->
         )
 
     # 4. Regla 3: HRV bajo -> Despertar antes
-    hrv_val = data.HRV or 0.0
+    window_hrv = rollup_mean(hrv_rollup)
+    hrv_val = round(window_hrv, 1) if window_hrv is not None else (data.HRV or 0.0)
     is_stressed = hrv_val < HRV_THRESHOLD and hrv_val > 0 
 
     best_time = target_alarm_time
@@ -348,3 +629,22 @@ def predict_optimal_wakeup(data: CleanSleepData, target_alarm_time: datetime) ->
         confidence=0.9,
         reasoning=reason
     )
+
+
+def build_smart_alarm_response(
+    data: CleanSleepData,
+    target_alarm_time: datetime,
+    window_hrv_rollup: Optional[List[VitalRollupBucket]] = None,
+    night_hrv_rollup: Optional[List[VitalRollupBucket]] = None,
+) -> SmartAlarmResponse:
+    """
+    Combina predicción, puntuación y anomalías en la respuesta de la alarma.
+    """
+    prediction = predict_optimal_wakeup(data, target_alarm_time, hrv_rollup=window_hrv_rollup)
+    return SmartAlarmResponse(
+        suggested_time=prediction.suggested_time,
+        confidence=prediction.confidence,
+        reasoning=prediction.reasoning,
+        quality_score=calculate_sleep_score(data, hrv_rollup=night_hrv_rollup),
+        anomalies=detect_sleep_anomalies(data),
+    )
@@ -1,28 +1,50 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from app.admission import IngestionAdmissionMiddleware
 from app.config import settings
+from app.log import RequestIdMiddleware, setup_logging, shutdown_logging
+from app.startup import StartupGateMiddleware, shut_down, startup_state, warm_up
 
 """
 Main entry point for the WeSleep API application.
 
-This module configures the FastAPI application, includes routers,
-and defines the startup events (such as database initialization).
+This module configures the FastAPI application and defines the startup
+events. Routers, models and the database layer are imported by
+`app.startup.warm_up` rather than at import time, to keep cold starts short.
 """
+import asyncio
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    from app.database import init_db
     """
     Lifespan context manager for the FastAPI application.
 
+    Starts the logging writer thread and warms the application up: routers,
+    database migrations, the ingestion writer connection (multi-worker mode)
+    and the alarm precomputation worker. With `STARTUP_BACKGROUND` the server
+    starts answering liveness checks while the warm-up runs.
+
     Args:
         app (FastAPI): The FastAPI application instance.
 
     Yields:
         None: Yields control back to the application.
     """
-    await init_db()
-    yield
+    setup_logging()
+    startup_state.reset()
+    warm_up_task = asyncio.create_task(warm_up(app))
+    if not settings.STARTUP_BACKGROUND:
+        await warm_up_task
+    try:
+        yield
+    finally:
+        if not warm_up_task.done():
+            warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+        await shut_down()
+        shutdown_logging()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -30,8 +52,14 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-from app.routers import api_router
-app.include_router(api_router, prefix=settings.API_V1_STR)
+# Compresión HTTP (incluye respuestas en streaming como la exportación)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Retiene las peticiones a la API hasta que termina el arranque
+app.add_middleware(StartupGateMiddleware, prefix=settings.API_V1_STR)
+# Descarta ingestas por saturación antes de leer y validar el cuerpo
+app.add_middleware(IngestionAdmissionMiddleware, prefix=f"{settings.API_V1_STR}/webhooks/wearable")
+# Id de petición para correlacionar logs (añadido el último: envuelve a todos)
+app.add_middleware(RequestIdMiddleware)
 
 @app.get("/health", status_code=200)
 async def health_check():
@@ -40,6 +68,39 @@ async def health_check():
     """
     return {"status": "ok", "project": settings.PROJECT_NAME}
 
+@app.get("/ready", status_code=200)
+async def readiness_check():
+    """
+    Readiness check: 200 once the warm-up (routers, migrations, services) is done.
+
+    Returns 503 while starting, if the warm-up failed, or (multi-worker mode)
+    while the ingestion writer is unreachable, so load balancers only route
+    traffic to replicas that can serve it. The response includes the duration
+    of each startup phase.
+    """
+    if startup_state.ready:
+        # Importado durante el arranque
+        from app.writer import writer_reachable
+
+        if writer_reachable():
+            return {"status": "ready", "startup_ms": startup_state.phases_ms}
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": "unavailable",
+                "error": "Ingestion writer is not reachable",
+                "startup_ms": startup_state.phases_ms,
+            },
+        )
+    return JSONResponse(
+        status_code=503,
+        content={
+            "status": "failed" if startup_state.error else "starting",
+            "error": startup_state.error,
+            "startup_ms": startup_state.phases_ms,
+        },
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,196 @@
+"""
+Multi-source night merging.
+
+Users with both a watch and a phone send two `SleepRecord`s for the same
+night from different `provider_source`s. This module finds the records that
+overlap a given night with an interval index, and fuses their metrics and
+hypnograms into one canonical night. For each metric and for each instant of
+the hypnogram, the value comes from the best-quality source that has it.
+
+Fused nights are cached by the set of record ids that compose them. A new
+record for the night therefore produces a different key. Other updates to a
+source (e.g. an SpO2 series) invalidate the user's entries explicitly.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.config import settings
+from app.database import to_naive_utc
+from app.models import CleanSleepData, SleepRecord
+import app.logic as logic
+
+# Campos que se toman de la mejor fuente que los tenga
+_FUSED_FIELDS = [
+    "media_HR",
+    "var_HR",
+    "HRV",
+    "SpO2",
+    "SpO2_min",
+    "SpO2_max",
+    "ODI",
+    "desaturation_count",
+    "movimiento",
+    "breathing_rate",
+]
+
+
+def record_interval(record: SleepRecord) -> Tuple[datetime, datetime]:
+    """
+    Return the (start, end) of a record as naive UTC, read from its payload.
+
+    Raises:
+        DataParsingError: If the payload timestamps are missing or invalid.
+    """
+    payload = record.payload or {}
+    start_at = logic.coerce_datetime(payload.get("start_at_timestamp"), "start_at_timestamp")
+    end_at = logic.coerce_datetime(payload.get("end_at_timestamp"), "end_at_timestamp")
+    return to_naive_utc(start_at), to_naive_utc(end_at)
+
+
+class IntervalIndex:
+    """
+    Static index of intervals sorted by start.
+
+    `overlapping` finds the candidates with a binary search on the starts and
+    keeps those that end after the query starts.
+    """
+
+    def __init__(self, intervals: List[Tuple[datetime, datetime, UUID]]):
+        self._intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in self._intervals]
+
+    def overlapping(self, start: datetime, end: datetime, min_ratio: float = 0.0) -> List[UUID]:
+        """
+        Return the ids of the intervals overlapping [start, end).
+
+        Args:
+            start (datetime): Query start.
+            end (datetime): Query end.
+            min_ratio (float): Minimum overlap as a fraction of the shorter interval.
+
+        Returns:
+            List[UUID]: Ids of the matching intervals, ordered by start.
+        """
+        result = []
+        for other_start, other_end, item_id in self._intervals[: bisect_left(self._starts, end)]:
+            overlap = (min(end, other_end) - max(start, other_start)).total_seconds()
+            if overlap <= 0:
+                continue
+            shorter = min((end - start).total_seconds(), (other_end - other_start).total_seconds())
+            if shorter <= 0 or overlap / shorter >= min_ratio:
+                result.append(item_id)
+        return result
+
+
+def source_quality(record: SleepRecord, data: CleanSleepData) -> float:
+    """
+    Score how trustworthy a source is for a night.
+
+    Native hypnograms weigh most, followed by physiological signals (a watch
+    has them, a phone usually does not). `SOURCE_QUALITY` adds a configured
+    bonus per `provider_source`.
+    """
+    payload = record.payload or {}
+    score = settings.SOURCE_QUALITY.get(record.provider_source, 0.0)
+    if payload.get("segments"):
+        score += 3.0
+    if data.HRV:
+        score += 1.0
+    if data.media_HR:
+        score += 1.0
+    if data.SpO2 or data.SpO2_min or data.ODI is not None:
+        score += 1.0
+    return score
+
+
+def fuse_nights(sources: List[Tuple[SleepRecord, CleanSleepData]]) -> CleanSleepData:
+    """
+    Fuse several sources of the same night into one canonical `CleanSleepData`.
+
+    The best source provides duration and phase totals. Every other metric
+    comes from the best source that has it. The hypnogram is rebuilt with
+    `normalize_segments`, where the source rank takes precedence over the
+    phase priority. Naive timestamps are taken as UTC and aligned with the
+    best source, so sources may mix naive and `Z` timestamps.
+
+    Args:
+        sources (List[Tuple[SleepRecord, CleanSleepData]]): Records with their parsed data.
+
+    Returns:
+        CleanSleepData: The canonical night.
+    """
+    ranked = sorted(
+        sources,
+        key=lambda source: (source_quality(*source), source[0].created_at),
+        reverse=True,
+    )
+    best = ranked[0][1]
+    if len(ranked) == 1:
+        return best
+
+    fused = best.model_copy()
+    for field in _FUSED_FIELDS:
+        for _, data in ranked:
+            value = getattr(data, field)
+            if value is not None:
+                setattr(fused, field, value)
+                break
+
+    # Las fuentes pueden mezclar timestamps naive y con zona: se alinean a la mejor
+    reference = best.start_at_timestamp
+    fused.start_at_timestamp = min(logic.align_timezone(data.start_at_timestamp, reference) for _, data in ranked)
+    fused.end_at_timestamp = max(logic.align_timezone(data.end_at_timestamp, reference) for _, data in ranked)
+
+    phase_levels = len(logic.PHASE_PRIORITY)
+    segments = [
+        (
+            segment.start_at,
+            segment.end_at,
+            segment.phase,
+            (len(ranked) - rank) * phase_levels + logic.PHASE_PRIORITY[segment.phase],
+        )
+        for rank, (_, data) in enumerate(ranked)
+        for segment in data.hypnogram
+    ]
+    fused.hypnogram = logic.normalize_segments(segments, fused.start_at_timestamp, fused.end_at_timestamp)
+    return fused
+
+
+class FusionCache:
+    """
+    Bounded LRU cache of fused nights keyed by their composing record ids.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[UUID, ...], Tuple[UUID, CleanSleepData]]" = OrderedDict()
+        self._keys_by_user: Dict[UUID, Set[Tuple[UUID, ...]]] = {}
+
+    def get(self, key: Tuple[UUID, ...]) -> Optional[CleanSleepData]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Tuple[UUID, ...], user_id: UUID, data: CleanSleepData) -> None:
+        self._entries[key] = (user_id, data)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (old_user, _) = self._entries.popitem(last=False)
+            self._keys_by_user.get(old_user, set()).discard(old_key)
+
+    def invalidate_user(self, user_id: UUID) -> None:
+        for key in self._keys_by_user.pop(user_id, set()):
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+
+fusion_cache = FusionCache()
@@ -0,0 +1,308 @@
+"""
+Schema versioning and migrations.
+
+Replaces the `create_all` call at every boot with an ordered list of migration
+steps tracked in a `schema_version` table. Startup only reads the applied
+versions (a tiny table); pending heavy steps (e.g. index builds on a large
+`sleep_records` table) are run out of band with:
+
+    python -m app.migrations upgrade
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Sequence, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.models import (
+    AlarmSchedule,
+    SleepRecord,
+    SleepRecordArchiveIndex,
+    SpO2Series,
+    VitalIngestRange,
+    VitalRollup,
+    VitalSample,
+)
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock de PostgreSQL que serializa las migraciones
+_MIGRATION_LOCK_KEY = 0x5745534C
+# Espera máxima de SQLite por el bloqueo de escritura de otro proceso migrando
+_MIGRATION_LOCK_TIMEOUT_SECONDS = 600
+
+# Metadata propia: la tabla de versiones no debe formar parte de SQLModel.metadata
+version_metadata = MetaData()
+
+schema_version_table = Table(
+    "schema_version",
+    version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A single ordered schema change.
+
+    Attributes:
+        version: Monotonic version number reached after applying the step.
+        description: Human readable summary stored in `schema_version`.
+        upgrade: Callable executed with a synchronous connection.
+        heavy: If True, the step is skipped at startup and must be applied
+            with the migration command (unless the database is brand new).
+        transactional: If False, the step runs in autocommit mode (required
+            for online index builds such as `CREATE INDEX CONCURRENTLY`).
+    """
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+    heavy: bool = False
+    transactional: bool = True
+
+
+# --- Helpers ---
+
+def create_index_online(
+    conn: Connection,
+    name: str,
+    table: str,
+    columns: Sequence[str],
+) -> None:
+    """
+    Crea un índice sin bloquear escrituras cuando el motor lo permite.
+
+    PostgreSQL usa `CREATE INDEX CONCURRENTLY` (requiere autocommit). SQLite no
+    tiene variante online, así que se usa `IF NOT EXISTS` para que el paso sea
+    idempotente y pueda reintentarse.
+    """
+    column_list = ", ".join(columns)
+    if conn.dialect.name == "postgresql":
+        statement = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column_list})"
+    else:
+        statement = f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column_list})"
+    conn.exec_driver_sql(statement)
+
+
+# --- Migration Steps ---
+
+def _create_sleep_records(conn: Connection) -> None:
+    # checkfirst=True permite adoptar bases creadas con el antiguo create_all
+    SleepRecord.__table__.create(conn, checkfirst=True)
+
+
+def _index_sleep_records_user_timestamp(conn: Connection) -> None:
+    create_index_online(
+        conn,
+        "ix_sleep_records_user_id_timestamp",
+        "sleep_records",
+        ["user_id", "timestamp"],
+    )
+
+
+def _create_archive_index(conn: Connection) -> None:
+    SleepRecordArchiveIndex.__table__.create(conn, checkfirst=True)
+
+
+def _create_alarm_schedules(conn: Connection) -> None:
+    AlarmSchedule.__table__.create(conn, checkfirst=True)
+
+
+def _create_spo2_series(conn: Connection) -> None:
+    SpO2Series.__table__.create(conn, checkfirst=True)
+
+
+def _create_vitals(conn: Connection) -> None:
+    VitalSample.__table__.create(conn, checkfirst=True)
+    VitalRollup.__table__.create(conn, checkfirst=True)
+
+
+def _add_sleep_records_ingest_request_id(conn: Connection) -> None:
+    # Las bases nuevas ya tienen la columna: el paso 1 crea la tabla desde el modelo
+    columns = {column["name"] for column in inspect(conn).get_columns("sleep_records")}
+    if "ingest_request_id" not in columns:
+        conn.exec_driver_sql("ALTER TABLE sleep_records ADD COLUMN ingest_request_id VARCHAR(64)")
+
+
+def _create_vital_ingest_ranges(conn: Connection) -> None:
+    VitalIngestRange.__table__.create(conn, checkfirst=True)
+    # Lo ya ingerido queda cubierto: un rango por usuario y métrica sobre las muestras crudas
+    conn.exec_driver_sql(
+        "INSERT INTO vital_ingest_ranges (user_id, metric, start_at, end_at) "
+        "SELECT user_id, metric, MIN(ts), MAX(ts) FROM vital_samples GROUP BY user_id, metric"
+    )
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Create sleep_records", _create_sleep_records),
+    Migration(
+        2,
+        "Composite index sleep_records(user_id, timestamp)",
+        _index_sleep_records_user_timestamp,
+        heavy=True,
+        transactional=False,
+    ),
+    Migration(3, "Create sleep_record_archive_index", _create_archive_index),
+    Migration(4, "Create alarm_schedules", _create_alarm_schedules),
+    Migration(5, "Create spo2_series", _create_spo2_series),
+    Migration(6, "Create vital_samples and vital_rollups", _create_vitals),
+    Migration(7, "Add sleep_records.ingest_request_id", _add_sleep_records_ingest_request_id),
+    Migration(8, "Create vital_ingest_ranges", _create_vital_ingest_ranges),
+]
+
+HEAD_VERSION = MIGRATIONS[-1].version
+
+
+# --- Runner ---
+
+def _read_applied(conn: Connection) -> Set[int]:
+    if not inspect(conn).has_table(schema_version_table.name):
+        return set()
+    return set(conn.execute(select(schema_version_table.c.version)).scalars())
+
+
+async def get_pending_migrations(engine: AsyncEngine) -> List[Migration]:
+    """
+    Return the migrations not yet recorded in `schema_version`, in order.
+    """
+    async with engine.connect() as conn:
+        applied = await conn.run_sync(_read_applied)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _read_state(conn: Connection) -> Tuple[Set[int], bool]:
+    """
+    Create `schema_version` if needed and return the applied versions and
+    whether the data tables are still empty.
+
+    Databases created by the old `create_all` have no `schema_version` but a
+    populated `sleep_records`: they are not fresh, so heavy steps stay deferred.
+    """
+    version_metadata.create_all(conn)
+    fresh_database = not inspect(conn).has_table(SleepRecord.__tablename__) or (
+        conn.exec_driver_sql(f"SELECT 1 FROM {SleepRecord.__tablename__} LIMIT 1").first() is None
+    )
+    return _read_applied(conn), fresh_database
+
+
+async def _apply(conn: AsyncConnection, migration: Migration) -> None:
+    await conn.run_sync(migration.upgrade)
+    await conn.execute(
+        schema_version_table.insert().values(
+            version=migration.version,
+            description=migration.description,
+            applied_at=datetime.utcnow(),
+        )
+    )
+
+
+async def _upgrade_locked(
+    engine: AsyncEngine,
+    lock_conn: AsyncConnection,
+    include_heavy: bool,
+) -> List[Migration]:
+    # Releer bajo el bloqueo: otro proceso puede haber migrado mientras esperábamos
+    applied, fresh_database = await lock_conn.run_sync(_read_state)
+    pending: List[Migration] = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        if migration.heavy and not include_heavy and not fresh_database:
+            logger.warning(
+                "Migration %s (%s) is pending; run `python -m app.migrations upgrade`",
+                migration.version,
+                migration.description,
+            )
+            pending.append(migration)
+            continue
+
+        if lock_conn.dialect.name == "sqlite":
+            # Un solo escritor: los pasos van en la transacción que tiene el bloqueo
+            await _apply(lock_conn, migration)
+        else:
+            async with engine.connect() as conn:
+                if not migration.transactional:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await _apply(conn, migration)
+                if migration.transactional:
+                    await conn.commit()
+        logger.info("Applied migration %s: %s", migration.version, migration.description)
+
+    return pending
+
+
+async def upgrade(engine: AsyncEngine, include_heavy: bool = True) -> List[Migration]:
+    """
+    Apply pending migrations in order.
+
+    Heavy steps may only add redundant structures (indexes), so when they are
+    deferred the following light steps are still applied.
+
+    Concurrent callers (replicas or workers booting at once) are serialized:
+    SQLite takes the write lock with `BEGIN IMMEDIATE` and applies every step
+    in that transaction; PostgreSQL holds an advisory lock. The applied
+    versions are re-read under the lock, so each step runs exactly once.
+
+    Args:
+        engine (AsyncEngine): Target database engine.
+        include_heavy (bool): If False, skip pending heavy steps. They are
+            always applied on a fresh database (no `sleep_records` rows),
+            where they are cheap.
+
+    Returns:
+        List[Migration]: Migrations still pending after the upgrade.
+    """
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        if lock_conn.dialect.name == "sqlite":
+            await lock_conn.exec_driver_sql(f"PRAGMA busy_timeout = {_MIGRATION_LOCK_TIMEOUT_SECONDS * 1000}")
+            await lock_conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                pending = await _upgrade_locked(engine, lock_conn, include_heavy)
+            except BaseException:
+                await lock_conn.exec_driver_sql("ROLLBACK")
+                raise
+            await lock_conn.exec_driver_sql("COMMIT")
+        else:
+            await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+            try:
+                pending = await _upgrade_locked(engine, lock_conn, include_heavy)
+            finally:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+    return pending
+
+
+# --- CLI ---
+
+async def _main(command: str) -> None:
+    from app.database import engine
+
+    if command == "upgrade":
+        await upgrade(engine, include_heavy=True)
+        print(f"Schema at head version {HEAD_VERSION}")
+    elif command in ("current", "history"):
+        pending = {m.version for m in await get_pending_migrations(engine)}
+        for migration in MIGRATIONS:
+            if command == "current" and migration.version not in pending:
+                continue
+            flags = " [heavy]" if migration.heavy else ""
+            state = "pending" if migration.version in pending else "applied"
+            print(f"{migration.version:>4}  {state:<8} {migration.description}{flags}")
+        if command == "current" and not pending:
+            print(f"Schema at head version {HEAD_VERSION}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WeSleep schema migrations")
+    parser.add_argument("command", choices=["upgrade", "current", "history"], nargs="?", default="upgrade")
+    args = parser.parse_args()
+    asyncio.run(_main(args.command))
@@ -9,7 +9,7 @@ from uuid import UUID, uuid4
 from enum import Enum
 
 from sqlmodel import Field, SQLModel, JSON
-from sqlalchemy import Column
+from sqlalchemy import Column, LargeBinary
 from sqlalchemy.dialects.sqlite import JSON as SQLiteJSON
 from pydantic import BaseModel, ConfigDict
 
@@ -22,11 +22,41 @@ class SleepPhase(str, Enum):
     REM = "rem"
     AWAKE = "awake"
 
+class VitalMetric(str, Enum):
+    HEARTRATE = "heartrate"
+    HRV = "hrv_sdnn"
+
 class SleepSegment(BaseModel):
     start_at: datetime
     end_at: datetime
     phase: SleepPhase
 
+class RawSleepSegment(BaseModel):
+    """
+    Segmento de fase nativo enviado por el proveedor (e.g., HealthKit category sample).
+    """
+    start_at: datetime = Field(..., description="Inicio del segmento")
+    end_at: datetime = Field(..., description="Fin del segmento")
+    stage: str = Field(..., description="Fase según el proveedor (e.g., asleepDeep, asleepCore, asleepREM, awake, inBed)")
+    model_config = ConfigDict(extra="allow")
+
+class DesaturationEvent(BaseModel):
+    """
+    Caída de SpO2 detectada en una serie de muestras.
+    """
+    start_offset_s: float = Field(..., description="Inicio del evento en segundos desde el inicio de la serie")
+    duration_s: float = Field(..., description="Duración del evento en segundos")
+    baseline: float = Field(..., description="SpO2 basal previo al evento")
+    nadir: int = Field(..., description="SpO2 mínimo durante el evento")
+
+class DesaturationSummary(BaseModel):
+    """
+    Resultado del detector de desaturaciones sobre una noche.
+    """
+    odi: float = Field(..., description="Oxygen Desaturation Index (eventos por hora válida)")
+    valid_hours: float = Field(..., description="Horas con muestras válidas")
+    events: List[DesaturationEvent] = Field(default_factory=list)
+
 class WearableSource(BaseModel):
     """
     Información sobre la fuente de los datos (dispositivo, versión).
@@ -80,6 +110,7 @@ class WearableRawPayload(BaseModel):
     provider_slug: str = Field(..., description="Slug del proveedor (e.g., apple)")
     
     source: Optional[WearableSource] = Field(None, description="Detalles técnicos de la fuente")
+    segments: Optional[List[RawSleepSegment]] = Field(None, description="Segmentos de fase nativos, si el proveedor los envía")
     
     sleep_id: Optional[UUID] = Field(None, description="ID asociado al sueño, si existe")
     score: Optional[int] = Field(None, description="Puntuación de sueño calculada por el proveedor")
@@ -120,6 +151,8 @@ class CleanSleepData(BaseModel):
     SpO2: Optional[float] = Field(None, description="SpO2 promedio")
     SpO2_min: Optional[float] = Field(None, description="SpO2 mínimo")
     SpO2_max: Optional[float] = Field(None, description="SpO2 máximo")
+    ODI: Optional[float] = Field(None, description="Índice de desaturación (eventos/h), si hay serie de SpO2")
+    desaturation_count: Optional[int] = Field(None, description="Número de desaturaciones en la serie de SpO2")
     
     # Movimiento y Respiración
     movimiento: Optional[float] = Field(None, description="Índice de movimiento normalizado (0-1)")
@@ -151,6 +184,7 @@ class SleepRecord(SQLModel, table=True):
         record_id_provider: External ID from the provider.
         payload: Full raw JSON payload.
         created_at: Database insertion timestamp.
+        ingest_request_id: Request id of the webhook call that stored the record.
     """
     __tablename__ = "sleep_records"
 
@@ -167,6 +201,145 @@ class SleepRecord(SQLModel, table=True):
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+    # Correlación con los logs de la petición de ingesta
+    ingest_request_id: Optional[str] = Field(default=None, max_length=64)
+
+
+class SleepRecordArchiveIndex(SQLModel, table=True):
+    """
+    Hot-database index of sleep records moved to the monthly archive.
+
+    Attributes:
+        id: ID of the archived SleepRecord.
+        user_id: ID of the user who owns the record.
+        timestamp: Timestamp of the archived record.
+        archive_month: Archive partition (YYYY-MM) holding the full record.
+    """
+    __tablename__ = "sleep_record_archive_index"
+
+    id: UUID = Field(primary_key=True)
+    user_id: UUID = Field(index=True, nullable=False)
+    timestamp: datetime = Field(index=True)
+    archive_month: str = Field(nullable=False)
+
+
+class SpO2Series(SQLModel, table=True):
+    """
+    Per-sample SpO2 series attached to a sleep record.
+
+    Samples are stored as a compact uint8 array (one percentage per sample,
+    0 = invalid). The desaturation analysis is computed once at ingestion.
+
+    Attributes:
+        sleep_record_id: ID of the SleepRecord the series belongs to.
+        start_at: Timestamp of the first sample (naive UTC).
+        interval_ms: Sampling interval in milliseconds.
+        sample_count: Number of samples.
+        samples: Raw uint8 samples.
+        odi: Oxygen desaturation index (events per valid hour).
+        desaturation_count: Number of detected desaturation events.
+        desaturation_events: Detected events as JSON.
+        created_at: Database insertion timestamp.
+    """
+    __tablename__ = "spo2_series"
+
+    sleep_record_id: UUID = Field(primary_key=True)
+    start_at: datetime = Field(nullable=False)
+    interval_ms: int = Field(nullable=False)
+    sample_count: int = Field(nullable=False)
+    samples: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    odi: float = Field(nullable=False)
+    desaturation_count: int = Field(nullable=False)
+    desaturation_events: List[Dict[str, Any]] = Field(default=[], sa_column=Column(JSON))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class VitalSample(SQLModel, table=True):
+    """
+    Raw per-minute heart-rate / HRV sample, kept for a short retention period.
+
+    Attributes:
+        user_id: ID of the user who owns the sample.
+        metric: Measured metric.
+        ts: Sample timestamp (naive UTC).
+        value: Measured value.
+    """
+    __tablename__ = "vital_samples"
+
+    user_id: UUID = Field(primary_key=True)
+    metric: VitalMetric = Field(primary_key=True)
+    ts: datetime = Field(primary_key=True)
+    value: float = Field(nullable=False)
+
+
+class VitalRollup(SQLModel, table=True):
+    """
+    Precomputed aggregate of vital samples over a fixed bucket.
+
+    Stores sum and count (instead of the mean) so buckets can be merged
+    incrementally as new samples arrive.
+
+    Attributes:
+        user_id: ID of the user who owns the samples.
+        metric: Aggregated metric.
+        resolution_s: Bucket size in seconds (60 or 300).
+        bucket_start: Start of the bucket (naive UTC).
+        total: Sum of the sample values.
+        count: Number of samples.
+        min_value: Minimum sample value.
+        max_value: Maximum sample value.
+    """
+    __tablename__ = "vital_rollups"
+
+    user_id: UUID = Field(primary_key=True)
+    metric: VitalMetric = Field(primary_key=True)
+    resolution_s: int = Field(primary_key=True)
+    bucket_start: datetime = Field(primary_key=True)
+    total: float = Field(nullable=False)
+    count: int = Field(nullable=False)
+    min_value: float = Field(nullable=False)
+    max_value: float = Field(nullable=False)
+
+
+class VitalIngestRange(SQLModel, table=True):
+    """
+    Time range covered by an ingested vital series.
+
+    Lets retries be recognized after their raw samples have been purged.
+
+    Attributes:
+        id: Autoincrement id.
+        user_id: ID of the user who owns the series.
+        metric: Measured metric.
+        start_at: First sample of the series (naive UTC).
+        end_at: Last sample of the series (naive UTC).
+    """
+    __tablename__ = "vital_ingest_ranges"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: UUID = Field(index=True, nullable=False)
+    metric: VitalMetric = Field(nullable=False)
+    start_at: datetime = Field(nullable=False)
+    end_at: datetime = Field(nullable=False)
+
+
+class AlarmSchedule(SQLModel, table=True):
+    """
+    Alarm target time registered by a user for ahead-of-time prediction.
+
+    Attributes:
+        id: Unique identifier (UUID).
+        user_id: ID of the user who owns the alarm.
+        target_time: Latest wake-up time (naive UTC).
+        created_at: Database insertion timestamp.
+    """
+    __tablename__ = "alarm_schedules"
+
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    user_id: UUID = Field(index=True, nullable=False)
+    target_time: datetime = Field(index=True, nullable=False)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 
 # --- API Request/Response Models ---
 
@@ -185,9 +358,71 @@ class SmartAlarmRequest(BaseModel):
     sleep_record_id: UUID = Field(..., description="ID del registro de sueño a analizar")
     target_time: datetime = Field(..., description="Hora objetivo para despertar")
 
+class AlarmScheduleRequest(BaseModel):
+    """
+    Request payload to register an alarm for ahead-of-time prediction.
+    """
+    user_id: UUID = Field(..., description="Usuario dueño de la alarma")
+    target_time: datetime = Field(..., description="Hora objetivo para despertar")
+
+class VitalSeriesPayload(BaseModel):
+    """
+    Regularly sampled heart-rate or HRV series sent by a provider.
+    """
+    user_id: UUID = Field(..., description="Usuario dueño de la serie")
+    provider_slug: str = Field(..., description="Slug del proveedor (e.g., apple)")
+    metric: VitalMetric = Field(..., description="Métrica medida")
+    start_at: datetime = Field(..., description="Timestamp de la primera muestra")
+    interval_seconds: int = Field(60, gt=0, description="Intervalo entre muestras en segundos")
+    values: List[Optional[float]] = Field(..., max_length=48 * 60 * 60, description="Valores (null = muestra ausente)")
+
+class VitalSeriesIngestResponse(BaseModel):
+    """
+    Response of the vitals ingestion endpoint.
+    """
+    inserted: int = Field(..., description="Muestras nuevas almacenadas")
+    duplicates: int = Field(..., description="Muestras ya recibidas e ignoradas")
+
+class VitalRollupBucket(BaseModel):
+    """
+    Aggregated vital values for a time bucket.
+    """
+    bucket_start: datetime
+    mean: float
+    min: float
+    max: float
+    count: int
+
+class SpO2SeriesIngestResponse(DesaturationSummary):
+    """
+    Response of the SpO2 series ingestion endpoint.
+    """
+    sleep_record_id: UUID
+    sample_count: int
+
+class SleepHistoryItem(BaseModel):
+    """
+    Summary of a sleep record returned by the history endpoint.
+    """
+    id: UUID
+    timestamp: datetime
+    provider_source: str
+    record_id_provider: str
+    archived: bool = Field(False, description="True si el registro se sirve desde el archivo")
+    ingest_request_id: Optional[str] = None
+
 class SmartAlarmResponse(WakeupPrediction):
     """
     Response payload for the smart alarm endpoint, including quality score.
     """
     quality_score: float = Field(..., description="Puntuación de calidad del sueño (0-100)")
     anomalies: List[str] = Field(default_factory=list, description="Lista de anomalías detectadas")
+
+class AlarmPredictionResponse(SmartAlarmResponse):
+    """
+    Smart alarm prediction served for a registered alarm schedule.
+    """
+    schedule_id: UUID
+    sleep_record_id: UUID
+    computed_at: datetime
+    precomputed: bool = Field(..., description="True si se sirvió desde el almacén precalculado")
@@ -0,0 +1,169 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries the `X-Profile-Token` header matching
+`PROFILING_TOKEN`, or when it is picked by `PROFILING_SAMPLE_RATE`. While the
+handler runs, a `sys.setprofile` hook attributes the time between interpreter
+events to the call stack that was executing. Only events of the request's own
+task are kept, so concurrent requests on the same event loop do not pollute
+the profile. Time spent awaiting I/O (e.g. database queries in the aiosqlite
+thread) is not on the loop thread and therefore not counted.
+
+The result is written in the folded-stack format (`frame;frame;frame <µs>`)
+accepted by flamegraph.pl, speedscope and inferno. At most
+`PROFILING_MAX_FILES` profiles are kept in `PROFILING_DIR`.
+
+When both triggers are disabled, the only cost per request is one check of
+the settings.
+"""
+import asyncio
+import hmac
+import os
+import random
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter_ns
+from types import CodeType, FrameType
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_FILE_HEADER = "X-Profile-File"
+PROFILE_SUFFIX = ".folded"
+
+# sys.setprofile es por hilo: solo un perfil activo a la vez en el event loop
+_active: Optional["RequestProfiler"] = None
+
+
+def profiling_enabled() -> bool:
+    """Return True if any profiling trigger is configured."""
+    return bool(settings.PROFILING_TOKEN) or settings.PROFILING_SAMPLE_RATE > 0
+
+
+def should_profile(token: Optional[str]) -> bool:
+    """
+    Decide whether a request is profiled.
+
+    Args:
+        token (Optional[str]): Value of the `X-Profile-Token` header, if any.
+
+    Returns:
+        bool: True if the token matches or the request is sampled.
+    """
+    if token and settings.PROFILING_TOKEN and hmac.compare_digest(token, settings.PROFILING_TOKEN):
+        return True
+    return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+class RequestProfiler:
+    """
+    Deterministic profiler for the task handling one request.
+
+    Each interpreter event closes the interval since the previous one. The
+    interval is the self time of the stack that was running: the caller on
+    `call`, the returning function on `return`, and the C function on
+    `c_return`.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.file_name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%fZ}-{label}{PROFILE_SUFFIX}"
+        self.samples: Dict[Tuple[str, ...], int] = defaultdict(int)
+        self._labels: Dict[CodeType, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last = 0
+
+    def start(self) -> bool:
+        """
+        Install the hook for the current task.
+
+        Returns:
+            bool: False if another request is already being profiled.
+        """
+        global _active
+        if _active is not None:
+            return False
+        _active = self
+        self._task = asyncio.current_task()
+        self._last = perf_counter_ns()
+        sys.setprofile(self._hook)
+        return True
+
+    def stop(self) -> None:
+        """Remove the hook."""
+        global _active
+        sys.setprofile(None)
+        _active = None
+
+    def _frame_label(self, code: CodeType, frame: FrameType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            module = frame.f_globals.get("__name__", "?")
+            label = f"{module}:{code.co_qualname}"
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame: Optional[FrameType]) -> Tuple[str, ...]:
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_label(frame.f_code, frame))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _hook(self, frame: FrameType, event: str, arg: Any) -> None:
+        now = perf_counter_ns()
+        elapsed, self._last = now - self._last, now
+        # Eventos de otras tareas del loop (u ocioso) no pertenecen a esta petición
+        if asyncio.current_task() is not self._task:
+            return
+
+        if event == "call":
+            stack = self._stack(frame.f_back)
+        elif event in ("c_return", "c_exception"):
+            name = getattr(arg, "__qualname__", None) or getattr(arg, "__name__", repr(arg))
+            module = getattr(arg, "__module__", None) or "builtins"
+            stack = self._stack(frame) + (f"{module}:{name}",)
+        else:
+            stack = self._stack(frame)
+        if stack:
+            self.samples[stack] += elapsed
+
+    def folded(self) -> str:
+        """Render the profile as folded stacks weighted in microseconds."""
+        lines = []
+        for stack, elapsed_ns in sorted(self.samples.items()):
+            elapsed_us = elapsed_ns // 1000
+            if elapsed_us:
+                frames = ";".join(frame.replace(";", ":").replace(" ", "_") for frame in stack)
+                lines.append(f"{frames} {elapsed_us}")
+        return "\n".join(lines) + "\n"
+
+
+def write_profile(profiler: RequestProfiler, directory: Optional[str] = None) -> Path:
+    """
+    Write a profile to disk and rotate old ones. Blocking; run it in a thread.
+
+    Args:
+        profiler (RequestProfiler): A stopped profiler.
+        directory (Optional[str]): Output directory, `PROFILING_DIR` by default.
+
+    Returns:
+        Path: The written file.
+    """
+    output_dir = Path(directory or settings.PROFILING_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / profiler.file_name
+    path.write_text(profiler.folded())
+
+    # Los nombres empiezan por la fecha: el orden alfabético es el cronológico
+    profiles = sorted(output_dir.glob(f"*{PROFILE_SUFFIX}"))
+    for old in profiles[: max(len(profiles) - settings.PROFILING_MAX_FILES, 0)]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+    return path
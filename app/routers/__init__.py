@@ -1,8 +1,9 @@
 from fastapi import APIRouter
-from app.routers import wearable, alarm
+from app.routers import wearable, alarm, export
 
 api_router = APIRouter()
 
 # Webhooks de wearables (Apple HealthKit)
 api_router.include_router(wearable.router, prefix="/webhooks/wearable", tags=["wearables"])
 api_router.include_router(alarm.router, prefix="/sleep", tags=["sleep"])
+api_router.include_router(export.router, prefix="/sleep", tags=["export"])
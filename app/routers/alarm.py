@@ -3,17 +3,38 @@ API endpoints for Smart Alarm functionality.
 
 Handles requests to predict the optimal wake-up time based on sleep cycles.
 """
+import logging
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select
 
-from app.routers.deps import get_session
-from app.models import SmartAlarmRequest, SmartAlarmResponse, SleepRecord
-import app.logic as logic
+from app.routers.deps import get_session, profile_request, track_priority_read
+from app.models import (
+    AlarmPredictionResponse,
+    AlarmSchedule,
+    AlarmScheduleRequest,
+    SmartAlarmRequest,
+    SmartAlarmResponse,
+    SleepHistoryItem,
+)
+from app.analysis import analyze_sleep_record, find_night_record
+from app.archive import get_sleep_record, list_sleep_records
+from app.database import to_naive_utc
+from app.scheduler import prediction_store
+from app.writer import wake_scheduler
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/smart-alarm", response_model=SmartAlarmResponse)
+@router.post(
+    "/smart-alarm",
+    response_model=SmartAlarmResponse,
+    dependencies=[Depends(track_priority_read), Depends(profile_request)],
+)
 async def predict_smart_alarm(
     request: SmartAlarmRequest,
     session: AsyncSession = Depends(get_session),
@@ -35,32 +56,136 @@ async def predict_smart_alarm(
         HTTPException(404): If the sleep record is not found.
         HTTPException(500): If there is an error parsing the data.
     """
-    # 1. Fetch raw data
-    # SQLModel select style
-    statement = select(SleepRecord).where(SleepRecord.id == request.sleep_record_id)
-    result = await session.exec(statement)
-    record = result.first()
+    # 1. Fetch raw data (hot table, with fallback to the monthly archive)
+    record = await get_sleep_record(session, request.sleep_record_id)
     
     if not record:
         raise HTTPException(status_code=404, detail="Sleep record not found")
 
-    # 2. Parse data to CleanSleepData
+    # 2. Parse data and calculate wakeup window, sleep quality and anomalies
     try:
-        clean_data = logic.parse_sleep_payload(record.payload)
+        response = await analyze_sleep_record(session, record, request.target_time)
     except Exception as e:
+        logger.exception("Error computing smart alarm", extra={"sleep_record_id": str(record.id)})
         raise HTTPException(status_code=500, detail=f"Error parsing sleep data: {str(e)}")
 
-    # 3. Calculate wakeup window
-    prediction = logic.predict_optimal_wakeup(clean_data, request.target_time)
-    
-    # 4. Calculate sleep quality and anomalies
-    quality_score = logic.calculate_sleep_score(clean_data)
-    anomalies = logic.detect_sleep_anomalies(clean_data)
-
-    return SmartAlarmResponse(
-        suggested_time=prediction.suggested_time,
-        confidence=prediction.confidence,
-        reasoning=prediction.reasoning,
-        quality_score=quality_score,
-        anomalies=anomalies
+    # ingest_request_id enlaza esta lectura con la petición que guardó los datos
+    logger.info(
+        "Smart alarm computed",
+        extra={"sleep_record_id": str(record.id), "ingest_request_id": record.ingest_request_id},
+    )
+    return response
+
+
+@router.post("/alarms", response_model=AlarmSchedule, status_code=201)
+async def register_alarm(
+    request: AlarmScheduleRequest,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Register an alarm target time for ahead-of-time prediction.
+
+    The background scheduler computes the prediction shortly before the
+    wake-up window opens, and again whenever new data arrives for the night.
+
+    Args:
+        request (AlarmScheduleRequest): User and target time.
+        session (AsyncSession): Database session.
+
+    Returns:
+        AlarmSchedule: The registered schedule.
+    """
+    schedule = AlarmSchedule(user_id=request.user_id, target_time=to_naive_utc(request.target_time))
+    session.add(schedule)
+    await session.commit()
+    await session.refresh(schedule)
+
+    wake_scheduler()
+    return schedule
+
+
+@router.get(
+    "/alarms/{schedule_id}/prediction",
+    response_model=AlarmPredictionResponse,
+    dependencies=[Depends(track_priority_read)],
+)
+async def get_alarm_prediction(
+    schedule_id: UUID,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the prediction for a registered alarm.
+
+    Served from the precomputed store when available; otherwise computed on
+    the fly from the latest night of the user.
+
+    Args:
+        schedule_id (UUID): ID of the alarm schedule.
+        session (AsyncSession): Database session.
+
+    Returns:
+        AlarmPredictionResponse: Prediction plus provenance information.
+
+    Raises:
+        HTTPException(404): If the schedule or a sleep record for it is not found.
+        HTTPException(500): If there is an error parsing the data.
+    """
+    stored = prediction_store.get(schedule_id)
+    if stored is not None:
+        return stored.to_response()
+
+    schedule = await session.get(AlarmSchedule, schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Alarm schedule not found")
+    record = await find_night_record(session, schedule.user_id, schedule.target_time)
+    if not record:
+        raise HTTPException(status_code=404, detail="Sleep record not found")
+
+    try:
+        response = await analyze_sleep_record(session, record, schedule.target_time)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error parsing sleep data: {str(e)}")
+
+    return AlarmPredictionResponse(
+        **response.model_dump(),
+        schedule_id=schedule.id,
+        sleep_record_id=record.id,
+        computed_at=datetime.utcnow(),
+        precomputed=False,
     )
+
+
+@router.get("/history", response_model=List[SleepHistoryItem])
+async def get_sleep_history(
+    user_id: UUID,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    List a user's sleep records.
+
+    Recent records are served from the hot table; older ones are read
+    transparently from the monthly archive.
+
+    Args:
+        user_id (UUID): Owner of the records.
+        since (Optional[datetime]): Inclusive lower bound.
+        until (Optional[datetime]): Exclusive upper bound.
+        session (AsyncSession): Database session.
+
+    Returns:
+        List[SleepHistoryItem]: Records ordered by timestamp.
+    """
+    records = await list_sleep_records(session, user_id, since=since, until=until)
+    return [
+        SleepHistoryItem(
+            id=record.id,
+            timestamp=record.timestamp,
+            provider_source=record.provider_source,
+            record_id_provider=record.record_id_provider,
+            archived=archived,
+            ingest_request_id=record.ingest_request_id,
+        )
+        for record, archived in records
+    ]
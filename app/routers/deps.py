@@ -3,9 +3,14 @@ API dependencies.
 
 Common dependencies used across route handlers, such as database sessions.
 """
+import asyncio
 from typing import AsyncGenerator
+from fastapi import Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
+from app import profiling
+from app.admission import admission_controller
 from app.database import async_session_maker
+from app.models import VitalSeriesPayload, WearableRawPayload
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
@@ -16,3 +21,73 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """
     async with async_session_maker() as session:
         yield session
+
+async def admit_ingestion(payload: WearableRawPayload) -> None:
+    """
+    Dependency applying the per-provider rate limit to an ingestion request.
+
+    The global concurrency slot is taken earlier by `IngestionAdmissionMiddleware`,
+    before the body is read. Rejects with 429 and `Retry-After` before touching
+    the database.
+
+    Args:
+        payload (WearableRawPayload): Incoming payload (shared with the handler).
+    """
+    admission_controller.check_provider_rate(payload.provider_slug)
+
+async def admit_series_ingestion(provider_slug: str) -> None:
+    """
+    Dependency applying the per-provider rate limit to a sample series upload.
+
+    Args:
+        provider_slug (str): Provider sending the series (query parameter).
+    """
+    admission_controller.check_provider_rate(provider_slug)
+
+async def admit_vitals_ingestion(payload: VitalSeriesPayload) -> None:
+    """
+    Dependency applying the per-provider rate limit to a heart-rate/HRV series upload.
+
+    Args:
+        payload (VitalSeriesPayload): Incoming series (shared with the handler).
+    """
+    admission_controller.check_provider_rate(payload.provider_slug)
+
+async def track_priority_read() -> AsyncGenerator[None, None]:
+    """
+    Dependency marking an alarm read as in flight so ingestion yields capacity to it.
+    """
+    admission_controller.enter_read()
+    try:
+        yield
+    finally:
+        admission_controller.exit_read()
+
+async def profile_request(request: Request, response: Response) -> AsyncGenerator[None, None]:
+    """
+    Dependency profiling the handler when the request is selected.
+
+    A request is selected by a valid `X-Profile-Token` header or by
+    `PROFILING_SAMPLE_RATE`. The profile file name is returned in the
+    `X-Profile-File` response header.
+
+    Args:
+        request (Request): Incoming request.
+        response (Response): Response whose headers are extended.
+    """
+    if not profiling.profiling_enabled() or not profiling.should_profile(
+        request.headers.get(profiling.PROFILE_HEADER)
+    ):
+        yield
+        return
+
+    profiler = profiling.RequestProfiler(request.url.path.rstrip("/").rsplit("/", 1)[-1])
+    if not profiler.start():
+        yield
+        return
+    response.headers[profiling.PROFILE_FILE_HEADER] = profiler.file_name
+    try:
+        yield
+    finally:
+        profiler.stop()
+        await asyncio.to_thread(profiling.write_profile, profiler)
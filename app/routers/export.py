@@ -0,0 +1,155 @@
+"""
+API endpoints for bulk data export.
+
+Streams a user's full sleep history (hot and archived records) as NDJSON or CSV
+for data portability and analytics, with constant memory use.
+"""
+import asyncio
+import csv
+import io
+import json
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List
+from uuid import UUID
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from app.archive import stream_sleep_records
+from app.database import async_session_maker
+from app.models import SleepRecord, WearableMetrics
+import app.logic as logic
+
+router = APIRouter()
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+_MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+_METRIC_FIELDS = list(WearableMetrics.model_fields)
+
+_CSV_COLUMNS = [
+    "id",
+    "timestamp",
+    "provider_source",
+    "record_id_provider",
+    "start_at_timestamp",
+    "end_at_timestamp",
+    "duration",
+    *_METRIC_FIELDS,
+]
+
+_ENRICHED_COLUMNS = ["quality_score", "anomalies"]
+
+
+def _enrich(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Calcula score y anomalías; un payload inválido no corta la exportación."""
+    try:
+        clean_data = logic.parse_sleep_payload(payload)
+    except logic.DataParsingError as e:
+        return {"quality_score": None, "anomalies": [], "enrichment_error": str(e)}
+    return {
+        "quality_score": logic.calculate_sleep_score(clean_data),
+        "anomalies": logic.detect_sleep_anomalies(clean_data),
+    }
+
+
+def _encode_ndjson(records: List[SleepRecord], enrich: bool) -> str:
+    lines = []
+    for record in records:
+        row: Dict[str, Any] = {
+            "id": str(record.id),
+            "timestamp": record.timestamp.isoformat(),
+            "provider_source": record.provider_source,
+            "record_id_provider": record.record_id_provider,
+            "payload": record.payload,
+        }
+        if enrich:
+            row.update(_enrich(record.payload))
+        lines.append(json.dumps(row))
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _encode_csv(records: List[SleepRecord], enrich: bool, header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(_CSV_COLUMNS + (_ENRICHED_COLUMNS if enrich else []))
+    for record in records:
+        payload = record.payload or {}
+        metrics = payload.get("metrics") or {}
+        row = [
+            str(record.id),
+            record.timestamp.isoformat(),
+            record.provider_source,
+            record.record_id_provider,
+            payload.get("start_at_timestamp"),
+            payload.get("end_at_timestamp"),
+            payload.get("duration"),
+            *(metrics.get(field) for field in _METRIC_FIELDS),
+        ]
+        if enrich:
+            enrichment = _enrich(payload)
+            row += [enrichment["quality_score"], "|".join(enrichment["anomalies"])]
+        writer.writerow(row)
+    return buffer.getvalue()
+
+
+async def _iter_export(
+    user_id: UUID,
+    export_format: ExportFormat,
+    enrich: bool,
+    chunk_size: int,
+) -> AsyncIterator[str]:
+    # La sesión vive dentro del generador: las dependencias se cierran antes
+    # de que StreamingResponse empiece a enviar el cuerpo.
+    async with async_session_maker() as session:
+        first_chunk = True
+        async for records in stream_sleep_records(session, user_id, chunk_size=chunk_size):
+            if export_format == ExportFormat.CSV:
+                encoded = await asyncio.to_thread(_encode_csv, records, enrich, first_chunk)
+            else:
+                encoded = await asyncio.to_thread(_encode_ndjson, records, enrich)
+            first_chunk = False
+            if encoded:
+                yield encoded
+        if first_chunk and export_format == ExportFormat.CSV:
+            yield _encode_csv([], enrich, header=True)
+
+
+@router.get("/export")
+async def export_sleep_data(
+    user_id: UUID,
+    format: ExportFormat = ExportFormat.NDJSON,
+    enrich: bool = False,
+    chunk_size: int = Query(500, ge=1, le=5000),
+):
+    """
+    Export all of a user's sleep records.
+
+    The response is streamed chunk by chunk from a server-side cursor, so
+    memory use stays constant for multi-year histories. Compression is
+    negotiated through `Accept-Encoding: gzip`.
+
+    Args:
+        user_id (UUID): Owner of the records.
+        format (ExportFormat): `ndjson` (default) or `csv`.
+        enrich (bool): Add `quality_score` and `anomalies` computed by `app.logic`.
+        chunk_size (int): Records fetched per database round trip.
+
+    Returns:
+        StreamingResponse: NDJSON or CSV body.
+    """
+    filename = f"wesleep_{user_id}.{format.value}"
+    return StreamingResponse(
+        _iter_export(user_id, format, enrich, chunk_size),
+        media_type=_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -3,16 +3,33 @@ API endpoints for Wearable Data Ingestion.
 
 Handles the reception and storage of raw sleep data from providers like Apple HealthKit.
 """
+import asyncio
+import logging
+from datetime import datetime
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.routers.deps import get_session
-from app.models import WearableRawPayload, SleepRecord
+from app.routers.deps import admit_ingestion, admit_series_ingestion, admit_vitals_ingestion, get_session
+from app.models import (
+    SleepRecord,
+    SpO2Series,
+    SpO2SeriesIngestResponse,
+    VitalSeriesIngestResponse,
+    VitalSeriesPayload,
+    WearableRawPayload,
+)
+from app.archive import get_sleep_record
+from app.database import to_naive_utc
+from app.log import get_request_id
+from app.writer import WriterUnavailable, store_sleep_record, store_spo2_series, store_vital_series
+import app.logic as logic
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/", response_model=UUID, status_code=200)
+@router.post("/", response_model=UUID, status_code=200, dependencies=[Depends(admit_ingestion)])
 async def ingest_wearable_data(
     payload: WearableRawPayload,
     session: AsyncSession = Depends(get_session),
@@ -32,6 +49,8 @@ async def ingest_wearable_data(
         UUID: The internal ID of the created SleepRecord.
 
     Raises:
+        HTTPException(429): If the provider exceeded its ingestion rate.
+        HTTPException(503): If the server is at capacity or the ingestion writer is unreachable.
         HTTPException(500): If there is an internal processing error.
     """
     try:
@@ -45,16 +64,140 @@ async def ingest_wearable_data(
             provider_source=payload.provider_source,
             record_id_provider=str(payload.record_id),
             payload=payload.model_dump(mode='json'),
-            timestamp=payload.start_at_timestamp 
+            timestamp=payload.start_at_timestamp,
+            ingest_request_id=get_request_id(),
         )
 
-        session.add(sleep_record)
-        await session.commit()
-        await session.refresh(sleep_record)
+        # Invalida las noches fusionadas y predicciones precalculadas del usuario
+        await store_sleep_record(session, sleep_record)
 
+        logger.info(
+            "Ingested sleep record",
+            extra={"sleep_record_id": str(sleep_record.id), "provider_slug": payload.provider_slug},
+        )
         return sleep_record.id
 
-    except Exception as e:
-        # Loguear el error real aquí
-        print(f"Error ingesting data: {e}")
+    except WriterUnavailable:
+        raise
+    except Exception:
+        logger.exception(
+            "Error ingesting data",
+            extra={"provider_slug": payload.provider_slug, "record_id_provider": str(payload.record_id)},
+        )
         raise HTTPException(status_code=500, detail="Error interno procesando los datos")
+
+
+# Límite de muestras por serie (48 h a 1 Hz)
+MAX_SERIES_SAMPLES = 48 * 3600
+
+
+async def _read_body_capped(request: Request, limit: int) -> bytes:
+    """
+    Read the raw request body, rejecting it as soon as it exceeds `limit` bytes.
+
+    Raises:
+        HTTPException(413): If `Content-Length` or the streamed body exceeds `limit`.
+    """
+    too_large = HTTPException(status_code=413, detail="La serie de SpO2 es demasiado larga")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
+
+@router.post(
+    "/{sleep_record_id}/spo2",
+    response_model=SpO2SeriesIngestResponse,
+    status_code=200,
+    dependencies=[Depends(admit_series_ingestion)],
+)
+async def ingest_spo2_series(
+    sleep_record_id: UUID,
+    request: Request,
+    start_at: datetime,
+    interval_ms: int = Query(1000, gt=0),
+    session: AsyncSession = Depends(get_session),
+) -> SpO2SeriesIngestResponse:
+    """
+    Ingest a per-sample SpO2 series for a sleep record.
+
+    The body is a raw `application/octet-stream` uint8 array with one SpO2
+    percentage per sample (0 = invalid sample). Desaturation events and the
+    oxygen desaturation index are computed once here, in a single pass over
+    the bytes, and stored next to the compact samples. Uploading again
+    replaces the series.
+
+    Args:
+        sleep_record_id (UUID): Sleep record the series belongs to.
+        request (Request): Incoming request (raw body).
+        start_at (datetime): Timestamp of the first sample.
+        interval_ms (int): Sampling interval in milliseconds.
+        session (AsyncSession): Database session.
+
+    Returns:
+        SpO2SeriesIngestResponse: ODI and detected desaturation events.
+
+    Raises:
+        HTTPException(404): If the sleep record is not found.
+        HTTPException(413): If the series exceeds `MAX_SERIES_SAMPLES`.
+        HTTPException(422): If the body is empty.
+    """
+    samples = await _read_body_capped(request, MAX_SERIES_SAMPLES)
+    if not samples:
+        raise HTTPException(status_code=422, detail="La serie de SpO2 está vacía")
+
+    record = await get_sleep_record(session, sleep_record_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Sleep record not found")
+
+    # Bucle por muestra (decenas de ms en series largas): fuera del event loop
+    summary = await asyncio.to_thread(logic.detect_desaturations, samples, interval_ms)
+
+    series = SpO2Series(
+        sleep_record_id=sleep_record_id,
+        start_at=to_naive_utc(start_at),
+        interval_ms=interval_ms,
+        sample_count=len(samples),
+        samples=samples,
+        odi=summary.odi,
+        desaturation_count=len(summary.events),
+        desaturation_events=[event.model_dump() for event in summary.events],
+    )
+    await store_spo2_series(session, series, record.user_id)
+
+    return SpO2SeriesIngestResponse(
+        **summary.model_dump(),
+        sleep_record_id=sleep_record_id,
+        sample_count=len(samples),
+    )
+
+
+@router.post(
+    "/vitals",
+    response_model=VitalSeriesIngestResponse,
+    status_code=200,
+    dependencies=[Depends(admit_vitals_ingestion)],
+)
+async def ingest_vitals(
+    payload: VitalSeriesPayload,
+    session: AsyncSession = Depends(get_session),
+) -> VitalSeriesIngestResponse:
+    """
+    Ingest a per-minute heart-rate or HRV series.
+
+    Raw samples are kept for `VITALS_RAW_RETENTION_DAYS`; 1-minute and
+    5-minute rollups are updated in the same transaction. Samples already
+    received are ignored, so provider retries are safe.
+
+    Args:
+        payload (VitalSeriesPayload): The series to ingest.
+        session (AsyncSession): Database session.
+
+    Returns:
+        VitalSeriesIngestResponse: Number of new and duplicate samples.
+    """
+    return await store_vital_series(session, payload)
@@ -0,0 +1,252 @@
+"""
+Ahead-of-time smart alarm precomputation.
+
+Users register alarm target times (`alarm_schedules`). A background worker
+started from the application `lifespan` wakes up periodically, and shortly
+before each alarm window opens it batch-computes the prediction for every
+upcoming alarm and keeps it in an in-memory `PredictionStore`. The alarm
+read path then becomes a dictionary lookup.
+
+When new wearable data arrives for a user, `notify_new_data` marks that
+user's pending predictions as stale and wakes the worker to recompute them.
+
+In multi-worker mode the scheduler runs once, in the ingestion writer process,
+and every stored prediction is published to the HTTP workers (see app.writer).
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from uuid import UUID
+
+from sqlmodel import select
+
+from app.config import settings
+from app.models import AlarmPredictionResponse, AlarmSchedule, SmartAlarmResponse
+import app.logic as logic
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredPrediction:
+    """
+    Precomputed prediction for an alarm schedule.
+    """
+    schedule_id: UUID
+    user_id: UUID
+    target_time: datetime
+    sleep_record_id: UUID
+    computed_at: datetime
+    response: SmartAlarmResponse
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "schedule_id": str(self.schedule_id),
+            "user_id": str(self.user_id),
+            "target_time": self.target_time.isoformat(),
+            "sleep_record_id": str(self.sleep_record_id),
+            "computed_at": self.computed_at.isoformat(),
+            "response": self.response.model_dump(mode="json"),
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "StoredPrediction":
+        return cls(
+            schedule_id=UUID(data["schedule_id"]),
+            user_id=UUID(data["user_id"]),
+            target_time=datetime.fromisoformat(data["target_time"]),
+            sleep_record_id=UUID(data["sleep_record_id"]),
+            computed_at=datetime.fromisoformat(data["computed_at"]),
+            response=SmartAlarmResponse.model_validate(data["response"]),
+        )
+
+    def to_response(self) -> AlarmPredictionResponse:
+        return AlarmPredictionResponse(
+            **self.response.model_dump(),
+            schedule_id=self.schedule_id,
+            sleep_record_id=self.sleep_record_id,
+            computed_at=self.computed_at,
+            precomputed=True,
+        )
+
+
+class PredictionStore:
+    """
+    In-memory store of ready-made predictions keyed by schedule id.
+
+    Marking a user stale drops their predictions at once, so a failed
+    recompute falls back to the live path instead of serving old data. The
+    stale mark only guards against a prediction computed from data that was
+    replaced while it was being computed.
+    """
+
+    def __init__(self):
+        self._by_schedule: Dict[UUID, StoredPrediction] = {}
+        self._stale_users: Set[UUID] = set()
+
+    def get(self, schedule_id: UUID) -> Optional[StoredPrediction]:
+        return self._by_schedule.get(schedule_id)
+
+    def put(self, prediction: StoredPrediction) -> bool:
+        """
+        Store a prediction unless its user was marked stale since `clear_stale`.
+
+        Returns:
+            bool: True if the prediction was stored.
+        """
+        if prediction.user_id in self._stale_users:
+            return False
+        self._by_schedule[prediction.schedule_id] = prediction
+        return True
+
+    def all(self) -> List[StoredPrediction]:
+        return list(self._by_schedule.values())
+
+    def has_fresh(self, schedule_id: UUID) -> bool:
+        return self.get(schedule_id) is not None
+
+    def mark_stale(self, user_id: UUID) -> None:
+        self._stale_users.add(user_id)
+        stale = [key for key, value in self._by_schedule.items() if value.user_id == user_id]
+        for key in stale:
+            del self._by_schedule[key]
+
+    def clear_stale(self, user_id: UUID) -> None:
+        self._stale_users.discard(user_id)
+
+    def evict_before(self, cutoff: datetime) -> None:
+        expired = [key for key, value in self._by_schedule.items() if value.target_time < cutoff]
+        for key in expired:
+            del self._by_schedule[key]
+
+    def clear(self) -> None:
+        self._by_schedule.clear()
+        self._stale_users.clear()
+
+
+class AlarmScheduler:
+    """
+    Background worker that precomputes predictions before alarm windows open.
+
+    Attributes:
+        on_prediction: Optional coroutine called with every stored prediction
+            (used by the writer process to publish them to the HTTP workers).
+    """
+
+    def __init__(self, store: PredictionStore):
+        self.store = store
+        self.on_prediction: Optional[Callable[[StoredPrediction], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self) -> None:
+        """Ask the worker to run a tick as soon as possible."""
+        self._wakeup.set()
+
+    def notify_new_data(self, user_id: UUID) -> None:
+        """
+        Invalidate a user's predictions after new data for the night arrives.
+        """
+        self.store.mark_stale(user_id)
+        self.wake()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick(datetime.utcnow())
+            except Exception:
+                logger.exception("Alarm precomputation tick failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.SCHEDULER_TICK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def tick(self, now: datetime) -> int:
+        """
+        Precompute predictions for alarms whose window opens within the lead time.
+
+        Args:
+            now (datetime): Current time (naive UTC).
+
+        Returns:
+            int: Number of predictions computed.
+        """
+        from app.analysis import analyze_sleep_record, find_night_record
+        from app.database import async_session_maker
+
+        horizon = now + timedelta(
+            minutes=logic.SMART_ALARM_WINDOW_MINUTES + settings.SCHEDULER_LEAD_MINUTES
+        )
+        self.store.evict_before(now - timedelta(hours=1))
+
+        async with async_session_maker() as session:
+            statement = (
+                select(AlarmSchedule)
+                .where(AlarmSchedule.target_time >= now)
+                .where(AlarmSchedule.target_time <= horizon)
+                .order_by(AlarmSchedule.target_time)
+            )
+            schedules: List[AlarmSchedule] = (await session.exec(statement)).all()
+            # Desacopladas: el rollback tras un fallo no las expira
+            for schedule in schedules:
+                session.expunge(schedule)
+            due = [schedule for schedule in schedules if not self.store.has_fresh(schedule.id)]
+
+            computed = 0
+            for schedule in due:
+                # Se limpia antes de calcular: datos que lleguen durante el cálculo vuelven a
+                # marcarlo y `put` descarta el resultado (el siguiente tick lo recalcula)
+                self.store.clear_stale(schedule.user_id)
+                try:
+                    record = await find_night_record(session, schedule.user_id, schedule.target_time)
+                    if record is None:
+                        continue
+                    response = await analyze_sleep_record(session, record, schedule.target_time)
+                except logic.DataParsingError as e:
+                    logger.warning("Cannot precompute alarm %s: %s", schedule.id, e)
+                    continue
+                except Exception:
+                    # Una noche problemática no deja sin precálculo al resto del lote
+                    logger.exception("Precomputation of alarm %s failed", schedule.id)
+                    await session.rollback()
+                    continue
+                prediction = StoredPrediction(
+                    schedule_id=schedule.id,
+                    user_id=schedule.user_id,
+                    target_time=schedule.target_time,
+                    sleep_record_id=record.id,
+                    computed_at=datetime.utcnow(),
+                    response=response,
+                )
+                stored = self.store.put(prediction)
+                if stored and self.on_prediction is not None:
+                    await self.on_prediction(prediction)
+                computed += stored
+                # Cede el event loop entre noches para no penalizar las peticiones en curso
+                await asyncio.sleep(0)
+
+        if computed:
+            logger.info("Precomputed %s alarm predictions", computed)
+        return computed
+
+
+prediction_store = PredictionStore()
+alarm_scheduler = AlarmScheduler(prediction_store)
@@ -0,0 +1,173 @@
+"""
+Process launcher for the WeSleep API.
+
+    python -m app.serve [single|multi|writer] [--host H] [--port P] [--workers N]
+
+The mode defaults to `SERVE_MODE`:
+
+* `single`: one uvicorn process that reads and writes (the default).
+* `multi`: applies pending migrations and starts one ingestion writer process
+  (see app.writer). It then starts `SERVE_WORKERS` uvicorn workers (one per
+  CPU if 0) that serve reads and forward ingestion writes to the writer over
+  `INGEST_WRITER_ADDRESS`. Only one process writes to SQLite, so workers no
+  longer fail with "database is locked". The writer also runs the alarm
+  scheduler. The launcher restarts the writer if it dies. If it keeps dying,
+  the launcher stops and exits with an error so the container is restarted.
+* `writer`: only the writer process, e.g. to run it under its own supervisor.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Deque
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVE_MODES = ("single", "multi", "writer")
+
+_DEFAULT_WRITER_ADDRESS = os.path.join(tempfile.gettempdir(), "wesleep-ingest-writer.sock")
+_WRITER_START_TIMEOUT_SECONDS = 30.0
+_WRITER_CHECK_INTERVAL_SECONDS = 1.0
+# Más reinicios que estos dentro de la ventana: el launcher se detiene
+_WRITER_MAX_RESTARTS = 5
+_WRITER_RESTART_WINDOW_SECONDS = 60.0
+
+
+def _writer_main(address: str) -> None:
+    from app.writer import run_writer
+
+    asyncio.run(run_writer(address))
+
+
+def _migrate() -> None:
+    from app.database import engine, init_db
+
+    async def _run() -> None:
+        await init_db()
+        await engine.dispose()
+
+    asyncio.run(_run())
+
+
+def _start_writer(address: str) -> multiprocessing.Process:
+    # spawn: el proceso hijo no hereda el motor ni el event loop del padre
+    process = multiprocessing.get_context("spawn").Process(
+        target=_writer_main, args=(address,), name="wesleep-ingest-writer"
+    )
+    if os.path.exists(address):
+        os.remove(address)
+    process.start()
+
+    deadline = time.monotonic() + _WRITER_START_TIMEOUT_SECONDS
+    while not os.path.exists(address):
+        if not process.is_alive() or time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"Ingestion writer did not start listening on {address}")
+        time.sleep(0.05)
+    return process
+
+
+class _WriterSupervisor:
+    """
+    Background thread restarting the writer process when it exits.
+
+    Workers reconnect on their own. After `_WRITER_MAX_RESTARTS` restarts
+    within `_WRITER_RESTART_WINDOW_SECONDS` the launcher is sent SIGTERM, so
+    uvicorn stops its workers and `serve` exits with an error.
+    """
+
+    def __init__(self, address: str, process: multiprocessing.Process):
+        self.address = address
+        self.process = process
+        self.gave_up = False
+        self._stop = threading.Event()
+        self._restarts: Deque[float] = deque()
+        self._thread = threading.Thread(target=self._run, name="wesleep-writer-supervisor", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.process.terminate()
+        self.process.join(timeout=_WRITER_START_TIMEOUT_SECONDS)
+
+    def _run(self) -> None:
+        while not self._stop.wait(_WRITER_CHECK_INTERVAL_SECONDS):
+            if self.process.is_alive():
+                continue
+            now = time.monotonic()
+            while self._restarts and now - self._restarts[0] > _WRITER_RESTART_WINDOW_SECONDS:
+                self._restarts.popleft()
+            if len(self._restarts) >= _WRITER_MAX_RESTARTS:
+                logger.error("Ingestion writer keeps exiting; stopping the server")
+                self.gave_up = True
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+            logger.warning("Ingestion writer exited with code %s; restarting it", self.process.exitcode)
+            self._restarts.append(now)
+            try:
+                self.process = _start_writer(self.address)
+            except RuntimeError:
+                logger.exception("Ingestion writer restart failed")
+
+
+def serve(mode: str, host: str, port: int, workers: int) -> None:
+    """
+    Run the API in the given mode until interrupted.
+
+    Args:
+        mode (str): One of `SERVE_MODES`.
+        host (str): Bind address of the HTTP server.
+        port (int): Bind port of the HTTP server.
+        workers (int): HTTP worker processes in multi mode (0 = one per CPU).
+    """
+    import uvicorn
+
+    if mode == "single":
+        uvicorn.run("app.main:app", host=host, port=port)
+        return
+
+    address = settings.INGEST_WRITER_ADDRESS or _DEFAULT_WRITER_ADDRESS
+    if mode == "writer":
+        _writer_main(address)
+        return
+
+    # Migraciones una sola vez, antes de que los workers arranquen a la vez
+    _migrate()
+    supervisor = _WriterSupervisor(address, _start_writer(address))
+    supervisor.start()
+    # Los workers (spawn) leen la dirección del writer de su entorno
+    os.environ["INGEST_WRITER_ADDRESS"] = address
+    try:
+        uvicorn.run("app.main:app", host=host, port=port, workers=workers or os.cpu_count() or 1)
+    finally:
+        supervisor.stop()
+    if supervisor.gave_up:
+        sys.exit(1)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run the WeSleep API")
+    parser.add_argument("mode", nargs="?", choices=SERVE_MODES, default=settings.SERVE_MODE)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    args = parser.parse_args(argv)
+    if args.mode not in SERVE_MODES:
+        parser.error(f"SERVE_MODE must be one of {', '.join(SERVE_MODES)}")
+    serve(args.mode, args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
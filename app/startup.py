@@ -0,0 +1,161 @@
+"""
+Application warm-up and readiness.
+
+`app.main` imports only FastAPI and the settings, so the process can answer
+liveness (`/health`) as soon as possible. `warm_up` then does the expensive
+part of the startup, in phases whose durations are recorded:
+
+* `import_routers`: imports the routers, and with them SQLModel, SQLAlchemy,
+  the models and the business logic. This runs in a worker thread, so the
+  event loop stays responsive.
+* `init_db`: checks and applies pending light migrations.
+* `services`: connects to the ingestion writer, or starts the scheduler when
+  there is no writer (otherwise the writer process runs it).
+
+With `STARTUP_BACKGROUND` the lifespan does not wait for the warm-up.
+`/ready` answers 503 until the warm-up completes, and API requests that
+arrive earlier are held by `StartupGateMiddleware` for up to
+`STARTUP_TIMEOUT_SECONDS`.
+"""
+import asyncio
+import importlib
+import logging
+import sys
+from time import perf_counter
+from typing import Dict, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StartupState:
+    """Progress of the warm-up of the current application run."""
+
+    def __init__(self):
+        self.ready = False
+        self.error: Optional[str] = None
+        self.phases_ms: Dict[str, float] = {}
+        self._done: Optional[asyncio.Event] = None
+
+    def reset(self) -> None:
+        """Start a new run (one per lifespan; each has its own event loop)."""
+        self.ready = False
+        self.error = None
+        self.phases_ms = {}
+        self._done = asyncio.Event()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.error = error
+        self.ready = error is None
+        if self._done is not None:
+            self._done.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Wait for the warm-up to finish.
+
+        Returns:
+            bool: True if the application is ready within `timeout`.
+        """
+        if self.ready:
+            return True
+        if self._done is None:
+            return False
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.ready
+
+
+startup_state = StartupState()
+
+_routers_included = False
+
+
+async def warm_up(app: FastAPI) -> None:
+    """
+    Load the API and initialize its dependencies, timing each phase.
+
+    Raises:
+        Exception: Whatever failed, after recording it in `startup_state`.
+    """
+    global _routers_included
+    started = perf_counter()
+    phase_started = started
+
+    def _phase_done(name: str) -> None:
+        nonlocal phase_started
+        now = perf_counter()
+        startup_state.phases_ms[name] = round((now - phase_started) * 1000, 1)
+        phase_started = now
+
+    try:
+        routers = await asyncio.to_thread(importlib.import_module, "app.routers")
+        if not _routers_included:
+            app.include_router(routers.api_router, prefix=settings.API_V1_STR)
+            _routers_included = True
+        _phase_done("import_routers")
+
+        from app.database import init_db
+
+        await init_db()
+        _phase_done("init_db")
+
+        from app.scheduler import alarm_scheduler
+        from app.writer import start_writer_client
+
+        start_writer_client()
+        # Con writer, el planificador corre una sola vez en su proceso
+        if settings.SCHEDULER_ENABLED and not settings.INGEST_WRITER_ADDRESS:
+            alarm_scheduler.start()
+        _phase_done("services")
+    except Exception as e:
+        logger.exception("Startup failed")
+        startup_state.finish(error=str(e) or type(e).__name__)
+        raise
+
+    startup_state.phases_ms["total"] = round((perf_counter() - started) * 1000, 1)
+    startup_state.finish()
+    logger.info("Startup complete", extra={"startup_ms": startup_state.phases_ms})
+
+
+async def shut_down() -> None:
+    """Stop the services started by `warm_up` (only those that were loaded)."""
+    if "app.scheduler" in sys.modules:
+        await sys.modules["app.scheduler"].alarm_scheduler.stop()
+    if "app.writer" in sys.modules:
+        await sys.modules["app.writer"].stop_writer_client()
+
+
+class StartupGateMiddleware:
+    """
+    ASGI middleware holding API requests until the warm-up finishes.
+
+    Requests outside `prefix` (liveness, readiness) pass through. Once the
+    application is ready the check is a single attribute read.
+    """
+
+    def __init__(self, app, prefix: str):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and not startup_state.ready
+            and scope["path"].startswith(self.prefix)
+            and not await startup_state.wait(settings.STARTUP_TIMEOUT_SECONDS)
+        ):
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "El servicio está arrancando, reintente más tarde"},
+                headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,164 @@
+"""
+Reproducible cold-start benchmark for `app.main`.
+
+Each run uses a fresh interpreter, so nothing is already imported or cached
+in memory. A run measures:
+
+* the import time of `app.main`, broken down by top-level package with
+  `python -X importtime`;
+* the warm-up phases of `app.startup.warm_up` (routers import, `init_db`,
+  services), against a new database (all migrations applied) and against an
+  up-to-date one (the usual replica start).
+
+Usage:
+
+    python -m app.startup_benchmark [--runs 5] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, List
+
+_RESULT_PREFIX = "STARTUP_RESULT "
+_REPORT_TOP_PACKAGES = 12
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)$")
+
+# Importa app.main y ejecuta su lifespan completo, midiendo cada parte
+_CHILD_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import app.main
+import_ms = (time.perf_counter() - started) * 1000
+from app.startup import startup_state
+
+async def _run():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        pass
+
+asyncio.run(_run())
+print("STARTUP_RESULT " + json.dumps({"import_ms": round(import_ms, 1), **startup_state.phases_ms}))
+"""
+
+
+def _child_env(database_path: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        SQLITE_URL=f"sqlite+aiosqlite:///{database_path}",
+        STARTUP_BACKGROUND="false",
+        SCHEDULER_ENABLED="false",
+        LOG_LEVEL="WARNING",
+    )
+    env.pop("INGEST_WRITER_ADDRESS", None)
+    return env
+
+
+def measure_imports(env: Dict[str, str], modules: str) -> Dict[str, float]:
+    """
+    Import `modules` with `-X importtime` and add up the self time of every
+    imported module by root package (e.g. all of `sqlalchemy.*`).
+
+    Returns:
+        Dict[str, float]: Milliseconds per root package, plus `total`.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modules}"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    by_package: Dict[str, float] = defaultdict(float)
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            by_package[match.group(3).split(".")[0]] += int(match.group(1)) / 1000
+    by_package["total"] = sum(by_package.values())
+    return dict(by_package)
+
+
+def measure_startup(env: Dict[str, str]) -> Dict[str, float]:
+    """
+    Run `app.main` and its lifespan in a fresh interpreter.
+
+    Returns:
+        Dict[str, float]: `import_ms` and the warm-up phases in milliseconds.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-c", _CHILD_SCRIPT], env=env, capture_output=True, text=True, check=True
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(_RESULT_PREFIX):
+            return json.loads(line[len(_RESULT_PREFIX):])
+    raise RuntimeError(f"Benchmark child produced no result:\n{completed.stderr}")
+
+
+def _median(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    keys = {key for sample in samples for key in sample}
+    return {key: round(statistics.median(sample.get(key, 0.0) for sample in samples), 1) for key in keys}
+
+
+def run_benchmark(runs: int) -> Dict[str, Any]:
+    """
+    Run the benchmark `runs` times and return the medians.
+
+    Returns:
+        Dict[str, Any]: Import time by package before liveness (`app.main`)
+        and for the whole application (`app.main` plus `app.routers`), and the
+        `fresh_db` / `migrated_db` timings (import, warm-up phases, `ready_ms`).
+    """
+    main_imports, full_imports, fresh, migrated = [], [], [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(runs):
+            env = _child_env(os.path.join(tmp, f"bench-{run}.db"))
+            main_imports.append(measure_imports(env, "app.main"))
+            full_imports.append(measure_imports(env, "app.main, app.routers"))
+            fresh.append(measure_startup(env))
+            migrated.append(measure_startup(env))
+
+    result = {
+        "runs": runs,
+        "imports_ms": {"app.main": _median(main_imports), "app.main+routers": _median(full_imports)},
+        "fresh_db": _median(fresh),
+        "migrated_db": _median(migrated),
+    }
+    for name in ("fresh_db", "migrated_db"):
+        timings = result[name]
+        timings["ready_ms"] = round(timings.get("import_ms", 0) + timings.get("total", 0), 1)
+    return result
+
+
+def _print_report(result: Dict[str, Any]) -> None:
+    print(f"Cold start of app.main (median of {result['runs']} runs)\n")
+    main_imports = result["imports_ms"]["app.main"]
+    full_imports = result["imports_ms"]["app.main+routers"]
+    print("Import self time by package (-X importtime):")
+    print(f"  {'package':<20} {'app.main':>12} {'+ routers':>12}")
+    packages = sorted((name for name in full_imports if name != "total"), key=lambda name: -full_imports[name])
+    rows = [(name, main_imports.get(name, 0), full_imports[name]) for name in packages[:_REPORT_TOP_PACKAGES]]
+    rest = packages[_REPORT_TOP_PACKAGES:]
+    rows.append(("other", sum(main_imports.get(n, 0) for n in rest), sum(full_imports[n] for n in rest)))
+    rows.append(("total", main_imports["total"], full_imports["total"]))
+    for name, before_liveness, whole_app in rows:
+        print(f"  {name:<20} {before_liveness:>9.1f} ms {whole_app:>9.1f} ms")
+
+    print(f"\n  {'phase':<20} {'fresh db':>12} {'migrated db':>12}")
+    labels = {"import_ms": "import app.main", "total": "warm-up total", "ready_ms": "time to ready"}
+    for phase in ("import_ms", "import_routers", "init_db", "services", "total", "ready_ms"):
+        label = labels.get(phase, phase)
+        print(f"  {label:<20} {result['fresh_db'].get(phase, 0):>9.1f} ms {result['migrated_db'].get(phase, 0):>9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WeSleep cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print the medians as JSON")
+    args = parser.parse_args()
+    benchmark = run_benchmark(args.runs)
+    if args.json:
+        print(json.dumps(benchmark, indent=2))
+    else:
+        _print_report(benchmark)
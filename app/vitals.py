@@ -0,0 +1,257 @@
+"""
+Heart-rate and HRV time series with automatic rollups.
+
+Raw per-minute samples are kept only for `VITALS_RAW_RETENTION_DAYS`. On every
+ingestion the new samples are folded into 1-minute and 5-minute rollups
+(sum/count/min/max), so the alarm window and the night can be summarized with
+a handful of indexed rows instead of scanning raw samples. 1-minute rollups
+(one row per sample at the usual rate) are kept for
+`VITALS_MINUTE_ROLLUP_RETENTION_DAYS`; 5-minute rollups are kept long term.
+
+Retries are recognized by the raw table while it has the samples, and later
+by the time ranges of the series already ingested (`vital_ingest_ranges`), so
+late data is still folded into the rollups without double counting.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import delete, select
+
+from app.config import settings
+from app.database import to_naive_utc
+from app.models import (
+    VitalIngestRange,
+    VitalMetric,
+    VitalRollup,
+    VitalRollupBucket,
+    VitalSample,
+    VitalSeriesIngestResponse,
+    VitalSeriesPayload,
+)
+
+# Resoluciones mantenidas (segundos)
+ROLLUP_RESOLUTIONS = (60, 300)
+# Resoluciones con retención propia (las demás se conservan)
+_MINUTE_RESOLUTION_S = 60
+
+_EPOCH = datetime(1970, 1, 1)
+_UPSERT_BATCH_ROWS = 500
+
+
+def _bucket_start(ts: datetime, resolution_s: int) -> datetime:
+    seconds = int((ts - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % resolution_s)
+
+
+def _dialect_helpers(session: AsyncSession) -> Tuple[Callable, Callable, Callable]:
+    """Devuelve (insert con upsert, mínimo escalar, máximo escalar) del dialecto."""
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert, func.least, func.greatest
+    return sqlite.insert, func.min, func.max
+
+
+def _covered(ts: datetime, ranges: List[Tuple[datetime, datetime]], starts: List[datetime]) -> bool:
+    # `ranges` fusionados y ordenados por inicio
+    index = bisect_right(starts, ts) - 1
+    return index >= 0 and ts <= ranges[index][1]
+
+
+def _merge_ranges(ranges: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    merged: List[Tuple[datetime, datetime]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def ingest_vital_series(session: AsyncSession, payload: VitalSeriesPayload) -> VitalSeriesIngestResponse:
+    """
+    Store a vital series and fold it into the rollups.
+
+    Samples already ingested (provider retries) are skipped so the rollups are
+    not double counted. Recent samples are checked against the raw table.
+    Older ones, whose raw rows may have been purged, are checked against the
+    ranges of previously ingested series (`vital_ingest_ranges`). A late series
+    overlapping one already ingested only contributes its samples outside it.
+    Late samples go to the rollups that are still retained, not to the raw
+    table. Raw samples and 1-minute rollups past their retention are purged
+    for the same user and metric. Does not commit.
+
+    Args:
+        session (AsyncSession): Database session.
+        payload (VitalSeriesPayload): Incoming series.
+
+    Returns:
+        VitalSeriesIngestResponse: Number of new and duplicate samples.
+    """
+    now = datetime.utcnow()
+    raw_cutoff = now - timedelta(days=settings.VITALS_RAW_RETENTION_DAYS)
+    minute_cutoff = now - timedelta(days=settings.VITALS_MINUTE_ROLLUP_RETENTION_DAYS)
+    start_at = to_naive_utc(payload.start_at)
+    step = timedelta(seconds=payload.interval_seconds)
+    samples: List[Tuple[datetime, float]] = [
+        (start_at + step * index, float(value))
+        for index, value in enumerate(payload.values)
+        if value is not None
+    ]
+    if not samples:
+        return VitalSeriesIngestResponse(inserted=0, duplicates=0)
+
+    new_samples: List[Tuple[datetime, float]] = []
+    late = [(ts, value) for ts, value in samples if ts < raw_cutoff]
+    if late:
+        ranges_statement = (
+            select(VitalIngestRange.start_at, VitalIngestRange.end_at)
+            .where(VitalIngestRange.user_id == payload.user_id)
+            .where(VitalIngestRange.metric == payload.metric)
+            .where(VitalIngestRange.start_at <= late[-1][0])
+            .where(VitalIngestRange.end_at >= late[0][0])
+        )
+        ranges = _merge_ranges([tuple(row) for row in (await session.exec(ranges_statement)).all()])
+        starts = [start for start, _ in ranges]
+        new_samples += [(ts, value) for ts, value in late if not _covered(ts, ranges, starts)]
+
+    recent = samples[len(late):]
+    new_recent: List[Tuple[datetime, float]] = []
+    if recent:
+        existing_statement = (
+            select(VitalSample.ts)
+            .where(VitalSample.user_id == payload.user_id)
+            .where(VitalSample.metric == payload.metric)
+            .where(VitalSample.ts >= recent[0][0])
+            .where(VitalSample.ts <= recent[-1][0])
+        )
+        existing = set((await session.exec(existing_statement)).all())
+        new_recent = [(ts, value) for ts, value in recent if ts not in existing]
+        new_samples += new_recent
+
+    if new_recent:
+        await session.exec(
+            VitalSample.__table__.insert(),
+            params=[
+                {"user_id": payload.user_id, "metric": payload.metric, "ts": ts, "value": value}
+                for ts, value in new_recent
+            ],
+        )
+
+    if new_samples:
+        session.add(
+            VitalIngestRange(
+                user_id=payload.user_id,
+                metric=payload.metric,
+                start_at=samples[0][0],
+                end_at=samples[-1][0],
+            )
+        )
+
+        insert, least, greatest = _dialect_helpers(session)
+        table = VitalRollup.__table__
+        for resolution_s in ROLLUP_RESOLUTIONS:
+            buckets: Dict[datetime, List[float]] = defaultdict(lambda: [0.0, 0, float("inf"), float("-inf")])
+            for ts, value in new_samples:
+                if resolution_s == _MINUTE_RESOLUTION_S and ts < minute_cutoff:
+                    continue
+                bucket = buckets[_bucket_start(ts, resolution_s)]
+                bucket[0] += value
+                bucket[1] += 1
+                bucket[2] = min(bucket[2], value)
+                bucket[3] = max(bucket[3], value)
+
+            rows = [
+                {
+                    "user_id": payload.user_id,
+                    "metric": payload.metric,
+                    "resolution_s": resolution_s,
+                    "bucket_start": bucket_start,
+                    "total": total,
+                    "count": count,
+                    "min_value": min_value,
+                    "max_value": max_value,
+                }
+                for bucket_start, (total, count, min_value, max_value) in buckets.items()
+            ]
+            # Lotes acotados para no superar el límite de parámetros de SQLite
+            for offset in range(0, len(rows), _UPSERT_BATCH_ROWS):
+                statement = insert(table).values(rows[offset:offset + _UPSERT_BATCH_ROWS])
+                statement = statement.on_conflict_do_update(
+                    index_elements=[table.c.user_id, table.c.metric, table.c.resolution_s, table.c.bucket_start],
+                    set_={
+                        "total": table.c.total + statement.excluded.total,
+                        "count": table.c.count + statement.excluded.count,
+                        "min_value": least(table.c.min_value, statement.excluded.min_value),
+                        "max_value": greatest(table.c.max_value, statement.excluded.max_value),
+                    },
+                )
+                await session.exec(statement)
+
+    # Retención de muestras crudas y de agregaciones por minuto (las de 5 min se conservan)
+    await session.exec(
+        delete(VitalSample)
+        .where(VitalSample.user_id == payload.user_id)
+        .where(VitalSample.metric == payload.metric)
+        .where(VitalSample.ts < raw_cutoff)
+    )
+    await session.exec(
+        delete(VitalRollup)
+        .where(VitalRollup.user_id == payload.user_id)
+        .where(VitalRollup.metric == payload.metric)
+        .where(VitalRollup.resolution_s == _MINUTE_RESOLUTION_S)
+        .where(VitalRollup.bucket_start < minute_cutoff)
+    )
+
+    return VitalSeriesIngestResponse(inserted=len(new_samples), duplicates=len(samples) - len(new_samples))
+
+
+async def get_rollups(
+    session: AsyncSession,
+    user_id: UUID,
+    metric: VitalMetric,
+    start: datetime,
+    end: datetime,
+    resolution_s: int = 60,
+) -> List[VitalRollupBucket]:
+    """
+    Return the rollup buckets of a metric overlapping [start, end).
+
+    Args:
+        session (AsyncSession): Database session.
+        user_id (UUID): Owner of the series.
+        metric (VitalMetric): Metric to query.
+        start (datetime): Range start.
+        end (datetime): Range end (exclusive).
+        resolution_s (int): One of `ROLLUP_RESOLUTIONS`.
+
+    Returns:
+        List[VitalRollupBucket]: Buckets ordered by start.
+    """
+    if resolution_s not in ROLLUP_RESOLUTIONS:
+        raise ValueError(f"Unsupported rollup resolution: {resolution_s}")
+
+    statement = (
+        select(VitalRollup)
+        .where(VitalRollup.user_id == user_id)
+        .where(VitalRollup.metric == metric)
+        .where(VitalRollup.resolution_s == resolution_s)
+        .where(VitalRollup.bucket_start >= _bucket_start(to_naive_utc(start), resolution_s))
+        .where(VitalRollup.bucket_start < to_naive_utc(end))
+        .order_by(VitalRollup.bucket_start)
+    )
+    return [
+        VitalRollupBucket(
+            bucket_start=row.bucket_start,
+            mean=row.total / row.count,
+            min=row.min_value,
+            max=row.max_value,
+            count=row.count,
+        )
+        for row in (await session.exec(statement)).all()
+        if row.count
+    ]
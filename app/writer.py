@@ -0,0 +1,548 @@
+"""
+Ingestion writes, optionally funnelled through a single writer process.
+
+Several HTTP workers writing to one SQLite file contend for its lock. In the
+multi-worker mode (`python -m app.serve multi`) one writer process owns all
+ingestion writes. Workers forward them over a unix socket set in
+`INGEST_WRITER_ADDRESS`, and the writer commits them in batches of up to
+`INGEST_WRITER_BATCH_SIZE`, waiting at most `INGEST_WRITER_MAX_DELAY_MS` to
+fill a batch.
+
+The protocol is newline-delimited JSON. A worker sends
+`{"id", "op", "data", "request_id"}` and the writer answers
+`{"id", "result"}` or `{"id", "error"}`. After each commit, the writer also
+sends `{"event": "new_data", "user_id"}` to every connected worker so they
+all invalidate their in-memory caches.
+
+The writer process also runs the only alarm scheduler (workers do not start
+theirs). Each stored prediction is sent as `{"event": "prediction",
+"prediction"}`, and a worker that connects first receives every current one.
+Workers send `{"event": "wake"}` to have it run a tick now (e.g. after an
+alarm is registered inside the lead time).
+
+Routes call the `store_*` functions. Without `INGEST_WRITER_ADDRESS` these
+functions write with the request session, as in single-process mode.
+"""
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import os
+import signal
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.analysis import notify_new_data
+from app.config import settings
+from app.database import async_session_maker, engine
+from app.log import get_request_id, request_id_var
+from app.models import SleepRecord, SpO2Series, VitalSeriesIngestResponse, VitalSeriesPayload
+from app.scheduler import StoredPrediction, alarm_scheduler, prediction_store
+from app.vitals import ingest_vital_series
+
+logger = logging.getLogger(__name__)
+
+# Una serie de SpO2 de 48 h en base64 supera el límite de línea por defecto (64 KiB)
+_STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class WriterUnavailable(HTTPException):
+    """The writer process cannot be reached or did not answer in time (503, retry)."""
+
+    def __init__(self, reason: str):
+        super().__init__(
+            status_code=503,
+            detail="Servicio de escritura no disponible, reintente más tarde",
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+        )
+        self.reason = reason
+
+
+class WriterError(HTTPException):
+    """The writer process failed to apply a write (500)."""
+
+    def __init__(self, reason: str):
+        super().__init__(status_code=500, detail="Error interno procesando los datos")
+        self.reason = reason
+
+
+# --- Operations ---
+
+WriteOutcome = Tuple[Any, Optional[UUID]]
+
+
+@dataclass(frozen=True)
+class WriteOperation:
+    """
+    A write that can run locally or in the writer process.
+
+    Attributes:
+        execute: Applies the write to a session without committing. Returns
+            the result and the user whose data changed (None if nothing changed).
+        encode: Turns the argument into JSON-compatible data for the socket.
+        decode: Rebuilds the argument in the writer process.
+    """
+    execute: Callable[[AsyncSession, Any], Awaitable[WriteOutcome]]
+    encode: Callable[[Any], Dict[str, Any]]
+    decode: Callable[[Dict[str, Any]], Any]
+
+
+async def _execute_sleep_record(session: AsyncSession, record: SleepRecord) -> WriteOutcome:
+    session.add(record)
+    await session.flush()
+    return str(record.id), record.user_id
+
+
+async def _execute_spo2_series(session: AsyncSession, item: Tuple[SpO2Series, UUID]) -> WriteOutcome:
+    series, user_id = item
+    await session.merge(series)
+    return None, user_id
+
+
+def _encode_spo2_series(item: Tuple[SpO2Series, UUID]) -> Dict[str, Any]:
+    series, user_id = item
+    return {
+        "series": series.model_dump(mode="json", exclude={"samples"}),
+        "samples": base64.b64encode(series.samples).decode("ascii"),
+        "user_id": str(user_id),
+    }
+
+
+def _decode_spo2_series(data: Dict[str, Any]) -> Tuple[SpO2Series, UUID]:
+    series = SpO2Series.model_validate({**data["series"], "samples": base64.b64decode(data["samples"])})
+    return series, UUID(data["user_id"])
+
+
+async def _execute_vital_series(session: AsyncSession, payload: VitalSeriesPayload) -> WriteOutcome:
+    result = await ingest_vital_series(session, payload)
+    return result.model_dump(mode="json"), payload.user_id if result.inserted else None
+
+
+WRITE_OPERATIONS: Dict[str, WriteOperation] = {
+    "sleep_record": WriteOperation(
+        _execute_sleep_record,
+        lambda record: record.model_dump(mode="json"),
+        SleepRecord.model_validate,
+    ),
+    "spo2_series": WriteOperation(_execute_spo2_series, _encode_spo2_series, _decode_spo2_series),
+    "vital_series": WriteOperation(
+        _execute_vital_series,
+        lambda payload: payload.model_dump(mode="json"),
+        VitalSeriesPayload.model_validate,
+    ),
+}
+
+
+async def _submit(session: AsyncSession, op: str, argument: Any) -> Any:
+    if _client is not None:
+        return await _client.submit(op, WRITE_OPERATIONS[op].encode(argument))
+
+    result, user_id = await WRITE_OPERATIONS[op].execute(session, argument)
+    await session.commit()
+    if user_id is not None:
+        notify_new_data(user_id)
+    return result
+
+
+async def store_sleep_record(session: AsyncSession, record: SleepRecord) -> None:
+    """
+    Persist a new sleep record and notify the caches of its user.
+
+    Raises:
+        WriterUnavailable: In multi-worker mode, if the writer cannot be reached.
+        WriterError: In multi-worker mode, if the writer failed to store it.
+    """
+    await _submit(session, "sleep_record", record)
+
+
+async def store_spo2_series(session: AsyncSession, series: SpO2Series, user_id: UUID) -> None:
+    """
+    Persist (or replace) the SpO2 series of a sleep record owned by `user_id`.
+
+    Raises:
+        WriterUnavailable: In multi-worker mode, if the writer cannot be reached.
+        WriterError: In multi-worker mode, if the writer failed to store it.
+    """
+    await _submit(session, "spo2_series", (series, user_id))
+
+
+async def store_vital_series(session: AsyncSession, payload: VitalSeriesPayload) -> VitalSeriesIngestResponse:
+    """
+    Persist a heart-rate/HRV series and update its rollups.
+
+    Raises:
+        WriterUnavailable: In multi-worker mode, if the writer cannot be reached.
+        WriterError: In multi-worker mode, if the writer failed to store it.
+    """
+    return VitalSeriesIngestResponse.model_validate(await _submit(session, "vital_series", payload))
+
+
+# --- Writer process ---
+
+@dataclass
+class _PendingWrite:
+    message_id: int
+    op: str
+    data: Dict[str, Any]
+    request_id: Optional[str]
+    client: asyncio.StreamWriter
+
+
+@dataclass
+class _Outcome:
+    write: _PendingWrite
+    result: Any = None
+    user_id: Optional[UUID] = None
+    error: Optional[str] = None
+
+
+class IngestWriter:
+    """
+    Socket server applying forwarded writes in batched transactions.
+
+    If a batch fails, its writes are retried one per transaction, so one bad
+    write does not fail the others.
+    """
+
+    def __init__(
+        self,
+        session_maker: Callable[[], AsyncSession] = async_session_maker,
+        batch_size: Optional[int] = None,
+        max_delay_ms: Optional[float] = None,
+    ):
+        self.session_maker = session_maker
+        self.batch_size = batch_size or settings.INGEST_WRITER_BATCH_SIZE
+        self.max_delay = (settings.INGEST_WRITER_MAX_DELAY_MS if max_delay_ms is None else max_delay_ms) / 1000
+        self.batches_committed = 0
+        self._queue: "asyncio.Queue[_PendingWrite]" = asyncio.Queue()
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._address: Optional[str] = None
+
+    async def start(self, address: str) -> None:
+        """Listen on the unix socket `address` (replacing a stale one)."""
+        if os.path.exists(address):
+            os.remove(address)
+        self._server = await asyncio.start_unix_server(self._handle_client, path=address, limit=_STREAM_LIMIT)
+        os.chmod(address, 0o600)
+        self._address = address
+        self._batcher = asyncio.create_task(self._run_batches())
+        logger.info("Ingestion writer listening on %s", address)
+
+    async def stop(self) -> None:
+        """Stop accepting connections, flush queued writes and disconnect workers."""
+        if self._server is not None:
+            self._server.close()
+        await self._queue.join()
+        if self._batcher is not None:
+            self._batcher.cancel()
+        for client in list(self._clients):
+            client.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+        if self._address and os.path.exists(self._address):
+            os.remove(self._address)
+
+    async def publish_prediction(self, prediction: StoredPrediction) -> None:
+        """Send a newly stored alarm prediction to every connected worker."""
+        await self._broadcast({"event": "prediction", "prediction": prediction.to_json()})
+
+    async def _broadcast(self, message: Dict[str, Any]) -> None:
+        for client in list(self._clients):
+            await self._send(client, message)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, client: asyncio.StreamWriter) -> None:
+        self._clients.add(client)
+        # Un worker que (re)conecta recibe las predicciones ya calculadas
+        for prediction in prediction_store.all():
+            await self._send(client, {"event": "prediction", "prediction": prediction.to_json()})
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message.get("event") == "wake":
+                    alarm_scheduler.wake()
+                    continue
+                await self._queue.put(
+                    _PendingWrite(message["id"], message["op"], message["data"], message.get("request_id"), client)
+                )
+        except (ConnectionError, ValueError, KeyError) as e:
+            logger.warning("Dropping writer client: %s", e)
+        finally:
+            self._clients.discard(client)
+            client.close()
+
+    async def _run_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._commit_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _apply(self, batch: List[_PendingWrite]) -> List[_Outcome]:
+        outcomes = []
+        async with self.session_maker() as session:
+            for write in batch:
+                operation = WRITE_OPERATIONS[write.op]
+                token = request_id_var.set(write.request_id)
+                try:
+                    result, user_id = await operation.execute(session, operation.decode(write.data))
+                finally:
+                    request_id_var.reset(token)
+                outcomes.append(_Outcome(write, result, user_id))
+            await session.commit()
+        self.batches_committed += 1
+        return outcomes
+
+    async def _apply_one(self, write: _PendingWrite) -> _Outcome:
+        try:
+            return (await self._apply([write]))[0]
+        except Exception as e:
+            logger.exception("Write %s failed", write.op, extra={"request_id": write.request_id})
+            return _Outcome(write, error=str(e) or type(e).__name__)
+
+    async def _commit_batch(self, batch: List[_PendingWrite]) -> None:
+        if len(batch) == 1:
+            outcomes = [await self._apply_one(batch[0])]
+        else:
+            try:
+                outcomes = await self._apply(batch)
+            except Exception:
+                logger.warning("Batch of %s writes failed; retrying one by one", len(batch), exc_info=True)
+                outcomes = [await self._apply_one(write) for write in batch]
+
+        # Primero las invalidaciones: cada worker las procesa antes que su respuesta.
+        # También en este proceso, que tiene el planificador y su caché de noches
+        for user_id in {outcome.user_id for outcome in outcomes if outcome.user_id is not None}:
+            notify_new_data(user_id)
+            await self._broadcast({"event": "new_data", "user_id": str(user_id)})
+        for outcome in outcomes:
+            reply: Dict[str, Any] = {"id": outcome.write.message_id}
+            if outcome.error is None:
+                reply["result"] = outcome.result
+            else:
+                reply["error"] = outcome.error
+            await self._send(outcome.write.client, reply)
+
+    async def _send(self, client: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+        if client.is_closing():
+            return
+        try:
+            client.write(json.dumps(message).encode() + b"\n")
+            await client.drain()
+        except ConnectionError:
+            self._clients.discard(client)
+
+
+async def run_writer(address: str) -> None:
+    """
+    Run the writer process until SIGTERM/SIGINT.
+
+    Switches SQLite to WAL so the workers' reads do not block the writer, and
+    runs the alarm scheduler, publishing its predictions to the workers.
+    """
+    from app.log import setup_logging, shutdown_logging
+
+    setup_logging()
+    if engine.dialect.name == "sqlite":
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    writer = IngestWriter()
+    await writer.start(address)
+    if settings.SCHEDULER_ENABLED:
+        alarm_scheduler.on_prediction = writer.publish_prediction
+        alarm_scheduler.start()
+    try:
+        await stop.wait()
+    finally:
+        await alarm_scheduler.stop()
+        await writer.stop()
+        await engine.dispose()
+        shutdown_logging()
+
+
+# --- Worker side ---
+
+class WriterClient:
+    """
+    Connection from an HTTP worker to the writer process.
+
+    Reconnects in the background. New-data events from the writer are applied
+    to this worker's caches with `notify_new_data`, and published alarm
+    predictions are stored in this worker's `prediction_store`.
+    """
+
+    def __init__(self, address: str, timeout: float):
+        self.address = address
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._connected = asyncio.Event()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        backoff = 0.1
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.address, limit=_STREAM_LIMIT)
+            except OSError:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+                continue
+
+            backoff = 0.1
+            self._writer = writer
+            self._connected.set()
+            try:
+                while line := await reader.readline():
+                    self._dispatch(json.loads(line))
+            except (ConnectionError, ValueError) as e:
+                logger.warning("Connection to the ingestion writer failed: %s", e)
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(WriterUnavailable("Connection to the ingestion writer lost"))
+                self._pending.clear()
+
+    def _dispatch(self, message: Dict[str, Any]) -> None:
+        if message.get("event") == "new_data":
+            notify_new_data(UUID(message["user_id"]))
+            return
+        if message.get("event") == "prediction":
+            prediction = StoredPrediction.from_json(message["prediction"])
+            # Llega por el mismo socket que new_data: es posterior a toda invalidación ya recibida
+            prediction_store.clear_stale(prediction.user_id)
+            prediction_store.put(prediction)
+            prediction_store.evict_before(datetime.utcnow() - timedelta(hours=1))
+            return
+        future = self._pending.pop(message["id"], None)
+        if future is None or future.done():
+            return
+        if "error" in message:
+            future.set_exception(WriterError(message["error"]))
+        else:
+            future.set_result(message.get("result"))
+
+    def send_event(self, event: Dict[str, Any]) -> bool:
+        """
+        Send a fire-and-forget event to the writer.
+
+        Returns:
+            bool: False if not connected (the event is dropped).
+        """
+        if self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(json.dumps(event).encode() + b"\n")
+        return True
+
+    async def submit(self, op: str, data: Dict[str, Any]) -> Any:
+        """
+        Forward a write and wait for its result.
+
+        Raises:
+            WriterUnavailable: If not connected or no answer within `timeout`.
+            WriterError: If the writer failed to apply the write.
+        """
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise WriterUnavailable("Ingestion writer is not reachable")
+
+        message_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        message = {"id": message_id, "op": op, "data": data, "request_id": get_request_id()}
+        try:
+            self._writer.write(json.dumps(message).encode() + b"\n")
+            await self._writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise WriterUnavailable("Ingestion writer did not answer in time")
+        except (ConnectionError, AttributeError):
+            raise WriterUnavailable("Connection to the ingestion writer lost")
+        finally:
+            self._pending.pop(message_id, None)
+
+
+_client: Optional[WriterClient] = None
+
+
+def start_writer_client() -> None:
+    """Connect this worker to the writer if `INGEST_WRITER_ADDRESS` is set."""
+    global _client
+    if settings.INGEST_WRITER_ADDRESS and _client is None:
+        _client = WriterClient(settings.INGEST_WRITER_ADDRESS, settings.INGEST_WRITER_TIMEOUT_SECONDS)
+        _client.start()
+
+
+def wake_scheduler() -> None:
+    """
+    Ask the alarm scheduler to run a tick now: the local one, or the writer's
+    in multi-worker mode. If the writer is unreachable its periodic tick
+    catches up within `SCHEDULER_TICK_SECONDS`.
+    """
+    if _client is None:
+        alarm_scheduler.wake()
+    else:
+        _client.send_event({"event": "wake"})
+
+
+def writer_reachable() -> bool:
+    """True in single-process mode or while connected to the writer."""
+    return _client is None or _client.connected
+
+
+async def stop_writer_client() -> None:
+    """Disconnect from the writer (no-op in single-process mode)."""
+    global _client
+    if _client is not None:
+        await _client.stop()
+        _client = None
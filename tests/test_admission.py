@@ -0,0 +1,99 @@
+import pytest
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
+
+from app import admission
+from app.admission import AdmissionController, TokenBucket
+from app.main import app
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, burst=2, clock=clock)
+
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now = 0.5
+    assert bucket.try_acquire() == 0.0
+
+
+def test_provider_rate_limit_returns_429_with_retry_after():
+    clock = FakeClock()
+    controller = AdmissionController(
+        rate_per_provider=1.0, burst_per_provider=1, max_concurrency=10, read_reserve=2, clock=clock
+    )
+
+    controller.check_provider_rate("apple")
+    with pytest.raises(HTTPException) as exc:
+        controller.check_provider_rate("apple")
+    assert exc.value.status_code == 429
+    assert exc.value.headers["Retry-After"] == "1"
+
+    # Otro proveedor tiene su propio bucket
+    controller.check_provider_rate("garmin")
+
+
+def test_concurrency_limit_keeps_reserve_for_alarm_reads():
+    controller = AdmissionController(
+        rate_per_provider=1000.0, burst_per_provider=1000, max_concurrency=4, read_reserve=1
+    )
+
+    for _ in range(3):
+        controller.acquire_ingestion_slot()
+    with pytest.raises(HTTPException) as exc:
+        controller.acquire_ingestion_slot()
+    assert exc.value.status_code == 503
+    assert "Retry-After" in exc.value.headers
+
+    # Las lecturas en curso desplazan a la ingesta
+    controller.release_ingestion()
+    controller.enter_read()
+    controller.enter_read()
+    with pytest.raises(HTTPException):
+        controller.acquire_ingestion_slot()
+
+    controller.exit_read()
+    controller.acquire_ingestion_slot()
+
+
+def test_provider_buckets_are_capped():
+    controller = AdmissionController(
+        rate_per_provider=1.0, burst_per_provider=1, max_concurrency=10, read_reserve=0, max_buckets=2
+    )
+
+    controller.check_provider_rate("apple")
+    controller.check_provider_rate("garmin")
+    controller.check_provider_rate("oura")
+    assert list(controller._buckets) == ["garmin", "oura"]
+
+
+@pytest.mark.asyncio
+async def test_overload_is_shed_before_reading_the_body(monkeypatch):
+    controller = AdmissionController(
+        rate_per_provider=1000.0, burst_per_provider=1000, max_concurrency=2, read_reserve=1
+    )
+    monkeypatch.setattr(admission, "admission_controller", controller)
+
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            controller.ingest_in_flight = 1
+            # Un cuerpo inválido daría 422 si se llegara a validar
+            response = await ac.post("/api/v1/webhooks/wearable/", content=b"not json")
+            assert response.status_code == 503
+            assert "Retry-After" in response.headers
+
+            controller.ingest_in_flight = 0
+            response = await ac.post("/api/v1/webhooks/wearable/", content=b"not json")
+            assert response.status_code == 422
+            assert controller.ingest_in_flight == 0
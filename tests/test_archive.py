@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.archive import archive_old_records, get_sleep_record, get_spo2_summary, list_sleep_records
+from app.config import settings
+from app.migrations import upgrade
+from app.models import SleepRecord, SleepRecordArchiveIndex, SpO2Series
+
+
+@pytest.mark.asyncio
+async def test_archive_moves_old_records_and_reads_fall_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'hot.db'}")
+    await upgrade(engine)
+    session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    user_id = uuid4()
+    now = datetime.utcnow()
+    old = SleepRecord(
+        user_id=user_id,
+        timestamp=now - timedelta(days=200),
+        provider_source="test_provider",
+        record_id_provider="old",
+        payload={"duration": 1},
+    )
+    recent = SleepRecord(
+        user_id=user_id,
+        timestamp=now - timedelta(days=2),
+        provider_source="test_provider",
+        record_id_provider="recent",
+        payload={"duration": 2},
+    )
+
+    async with session_maker() as session:
+        session.add_all([old, recent])
+        await session.commit()
+        session.add(
+            SpO2Series(
+                sleep_record_id=old.id,
+                start_at=old.timestamp,
+                interval_ms=1000,
+                sample_count=3,
+                samples=bytes([97, 90, 97]),
+                odi=2.5,
+                desaturation_count=1,
+                desaturation_events=[{"start": 1, "nadir": 90}],
+            )
+        )
+        await session.commit()
+
+        assert await archive_old_records(session, older_than_days=90) == 1
+
+        hot_ids = (await session.exec(select(SleepRecord.id))).all()
+        assert hot_ids == [recent.id]
+        assert await session.get(SleepRecordArchiveIndex, old.id) is not None
+
+        # La serie de SpO2 se va al archivo junto con su registro
+        assert (await session.exec(select(SpO2Series.sleep_record_id))).all() == []
+        assert await get_spo2_summary(session, old.id) == (2.5, 1)
+        assert await get_spo2_summary(session, recent.id) is None
+
+        # Lectura por id con fallback al archivo mensual
+        fetched = await get_sleep_record(session, old.id)
+        assert fetched is not None
+        assert fetched.payload == {"duration": 1}
+        assert fetched.record_id_provider == "old"
+
+        history = await list_sleep_records(session, user_id)
+        assert [(r.record_id_provider, archived) for r, archived in history] == [
+            ("old", True),
+            ("recent", False),
+        ]
+
+        # Un rango reciente no toca el archivo
+        recent_only = await list_sleep_records(session, user_id, since=now - timedelta(days=30))
+        assert [r.id for r, _ in recent_only] == [recent.id]
+
+    await engine.dispose()
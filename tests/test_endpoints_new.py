@@ -1,7 +1,10 @@
+import json
+
 import pytest
 from httpx import AsyncClient, ASGITransport
 from app.main import app
 from app.config import settings
+from app.database import async_session_maker
 from app.models import SleepRecord
 from datetime import datetime
 from uuid import uuid4
@@ -64,3 +67,45 @@ async def test_ingestion_and_smart_alarm():
             assert "quality_score" in data
             assert "anomalies" in data
             assert data["confidence"] > 0.0
+
+@pytest.mark.asyncio
+async def test_export_streams_ndjson_and_csv():
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            user_id = uuid4()
+            async with async_session_maker() as session:
+                session.add(SleepRecord(
+                    user_id=user_id,
+                    timestamp=datetime(2025, 4, 28, 23, 0),
+                    provider_source="test_provider",
+                    record_id_provider=str(uuid4()),
+                    payload={
+                        "start_at_timestamp": "2025-04-28T23:00:00Z",
+                        "end_at_timestamp": "2025-04-29T07:00:00Z",
+                        "duration": 28800000,
+                        "metrics": {"heartrate": 56, "hrv_sdnn": 60, "spo2_min": 85},
+                    },
+                ))
+                await session.commit()
+
+            response = await ac.get(
+                "/api/v1/sleep/export",
+                params={"user_id": str(user_id), "enrich": "true"},
+                headers={"Accept-Encoding": "gzip"},
+            )
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            rows = [json.loads(line) for line in response.text.splitlines()]
+            assert len(rows) == 1
+            assert rows[0]["quality_score"] > 0
+            assert any("Apnea" in a for a in rows[0]["anomalies"])
+
+            response = await ac.get(
+                "/api/v1/sleep/export",
+                params={"user_id": str(user_id), "format": "csv", "chunk_size": 1},
+            )
+            assert response.status_code == 200
+            lines = response.text.strip().splitlines()
+            assert lines[0].startswith("id,timestamp,provider_source")
+            assert len(lines) == 2
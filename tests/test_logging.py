@@ -0,0 +1,92 @@
+import json
+import logging
+import sys
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.config import settings
+from app.log import JsonFormatter, install_sql_logging
+from app.main import app
+
+PAYLOAD = {
+    "record_id": "3c4a9f0e-8a57-4c47-9d0b-6f7f1bb0a0d1",
+    "modified_at": "2025-04-29T08:00:00Z",
+    "start_at_timestamp": "2025-04-28T23:00:00Z",
+    "end_at_timestamp": "2025-04-29T07:00:00Z",
+    "duration": 28800000,
+    "metrics": {"hrv_sdnn": 55, "sleep_duration_light": 1000, "sleep_duration_rem": 1000},
+    "provider_source": "test_provider",
+    "provider_slug": "test",
+    "source": {"source_version": "1.0", "source_bundle_identifier": "com.test"},
+}
+
+
+def test_json_formatter_keeps_extra_fields_and_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("app.test").makeRecord(
+            "app.test", logging.ERROR, __file__, 1, "Failed %s", ("ingest",), exc_info=sys.exc_info(),
+            extra={"sleep_record_id": "abc", "request_id": "req-1"},
+        )
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Failed ingest"
+    assert entry["level"] == "ERROR"
+    assert entry["request_id"] == "req-1"
+    assert entry["sleep_record_id"] == "abc"
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_failed_statements_do_not_leak_query_timers():
+    from sqlalchemy import create_engine, exc, text
+
+    engine = create_engine("sqlite://")
+    install_sql_logging(engine)
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+        conn.execute(text("SELECT 1"))
+        assert not conn.info.get("query_start")
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_request_ids_correlate_ingest_and_alarm_read(monkeypatch, capsys):
+    # Todas las consultas cuentan como lentas
+    monkeypatch.setattr(settings, "SQL_SLOW_QUERY_MS", 0.0)
+
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post(
+                "/api/v1/webhooks/wearable/", json=PAYLOAD, headers={"X-Request-ID": "ingest-abc"}
+            )
+            assert response.status_code == 200
+            assert response.headers["X-Request-ID"] == "ingest-abc"
+            sleep_record_id = response.json()
+
+            response = await ac.post(
+                "/api/v1/sleep/smart-alarm",
+                json={"sleep_record_id": sleep_record_id, "target_time": "2025-04-29T07:00:00Z"},
+                headers={"X-Request-ID": "bad id with spaces"},
+            )
+            assert response.status_code == 200
+            read_request_id = response.headers["X-Request-ID"]
+            assert read_request_id != "bad id with spaces"
+
+    # El lifespan vacía la cola al terminar
+    entries = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+    ingested = next(e for e in entries if e["message"] == "Ingested sleep record")
+    assert ingested["request_id"] == "ingest-abc"
+    assert ingested["sleep_record_id"] == sleep_record_id
+
+    alarm = next(e for e in entries if e["message"] == "Smart alarm computed")
+    assert alarm["request_id"] == read_request_id
+    assert alarm["ingest_request_id"] == "ingest-abc"
+
+    slow_queries = [e for e in entries if e["logger"] == "app.sql" and e.get("request_id") == "ingest-abc"]
+    assert any(e["statement"].startswith("INSERT INTO sleep_records") for e in slow_queries)
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from app.analysis import load_clean_sleep_data, notify_new_data
+from app.database import async_session_maker
+from app.main import app
+from app.merge import IntervalIndex, fusion_cache
+from app.models import SleepPhase, SleepRecord
+
+START = datetime(2025, 4, 28, 23, 0, tzinfo=timezone.utc)
+END = datetime(2025, 4, 29, 7, 0, tzinfo=timezone.utc)
+
+
+def _at(minutes: int) -> str:
+    return (START + timedelta(minutes=minutes)).isoformat()
+
+
+def test_interval_index_filters_by_overlap_ratio():
+    base = datetime(2025, 4, 28, 23, 0)
+    night, nap, other_night = uuid4(), uuid4(), uuid4()
+    index = IntervalIndex([
+        (base, base + timedelta(hours=8), night),
+        (base + timedelta(hours=7), base + timedelta(hours=9), nap),
+        (base + timedelta(hours=24), base + timedelta(hours=32), other_night),
+    ])
+
+    query_start, query_end = base + timedelta(minutes=30), base + timedelta(hours=8)
+    assert index.overlapping(query_start, query_end) == [night, nap]
+    assert index.overlapping(query_start, query_end, min_ratio=0.6) == [night]
+
+
+@pytest.mark.asyncio
+async def test_watch_and_phone_nights_are_fused_and_cached():
+    async with app.router.lifespan_context(app):
+        user_id = uuid4()
+        watch = SleepRecord(
+            user_id=user_id,
+            timestamp=START.replace(tzinfo=None),
+            provider_source="apple_watch",
+            record_id_provider=str(uuid4()),
+            payload={
+                "start_at_timestamp": START.isoformat(),
+                "end_at_timestamp": _at(450),
+                "duration": 450 * 60 * 1000,
+                "metrics": {"heartrate": 55, "hrv_sdnn": 62},
+                "segments": [
+                    {"start_at": _at(0), "end_at": _at(400), "stage": "asleepCore"},
+                    {"start_at": _at(400), "end_at": _at(450), "stage": "asleepDeep"},
+                ],
+            },
+        )
+        phone = SleepRecord(
+            user_id=user_id,
+            timestamp=(START - timedelta(minutes=20)).replace(tzinfo=None),
+            provider_source="phone_app",
+            record_id_provider=str(uuid4()),
+            payload={
+                "start_at_timestamp": _at(-20),
+                "end_at_timestamp": END.isoformat(),
+                "duration": 500 * 60 * 1000,
+                "metrics": {"sleep_breathing_rate": 14.5, "sleep_duration_awake": 1000},
+            },
+        )
+
+        async with async_session_maker() as session:
+            session.add_all([watch, phone])
+            await session.commit()
+
+            fused = await load_clean_sleep_data(session, phone)
+
+            # Métricas: el reloj es la mejor fuente; el teléfono completa lo que falta
+            assert fused.HRV == 62
+            assert fused.breathing_rate == 14.5
+            assert fused.start_at_timestamp == START - timedelta(minutes=20)
+            assert fused.end_at_timestamp == END
+
+            # Hipnograma: el del reloj manda donde existe; el teléfono cubre los bordes
+            phases = [(seg.start_at, seg.phase) for seg in fused.hypnogram]
+            assert phases[0] == (START - timedelta(minutes=20), SleepPhase.AWAKE)
+            assert (START, SleepPhase.LIGHT) in phases
+            assert (START + timedelta(minutes=400), SleepPhase.DEEP) in phases
+            assert fused.hypnogram[-1].end_at == END
+
+            key = tuple(sorted([watch.id, phone.id]))
+            assert fusion_cache.get(key) is not None
+            notify_new_data(user_id)
+            assert fusion_cache.get(key) is None
+
+
+@pytest.mark.asyncio
+async def test_sources_mixing_naive_and_utc_timestamps_are_fused():
+    async with app.router.lifespan_context(app):
+        user_id = uuid4()
+        watch = SleepRecord(
+            user_id=user_id,
+            timestamp=START.replace(tzinfo=None),
+            provider_source="apple_watch",
+            record_id_provider=str(uuid4()),
+            payload={
+                "start_at_timestamp": START.isoformat(),
+                "end_at_timestamp": _at(450),
+                "duration": 450 * 60 * 1000,
+                "metrics": {"heartrate": 55, "hrv_sdnn": 62},
+                "segments": [{"start_at": _at(0), "end_at": _at(450), "stage": "asleepCore"}],
+            },
+        )
+        # El teléfono envía ISO sin zona (UTC implícito)
+        naive_start = START.replace(tzinfo=None)
+        phone = SleepRecord(
+            user_id=user_id,
+            timestamp=naive_start - timedelta(minutes=20),
+            provider_source="phone_app",
+            record_id_provider=str(uuid4()),
+            payload={
+                "start_at_timestamp": (naive_start - timedelta(minutes=20)).isoformat(),
+                "end_at_timestamp": END.replace(tzinfo=None).isoformat(),
+                "duration": 500 * 60 * 1000,
+                "metrics": {"sleep_breathing_rate": 14.5, "sleep_duration_awake": 1000},
+                "segments": [
+                    {
+                        "start_at": (naive_start + timedelta(minutes=450)).isoformat(),
+                        "end_at": END.replace(tzinfo=None).isoformat(),
+                        "stage": "awake",
+                    },
+                ],
+            },
+        )
+
+        async with async_session_maker() as session:
+            session.add_all([watch, phone])
+            await session.commit()
+
+            fused = await load_clean_sleep_data(session, phone)
+
+        assert fused.start_at_timestamp == START - timedelta(minutes=20)
+        assert fused.end_at_timestamp == END
+        assert fused.hypnogram[-1].phase == SleepPhase.AWAKE
+        assert fused.hypnogram[-1].end_at == END
@@ -0,0 +1,154 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.migrations import (
+    MIGRATIONS,
+    get_pending_migrations,
+    schema_version_table,
+    upgrade,
+    version_metadata,
+)
+from app.models import SleepRecord
+
+
+@pytest.mark.asyncio
+async def test_upgrade_fresh_database_reaches_head(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fresh.db'}")
+    assert len(await get_pending_migrations(engine)) == len(MIGRATIONS)
+
+    # Una base vacía aplica también los pasos pesados (son baratos)
+    assert await upgrade(engine, include_heavy=False) == []
+    assert await get_pending_migrations(engine) == []
+
+    async with engine.connect() as conn:
+        indexes = await conn.run_sync(
+            lambda c: {ix["name"] for ix in inspect(c).get_indexes("sleep_records")}
+        )
+    assert "ix_sleep_records_user_id_timestamp" in indexes
+
+    # Idempotente
+    assert await upgrade(engine) == []
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_heavy_steps_deferred_on_existing_database(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'existing.db'}")
+    first_heavy = next(m for m in MIGRATIONS if m.heavy)
+
+    # Simula una base ya en producción justo antes del primer paso pesado
+    async with engine.begin() as conn:
+        await conn.run_sync(version_metadata.create_all)
+        for migration in MIGRATIONS:
+            if migration.version >= first_heavy.version:
+                break
+            await conn.run_sync(migration.upgrade)
+            await conn.execute(
+                schema_version_table.insert().values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+        await conn.execute(
+            SleepRecord.__table__.insert().values(
+                id=uuid4(),
+                user_id=uuid4(),
+                timestamp=datetime.utcnow(),
+                provider_source="apple_health",
+                record_id_provider="existing-1",
+                payload={},
+                created_at=datetime.utcnow(),
+            )
+        )
+
+    # Los pasos ligeros posteriores se aplican; los pesados quedan pendientes
+    pending = await upgrade(engine, include_heavy=False)
+    assert pending and all(m.heavy for m in pending)
+    assert await get_pending_migrations(engine) == pending
+
+    assert await upgrade(engine, include_heavy=True) == []
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_legacy_create_all_database_defers_heavy_steps(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.db'}")
+
+    # Base creada por el antiguo create_all: con datos y sin schema_version
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda c: SleepRecord.__table__.create(c))
+        await conn.execute(
+            SleepRecord.__table__.insert().values(
+                id=uuid4(),
+                user_id=uuid4(),
+                timestamp=datetime.utcnow(),
+                provider_source="apple_health",
+                record_id_provider="legacy-1",
+                payload={},
+                created_at=datetime.utcnow(),
+            )
+        )
+
+    pending = await upgrade(engine, include_heavy=False)
+    assert pending and all(m.heavy for m in pending)
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_upgrades_apply_each_step_once(tmp_path):
+    url = f"sqlite+aiosqlite:///{tmp_path / 'race.db'}"
+    engines = [create_async_engine(url) for _ in range(4)]
+
+    # Varios workers arrancando a la vez contra una base nueva
+    results = await asyncio.gather(*(upgrade(engine, include_heavy=False) for engine in engines))
+    assert results == [[]] * len(engines)
+
+    async with engines[0].connect() as conn:
+        versions = (await conn.execute(select(schema_version_table.c.version))).scalars().all()
+        indexes = await conn.run_sync(
+            lambda c: {ix["name"] for ix in inspect(c).get_indexes("sleep_records")}
+        )
+    assert sorted(versions) == [m.version for m in MIGRATIONS]
+    assert "ix_sleep_records_user_id_timestamp" in indexes
+    for engine in engines:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_init_db_ignores_deferred_heavy_steps_and_fails_without_auto_migrate(tmp_path, monkeypatch):
+    from app import database, migrations
+    from app.config import settings
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'boot.db'}")
+    await upgrade(engine)
+    monkeypatch.setattr(database, "engine", engine)
+
+    async def forbidden_upgrade(*args, **kwargs):
+        raise AssertionError("upgrade() must not run on every boot")
+
+    monkeypatch.setattr(migrations, "upgrade", forbidden_upgrade)
+
+    # Solo queda un paso pesado diferido: el arranque no toma el lock de migración
+    heavy = next(m for m in MIGRATIONS if m.heavy)
+    async with engine.begin() as conn:
+        await conn.execute(
+            schema_version_table.delete().where(schema_version_table.c.version == heavy.version)
+        )
+    await database.init_db()
+
+    # Un paso ligero pendiente sin DB_AUTO_MIGRATE hace fallar el arranque
+    light = next(m for m in reversed(MIGRATIONS) if not m.heavy)
+    async with engine.begin() as conn:
+        await conn.execute(
+            schema_version_table.delete().where(schema_version_table.c.version == light.version)
+        )
+    monkeypatch.setattr(settings, "DB_AUTO_MIGRATE", False)
+    with pytest.raises(RuntimeError, match=str(light.version)):
+        await database.init_db()
+    await engine.dispose()
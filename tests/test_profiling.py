@@ -0,0 +1,62 @@
+from uuid import uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.config import settings
+from app.database import async_session_maker
+from app.main import app
+from app.models import SleepRecord
+
+
+@pytest.mark.asyncio
+async def test_smart_alarm_profile_written_and_rotated(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "PROFILING_TOKEN", "s3cret")
+    monkeypatch.setattr(settings, "PROFILING_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PROFILING_MAX_FILES", 2)
+
+    async with app.router.lifespan_context(app):
+        async with async_session_maker() as session:
+            record = SleepRecord(
+                user_id=uuid4(),
+                provider_source="test_provider",
+                record_id_provider=str(uuid4()),
+                payload={
+                    "start_at_timestamp": "2025-04-28T23:00:00Z",
+                    "end_at_timestamp": "2025-04-29T07:00:00Z",
+                    "duration": 28800000,
+                    "metrics": {"hrv_sdnn": 55, "sleep_duration_light": 1000, "sleep_duration_rem": 1000},
+                },
+            )
+            session.add(record)
+            await session.commit()
+
+        request = {"sleep_record_id": str(record.id), "target_time": "2025-04-29T07:00:00Z"}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            # Sin cabecera o con un token incorrecto no se perfila
+            response = await ac.post("/api/v1/sleep/smart-alarm", json=request)
+            assert response.status_code == 200
+            response = await ac.post(
+                "/api/v1/sleep/smart-alarm", json=request, headers={"X-Profile-Token": "wrong"}
+            )
+            assert "X-Profile-File" not in response.headers
+            assert list(tmp_path.iterdir()) == []
+
+            names = []
+            for _ in range(3):
+                response = await ac.post(
+                    "/api/v1/sleep/smart-alarm", json=request, headers={"X-Profile-Token": "s3cret"}
+                )
+                assert response.status_code == 200
+                names.append(response.headers["X-Profile-File"])
+
+    # Rotación: solo los dos perfiles más recientes
+    assert sorted(path.name for path in tmp_path.iterdir()) == names[1:]
+
+    folded = (tmp_path / names[-1]).read_text()
+    for line in folded.splitlines():
+        _, weight = line.rsplit(" ", 1)
+        assert int(weight) > 0
+    assert "app.logic:parse_sleep_payload" in folded
+    assert "app.logic:predict_optimal_wakeup" in folded
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import app.analysis as analysis
+import app.logic as logic
+from app.config import settings
+from app.database import async_session_maker
+from app.main import app
+from app.models import SleepRecord
+from app.scheduler import alarm_scheduler, prediction_store
+
+
+def _night_payload(start_at: datetime, end_at: datetime) -> dict:
+    return {
+        "start_at_timestamp": start_at.isoformat() + "Z",
+        "end_at_timestamp": end_at.isoformat() + "Z",
+        "duration": int((end_at - start_at).total_seconds() * 1000),
+        "metrics": {
+            "hrv_sdnn": 60,
+            "sleep_duration_deep": 3600000,
+            "sleep_duration_light": 3600000,
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_precomputed_prediction_is_served_and_invalidated(monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_ENABLED", False)
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            now = datetime.utcnow().replace(microsecond=0)
+            target_time = now + timedelta(minutes=20)
+            user_id = uuid4()
+
+            async with async_session_maker() as session:
+                record = SleepRecord(
+                    user_id=user_id,
+                    timestamp=now - timedelta(hours=7),
+                    provider_source="test_provider",
+                    record_id_provider=str(uuid4()),
+                    payload=_night_payload(now - timedelta(hours=7), target_time),
+                )
+                session.add(record)
+                await session.commit()
+
+            response = await ac.post(
+                "/api/v1/sleep/alarms",
+                json={"user_id": str(user_id), "target_time": target_time.isoformat()},
+            )
+            assert response.status_code == 201
+            schedule_id = response.json()["id"]
+
+            # Antes del precálculo se responde en vivo
+            response = await ac.get(f"/api/v1/sleep/alarms/{schedule_id}/prediction")
+            assert response.status_code == 200
+            assert response.json()["precomputed"] is False
+
+            assert await alarm_scheduler.tick(now) >= 1
+            response = await ac.get(f"/api/v1/sleep/alarms/{schedule_id}/prediction")
+            assert response.status_code == 200
+            data = response.json()
+            assert data["precomputed"] is True
+            assert data["sleep_record_id"] == str(record.id)
+
+            # Nuevos datos del usuario invalidan la predicción hasta el siguiente tick
+            alarm_scheduler.notify_new_data(user_id)
+            assert prediction_store.get(UUID(schedule_id)) is None
+            response = await ac.get(f"/api/v1/sleep/alarms/{schedule_id}/prediction")
+            assert response.json()["precomputed"] is False
+
+            await alarm_scheduler.tick(now)
+            response = await ac.get(f"/api/v1/sleep/alarms/{schedule_id}/prediction")
+            assert response.json()["precomputed"] is True
+
+            # Si el recálculo falla no se vuelve a servir la predicción anterior
+            async def broken_analysis(*args, **kwargs):
+                raise logic.DataParsingError("payload corrupto")
+
+            monkeypatch.setattr(analysis, "analyze_sleep_record", broken_analysis)
+            alarm_scheduler.notify_new_data(user_id)
+            assert await alarm_scheduler.tick(now) == 0
+            assert prediction_store.get(UUID(schedule_id)) is None
+
+
+@pytest.mark.asyncio
+async def test_failing_alarm_does_not_starve_later_ones(monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_ENABLED", False)
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            now = datetime.utcnow().replace(microsecond=0)
+            broken_user, healthy_user = uuid4(), uuid4()
+            schedule_ids = {}
+            async with async_session_maker() as session:
+                for offset, user_id in ((10, broken_user), (20, healthy_user)):
+                    target_time = now + timedelta(minutes=offset)
+                    session.add(
+                        SleepRecord(
+                            user_id=user_id,
+                            timestamp=now - timedelta(hours=7),
+                            provider_source="test_provider",
+                            record_id_provider=str(uuid4()),
+                            payload=_night_payload(now - timedelta(hours=7), target_time),
+                        )
+                    )
+                await session.commit()
+            for offset, user_id in ((10, broken_user), (20, healthy_user)):
+                response = await ac.post(
+                    "/api/v1/sleep/alarms",
+                    json={"user_id": str(user_id), "target_time": (now + timedelta(minutes=offset)).isoformat()},
+                )
+                schedule_ids[user_id] = UUID(response.json()["id"])
+
+            original_analysis = analysis.analyze_sleep_record
+
+            # Un error inesperado en la primera alarma (por orden de hora) no aborta el tick
+            async def flaky_analysis(session, record, target_time):
+                if record.user_id == broken_user:
+                    raise TypeError("can't compare offset-naive and offset-aware datetimes")
+                return await original_analysis(session, record, target_time)
+
+            monkeypatch.setattr(analysis, "analyze_sleep_record", flaky_analysis)
+            prediction_store.clear()
+            await alarm_scheduler.tick(now)
+            assert prediction_store.get(schedule_ids[broken_user]) is None
+            assert prediction_store.get(schedule_ids[healthy_user]) is not None
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.logic as logic
+from app.models import SleepPhase
+
+START = datetime(2025, 4, 28, 23, 0, tzinfo=timezone.utc)
+END = datetime(2025, 4, 29, 7, 0, tzinfo=timezone.utc)
+
+
+def _at(minutes: int) -> str:
+    return (START + timedelta(minutes=minutes)).isoformat()
+
+
+def _payload(segments):
+    return {
+        "start_at_timestamp": START.isoformat(),
+        "end_at_timestamp": END.isoformat(),
+        "duration": 8 * 3600 * 1000,
+        "metrics": {},
+        "segments": segments,
+    }
+
+
+def _phases(hypnogram):
+    return [
+        (int((seg.start_at - START).total_seconds() // 60), int((seg.end_at - START).total_seconds() // 60), seg.phase)
+        for seg in hypnogram
+    ]
+
+
+def test_native_segments_are_sorted_clipped_and_merged():
+    segments = [
+        # Desordenados, con un segmento que empieza antes de la noche
+        {"start_at": _at(60), "end_at": _at(90), "stage": "asleepCore"},
+        {"start_at": _at(-30), "end_at": _at(30), "stage": "asleepCore"},
+        {"start_at": _at(30), "end_at": _at(60), "stage": "HKCategoryValueSleepAnalysisAsleepCore"},
+        {"start_at": _at(90), "end_at": _at(120), "stage": "asleepDeep"},
+        # inBed cubre toda la noche y se ignora
+        {"start_at": _at(0), "end_at": _at(480), "stage": "inBed"},
+    ]
+    data = logic.parse_sleep_payload(_payload(segments))
+
+    assert _phases(data.hypnogram) == [
+        (0, 90, SleepPhase.LIGHT),
+        (90, 120, SleepPhase.DEEP),
+    ]
+    assert data.sleep_duration_light == 90 * 60 * 1000
+    assert data.sleep_duration_deep == 30 * 60 * 1000
+
+
+def test_overlaps_resolved_by_priority():
+    segments = [
+        {"start_at": _at(0), "end_at": _at(120), "stage": "asleepUnspecified"},
+        {"start_at": _at(30), "end_at": _at(60), "stage": "asleepREM"},
+        {"start_at": _at(45), "end_at": _at(50), "stage": "awake"},
+        {"start_at": _at(100), "end_at": _at(500), "stage": "asleepDeep"},
+    ]
+    data = logic.parse_sleep_payload(_payload(segments))
+
+    assert _phases(data.hypnogram) == [
+        (0, 30, SleepPhase.LIGHT),
+        (30, 45, SleepPhase.REM),
+        (45, 50, SleepPhase.AWAKE),
+        (50, 60, SleepPhase.REM),
+        (60, 100, SleepPhase.LIGHT),
+        (100, 480, SleepPhase.DEEP),
+    ]
+    # Hipnograma mínimo y sin solapes
+    for previous, current in zip(data.hypnogram, data.hypnogram[1:]):
+        assert previous.end_at <= current.start_at
+        assert previous.phase != current.phase or previous.end_at != current.start_at
+
+
+def test_unknown_stage_raises_parsing_error():
+    with pytest.raises(logic.DataParsingError):
+        logic.parse_sleep_payload(_payload([{"start_at": _at(0), "end_at": _at(10), "stage": "dreaming"}]))
+
+
+def test_without_segments_falls_back_to_phase_durations():
+    payload = _payload(None)
+    payload["metrics"] = {"sleep_duration_deep": 1000, "sleep_duration_light": 1000}
+    data = logic.parse_sleep_payload(payload)
+    assert [seg.phase for seg in data.hypnogram] == [SleepPhase.DEEP, SleepPhase.LIGHT]
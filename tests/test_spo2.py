@@ -0,0 +1,118 @@
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import app.logic as logic
+from app.database import async_session_maker
+from app.main import app
+from app.models import CleanSleepData, SleepRecord
+from app.routers.wearable import MAX_SERIES_SAMPLES
+
+
+def _series_with_dips(dips: int, baseline: int = 97, dip: int = 92, dip_seconds: int = 20) -> bytes:
+    samples = bytearray([baseline] * 300)
+    for _ in range(dips):
+        samples += bytes([dip] * dip_seconds)
+        samples += bytes([baseline] * 120)
+    return bytes(samples)
+
+
+def test_detect_desaturations_counts_events_and_odi():
+    samples = _series_with_dips(10)
+    summary = logic.detect_desaturations(samples, interval_ms=1000)
+
+    assert len(summary.events) == 10
+    assert summary.events[0].start_offset_s == 300
+    assert summary.events[0].duration_s == 20
+    assert summary.events[0].nadir == 92
+    assert summary.odi == pytest.approx(10 / (len(samples) / 3600), rel=1e-2)
+
+
+def test_detect_desaturations_ignores_short_dips_and_invalid_samples():
+    # Caídas de 5 s (< 10 s) y muestras inválidas (0) no son eventos
+    samples = _series_with_dips(5, dip_seconds=5) + bytes([0] * 600)
+    summary = logic.detect_desaturations(samples, interval_ms=1000)
+
+    assert summary.events == []
+    assert summary.valid_hours == pytest.approx((len(samples) - 600) / 3600, rel=1e-2)
+
+
+def test_detect_desaturations_closes_event_open_at_end_of_series():
+    summary = logic.detect_desaturations(bytes([97] * 200 + [85] * 60), interval_ms=1000)
+
+    assert len(summary.events) == 1
+    assert summary.events[0].start_offset_s == 200
+    assert summary.events[0].duration_s == 60
+    assert summary.events[0].nadir == 85
+
+
+def test_anomalies_use_odi_when_available():
+    data = CleanSleepData(
+        start_at_timestamp=datetime(2025, 4, 28, 23, 0),
+        end_at_timestamp=datetime(2025, 4, 29, 7, 0),
+        duration=8 * 3600 * 1000,
+        SpO2_min=85,
+        ODI=2.0,
+        desaturation_count=16,
+    )
+    assert not any("Apnea" in a for a in logic.detect_sleep_anomalies(data))
+
+    data.ODI = 20.0
+    anomalies = logic.detect_sleep_anomalies(data)
+    assert any("Apnea moderada" in a for a in anomalies)
+
+
+@pytest.mark.asyncio
+async def test_ingest_spo2_series_feeds_smart_alarm():
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            async with async_session_maker() as session:
+                record = SleepRecord(
+                    user_id=uuid4(),
+                    timestamp=datetime(2025, 4, 28, 23, 0),
+                    provider_source="test_provider",
+                    record_id_provider=str(uuid4()),
+                    payload={
+                        "start_at_timestamp": "2025-04-28T23:00:00Z",
+                        "end_at_timestamp": "2025-04-29T07:00:00Z",
+                        "duration": 28800000,
+                        "metrics": {"spo2_min": 97},
+                    },
+                )
+                session.add(record)
+                await session.commit()
+
+            samples = _series_with_dips(40)
+            response = await ac.post(
+                f"/api/v1/webhooks/wearable/{record.id}/spo2",
+                params={"start_at": "2025-04-28T23:00:00Z", "provider_slug": "test"},
+                content=samples,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            assert response.status_code == 200
+            assert response.json()["sample_count"] == len(samples)
+            assert len(response.json()["events"]) == 40
+
+            response = await ac.post(
+                "/api/v1/sleep/smart-alarm",
+                json={"sleep_record_id": str(record.id), "target_time": "2025-04-29T07:00:00Z"},
+            )
+            assert response.status_code == 200
+            assert any("ODI" in a for a in response.json()["anomalies"])
+
+
+@pytest.mark.asyncio
+async def test_oversized_spo2_series_is_rejected_before_processing():
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post(
+                f"/api/v1/webhooks/wearable/{uuid4()}/spo2",
+                params={"start_at": "2025-04-28T23:00:00Z", "provider_slug": "test"},
+                content=bytes([97]) * (MAX_SERIES_SAMPLES + 1),
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            assert response.status_code == 413
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import app.database as database
+from app.config import settings
+from app.main import app
+
+
+@pytest.mark.asyncio
+async def test_liveness_before_readiness_in_background_startup(monkeypatch):
+    monkeypatch.setattr(settings, "STARTUP_BACKGROUND", True)
+    release_db = asyncio.Event()
+    original_init_db = database.init_db
+
+    async def slow_init_db():
+        await release_db.wait()
+        await original_init_db()
+
+    monkeypatch.setattr(database, "init_db", slow_init_db)
+
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            assert (await ac.get("/health")).status_code == 200
+            response = await ac.get("/ready")
+            assert response.status_code == 503
+            assert response.json()["status"] == "starting"
+
+            # Las peticiones a la API esperan al arranque en lugar de fallar
+            history = asyncio.create_task(
+                ac.get("/api/v1/sleep/history", params={"user_id": "00000000-0000-0000-0000-000000000001"})
+            )
+            await asyncio.sleep(0.05)
+            assert not history.done()
+
+            release_db.set()
+            assert (await history).status_code == 200
+
+            response = await ac.get("/ready")
+            assert response.status_code == 200
+            assert set(response.json()["startup_ms"]) == {"import_routers", "init_db", "services", "total"}
+
+
+@pytest.mark.asyncio
+async def test_failed_startup_is_not_ready(monkeypatch):
+    monkeypatch.setattr(settings, "STARTUP_BACKGROUND", True)
+
+    async def broken_init_db():
+        raise RuntimeError("database unreachable")
+
+    monkeypatch.setattr(database, "init_db", broken_init_db)
+
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            assert (await ac.get("/health")).status_code == 200
+            response = await ac.get("/api/v1/sleep/history", params={"user_id": "00000000-0000-0000-0000-000000000001"})
+            assert response.status_code == 503
+            response = await ac.get("/ready")
+            assert response.status_code == 503
+            assert response.json() == {
+                "status": "failed",
+                "error": "database unreachable",
+                "startup_ms": {"import_routers": response.json()["startup_ms"]["import_routers"]},
+            }
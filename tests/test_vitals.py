@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import app.logic as logic
+from app.config import settings
+from app.database import async_session_maker
+from app.main import app
+from app.models import SleepRecord, VitalMetric, VitalRollup
+from app.vitals import get_rollups
+
+
+@pytest.mark.asyncio
+async def test_vitals_rollups_and_alarm_window():
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            user_id = uuid4()
+            # Fechas recientes: las muestras crudas fuera de la retención se purgan
+            now = datetime.utcnow()
+            target_time = now.replace(minute=now.minute - now.minute % 5, second=0, microsecond=0)
+            night_start = target_time - timedelta(hours=8)
+
+            # HRV alto toda la noche salvo los últimos 30 min (estrés)
+            minutes = int((target_time - night_start).total_seconds() // 60)
+            values = [70.0] * (minutes - 30) + [30.0] * 30
+            series = {
+                "user_id": str(user_id),
+                "provider_slug": "test",
+                "metric": "hrv_sdnn",
+                "start_at": night_start.isoformat() + "Z",
+                "interval_seconds": 60,
+                "values": values,
+            }
+            response = await ac.post("/api/v1/webhooks/wearable/vitals", json=series)
+            assert response.status_code == 200
+            assert response.json() == {"inserted": minutes, "duplicates": 0}
+
+            # Reintento del proveedor: no duplica las agregaciones
+            response = await ac.post("/api/v1/webhooks/wearable/vitals", json=series)
+            assert response.json() == {"inserted": 0, "duplicates": minutes}
+
+            async with async_session_maker() as session:
+                five_min = await get_rollups(
+                    session, user_id, VitalMetric.HRV, night_start, target_time, resolution_s=300
+                )
+                assert len(five_min) == minutes // 5
+                assert all(bucket.count == 5 for bucket in five_min)
+                assert logic.rollup_mean(five_min) == pytest.approx(sum(values) / len(values))
+
+                record = SleepRecord(
+                    user_id=user_id,
+                    timestamp=night_start,
+                    provider_source="test_provider",
+                    record_id_provider=str(uuid4()),
+                    payload={
+                        "start_at_timestamp": night_start.isoformat() + "Z",
+                        "end_at_timestamp": target_time.isoformat() + "Z",
+                        "duration": 28800000,
+                        "metrics": {"hrv_sdnn": 68, "sleep_duration_light": 1000},
+                    },
+                )
+                session.add(record)
+                await session.commit()
+
+            # El HRV de la ventana (30 ms) manda sobre la media nocturna (68 ms)
+            response = await ac.post(
+                "/api/v1/sleep/smart-alarm",
+                json={"sleep_record_id": str(record.id), "target_time": target_time.isoformat() + "Z"},
+            )
+            assert response.status_code == 200
+            assert "HRV bajo" in response.json()["reasoning"]
+            window_start = target_time - timedelta(minutes=30)
+            assert response.json()["suggested_time"].startswith(window_start.isoformat()[:16])
+
+
+@pytest.mark.asyncio
+async def test_late_vitals_are_stored_once_and_minute_rollups_expire():
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            user_id = uuid4()
+            now = datetime.utcnow().replace(second=0, microsecond=0)
+            expired_minute = now - timedelta(days=settings.VITALS_MINUTE_ROLLUP_RETENTION_DAYS + 5)
+
+            # Agregación por minuto ya caducada: se purga en la siguiente ingesta
+            async with async_session_maker() as session:
+                session.add(
+                    VitalRollup(
+                        user_id=user_id,
+                        metric=VitalMetric.HRV,
+                        resolution_s=60,
+                        bucket_start=expired_minute,
+                        total=60.0,
+                        count=1,
+                        min_value=60.0,
+                        max_value=60.0,
+                    )
+                )
+                await session.commit()
+
+            # Dispositivo que sincroniza pasada la retención de crudos
+            late_start = now - timedelta(days=settings.VITALS_RAW_RETENTION_DAYS + 3)
+            late_start -= timedelta(minutes=late_start.minute % 5)
+            series = {
+                "user_id": str(user_id),
+                "provider_slug": "test",
+                "metric": "hrv_sdnn",
+                "start_at": late_start.isoformat() + "Z",
+                "interval_seconds": 60,
+                "values": [60.0] * 10,
+            }
+            response = await ac.post("/api/v1/webhooks/wearable/vitals", json=series)
+            assert response.json() == {"inserted": 10, "duplicates": 0}
+
+            # Su reintento se reconoce aunque no haya muestras crudas
+            response = await ac.post("/api/v1/webhooks/wearable/vitals", json=series)
+            assert response.json() == {"inserted": 0, "duplicates": 10}
+
+            # Más antigua que la retención por minuto: solo agregaciones de 5 min
+            very_late = {**series, "start_at": (expired_minute - timedelta(days=1)).isoformat() + "Z", "values": [50.0] * 5}
+            response = await ac.post("/api/v1/webhooks/wearable/vitals", json=very_late)
+            assert response.json() == {"inserted": 5, "duplicates": 0}
+
+            async with async_session_maker() as session:
+                late_end = late_start + timedelta(minutes=10)
+                five_min = await get_rollups(session, user_id, VitalMetric.HRV, late_start, late_end, resolution_s=300)
+                assert [bucket.count for bucket in five_min] == [5, 5]
+                one_min = await get_rollups(session, user_id, VitalMetric.HRV, late_start, late_end, resolution_s=60)
+                assert len(one_min) == 10
+
+                very_late_start = expired_minute - timedelta(days=1)
+                window_end = expired_minute + timedelta(minutes=1)
+                assert await get_rollups(
+                    session, user_id, VitalMetric.HRV, very_late_start, window_end, resolution_s=60
+                ) == []
+                five_min = await get_rollups(
+                    session, user_id, VitalMetric.HRV, very_late_start, window_end, resolution_s=300
+                )
+                assert sum(bucket.count for bucket in five_min) == 5
@@ -0,0 +1,249 @@
+import asyncio
+import signal
+import time
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app import serve
+from app.archive import get_sleep_record
+from app.config import settings
+from app.database import async_session_maker
+from app.main import app
+from app.models import SleepRecord, SmartAlarmResponse
+from app.scheduler import StoredPrediction, alarm_scheduler, prediction_store
+from app.writer import IngestWriter
+
+
+def _payload():
+    return {
+        "record_id": str(uuid4()),
+        "modified_at": "2025-04-29T08:00:00Z",
+        "start_at_timestamp": "2025-04-28T23:00:00Z",
+        "end_at_timestamp": "2025-04-29T07:00:00Z",
+        "duration": 28800000,
+        "metrics": {"hrv_sdnn": 55, "sleep_duration_light": 1000},
+        "provider_source": "test_provider",
+        "provider_slug": "test",
+        "source": {"source_version": "1.0", "source_bundle_identifier": "com.test"},
+    }
+
+
+@pytest.mark.asyncio
+async def test_ingestion_forwarded_to_writer_in_batches(monkeypatch, tmp_path):
+    address = str(tmp_path / "writer.sock")
+    monkeypatch.setattr(settings, "INGEST_WRITER_ADDRESS", address)
+
+    writer = IngestWriter(max_delay_ms=50)
+    await writer.start(address)
+    try:
+        async with app.router.lifespan_context(app):
+            transport = ASGITransport(app=app)
+            async with AsyncClient(transport=transport, base_url="http://test") as ac:
+                responses = await asyncio.gather(
+                    *[ac.post("/api/v1/webhooks/wearable/", json=_payload()) for _ in range(10)]
+                )
+                assert [r.status_code for r in responses] == [200] * 10
+
+                # Un solo proceso escribe, agrupando los commits
+                assert writer.batches_committed < 10
+                async with async_session_maker() as session:
+                    for response in responses:
+                        assert await get_sleep_record(session, UUID(response.json())) is not None
+
+                series = {
+                    "user_id": str(uuid4()),
+                    "provider_slug": "test",
+                    "metric": "heartrate",
+                    "start_at": (datetime.utcnow() - timedelta(hours=1)).isoformat() + "Z",
+                    "values": [55.0, 56.0, None],
+                }
+                response = await ac.post("/api/v1/webhooks/wearable/vitals", json=series)
+                assert response.json()["inserted"] == 2
+    finally:
+        await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_unreachable_writer_returns_503(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "INGEST_WRITER_ADDRESS", str(tmp_path / "missing.sock"))
+    monkeypatch.setattr(settings, "INGEST_WRITER_TIMEOUT_SECONDS", 0.2)
+
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post("/api/v1/webhooks/wearable/", json=_payload())
+            assert response.status_code == 503
+            assert "Retry-After" in response.headers
+
+            # Sin writer la réplica no está lista para recibir ingestas
+            response = await ac.get("/ready")
+            assert response.status_code == 503
+            assert response.json()["status"] == "unavailable"
+
+
+@pytest.mark.asyncio
+async def test_writer_publishes_predictions_to_workers(monkeypatch, tmp_path):
+    address = str(tmp_path / "writer.sock")
+    monkeypatch.setattr(settings, "INGEST_WRITER_ADDRESS", address)
+    prediction_store.clear()
+    now = datetime.utcnow().replace(microsecond=0)
+    prediction = StoredPrediction(
+        schedule_id=uuid4(),
+        user_id=uuid4(),
+        target_time=now + timedelta(minutes=20),
+        sleep_record_id=uuid4(),
+        computed_at=now,
+        response=SmartAlarmResponse(
+            suggested_time=now + timedelta(minutes=5),
+            confidence=0.8,
+            reasoning="Fase ligera",
+            quality_score=80.0,
+        ),
+    )
+
+    writer = IngestWriter()
+    await writer.start(address)
+    try:
+        async with app.router.lifespan_context(app):
+            transport = ASGITransport(app=app)
+            async with AsyncClient(transport=transport, base_url="http://test") as ac:
+                # Lista en cuanto conecta con el writer
+                for _ in range(100):
+                    if (await ac.get("/ready")).status_code == 200:
+                        break
+                    await asyncio.sleep(0.01)
+                assert (await ac.get("/ready")).status_code == 200
+                # Con writer el planificador no corre en los workers
+                assert alarm_scheduler._task is None
+
+                await writer.publish_prediction(prediction)
+                for _ in range(100):
+                    if prediction_store.get(prediction.schedule_id) is not None:
+                        break
+                    await asyncio.sleep(0.01)
+                assert prediction_store.get(prediction.schedule_id) == prediction
+    finally:
+        await writer.stop()
+        prediction_store.clear()
+
+
+class _FakeProcess:
+    def __init__(self, alive: bool):
+        self.alive = alive
+        self.exitcode = None if alive else 1
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+    def join(self, timeout=None):
+        pass
+
+
+def test_supervisor_restarts_writer_then_gives_up(monkeypatch):
+    monkeypatch.setattr(serve, "_WRITER_CHECK_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(serve, "_start_writer", lambda address: _FakeProcess(alive=True))
+    supervisor = serve._WriterSupervisor("writer.sock", _FakeProcess(alive=False))
+    supervisor.start()
+    for _ in range(100):
+        if supervisor.process.is_alive():
+            break
+        time.sleep(0.01)
+    supervisor.stop()
+    assert not supervisor.gave_up and supervisor._restarts
+
+    # Un writer que muere en bucle detiene el launcher
+    killed = []
+    monkeypatch.setattr(serve, "_start_writer", lambda address: _FakeProcess(alive=False))
+    monkeypatch.setattr(serve.os, "kill", lambda pid, signum: killed.append(signum))
+    supervisor = serve._WriterSupervisor("writer.sock", _FakeProcess(alive=False))
+    supervisor.start()
+    supervisor._thread.join(timeout=5)
+    assert supervisor.gave_up
+    assert killed == [signal.SIGTERM]
+
+
+@pytest.mark.asyncio
+async def test_writer_process_recomputes_predictions_after_new_data(monkeypatch, tmp_path):
+    # Writer en su propio proceso: su planificador y su caché no son los del worker
+    address = str(tmp_path / "writer.sock")
+    monkeypatch.setattr(settings, "INGEST_WRITER_ADDRESS", address)
+    prediction_store.clear()
+    now = datetime.utcnow().replace(microsecond=0)
+    target_time = now + timedelta(minutes=20)
+    night_start = now - timedelta(hours=7)
+    user_id = uuid4()
+
+    async def wait_for(condition):
+        for _ in range(500):
+            if await condition():
+                return True
+            await asyncio.sleep(0.02)
+        return False
+
+    async with app.router.lifespan_context(app):
+        process = await asyncio.to_thread(serve._start_writer, address)
+        try:
+            transport = ASGITransport(app=app)
+            async with AsyncClient(transport=transport, base_url="http://test") as ac:
+                assert await wait_for(lambda: _is_ready(ac))
+
+                async with async_session_maker() as session:
+                    record = SleepRecord(
+                        user_id=user_id,
+                        timestamp=night_start,
+                        provider_source="test_provider",
+                        record_id_provider=str(uuid4()),
+                        payload={
+                            "start_at_timestamp": night_start.isoformat() + "Z",
+                            "end_at_timestamp": target_time.isoformat() + "Z",
+                            "duration": int((target_time - night_start).total_seconds() * 1000),
+                            "metrics": {"hrv_sdnn": 60, "sleep_duration_light": 3600000},
+                        },
+                    )
+                    session.add(record)
+                    await session.commit()
+
+                # Alarma dentro del margen: el worker despierta al planificador del writer
+                response = await ac.post(
+                    "/api/v1/sleep/alarms",
+                    json={"user_id": str(user_id), "target_time": target_time.isoformat()},
+                )
+                schedule_id = UUID(response.json()["id"])
+
+                async def precomputed():
+                    return prediction_store.get(schedule_id) is not None
+
+                assert await wait_for(precomputed)
+                first = prediction_store.get(schedule_id)
+                assert not any("ODI" in a for a in first.response.anomalies)
+
+                # Nuevos datos vía writer: invalida su caché y recalcula con el ODI
+                samples = bytes([97] * 300 + ([92] * 20 + [97] * 120) * 40)
+                response = await ac.post(
+                    f"/api/v1/webhooks/wearable/{record.id}/spo2",
+                    params={"start_at": night_start.isoformat() + "Z", "provider_slug": "test"},
+                    content=samples,
+                    headers={"Content-Type": "application/octet-stream"},
+                )
+                assert response.status_code == 200
+
+                async def recomputed():
+                    current = prediction_store.get(schedule_id)
+                    return current is not None and current is not first
+
+                assert await wait_for(recomputed)
+                assert any("ODI" in a for a in prediction_store.get(schedule_id).response.anomalies)
+        finally:
+            process.terminate()
+            await asyncio.to_thread(process.join, 10)
+            prediction_store.clear()
+
+
+async def _is_ready(ac: AsyncClient) -> bool:
+    return (await ac.get("/ready")).status_code == 200